@@ -1,3 +1,5 @@
+// Record hashes are 8-byte fingerprints (see migrate_record_fingerprints.py
+// for Records with older md5 hashes).
 // We only care about the hashes, and we only care about the hashes which are
 // not null, but we cannot exclude _id in the index, partialFilterExpression
 // cannot be used with sparse, and cannot filter on $ne: null, so this will
@@ -13,3 +15,9 @@ db.records.createIndex(
     },
   }
 );
+
+// The Copier checks for existing Files by partner and file name
+db.files.createIndex({ partnerId: 1, name: 1 });
+
+// The Copier checks for re-delivered files by partner and content hash
+db.files.createIndex({ partnerId: 1, hash: 1 });
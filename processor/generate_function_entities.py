@@ -206,6 +206,7 @@ def get_callables(args: argparse.Namespace) -> list[protos.Function]:
 
             pythonFunction=full_function_name,
             parameters=params,
+            pure=symbol._pure,
           )
 
           if symbol._function_id:
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+""" CLI to replace Records' older hashes with fingerprints. """
+import argparse
+
+from rivoli import loader
+
+def parse_args() -> argparse.Namespace:
+  """ Argparser for this file. """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--dry_run', action='store_true',
+                      help='Count the Records which would be updated')
+
+  return parser.parse_args()
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  migrated = loader.migrate_record_fingerprints(args.dry_run)
+  print(f'{"Would update" if args.dry_run else "Updated"} {migrated} records')
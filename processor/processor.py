@@ -35,8 +35,7 @@ def reset_file(file_id: int) -> None:
 
 if __name__ == '__main__':
   #copier.setup_scan_tasks()
-  #copier.scan('641d47816af10755674ffdd1')
-  #copier.scan('641ddc817328627725c1e3a1')
+  #copier.scan_all()
   #copier.copy.delay('p1')
 
   #reset_file(FILE_ID)
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+""" CLI to move processed files into the partitioned directory layout. """
+import argparse
+
+from rivoli import copier
+
+def parse_args() -> argparse.Namespace:
+  """ Argparser for this file. """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--dry_run', action='store_true',
+                      help='Log the files which would be moved')
+
+  return parser.parse_args()
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  relocated = copier.relocate_processed_files(args.dry_run)
+  print(f'{"Would relocate" if args.dry_run else "Relocated"} {relocated} files')
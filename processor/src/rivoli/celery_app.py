@@ -1,6 +1,7 @@
 """ Processor Celery App. """
 import typing as t
 
+from rivoli import config
 from rivoli import copier
 from rivoli.utils import tasks
 
@@ -14,7 +15,12 @@ app = tasks.app
 
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender: celery.Celery, **_: t.Any):
-  """ Execute the copier scan tasks every 10 minutes. """
+  """ Execute the copier scan tasks every 10 minutes, by default.
+  When the watcher is running this is only a fallback and can be set to a much
+  longer interval with COPIER_SCAN_INTERVAL (in seconds).
+  """
+  interval = int(config.get('COPIER_SCAN_INTERVAL', '600'))
+
   sender.add_periodic_task(
-      600, copier.setup_scan_tasks.s(),
+      interval, copier.setup_scan_tasks.s(),
       name='Copier Setup Scan Tasks')
@@ -1,12 +1,16 @@
 """ Copier module; looks for new files and creates File record. """
 import abc
+from concurrent import futures
 import datetime
+import os
 import pathlib
 import re
-import shutil
+import threading
 import time
 import typing as t
 
+import pymongo
+
 from rivoli import config
 from rivoli import protos
 from rivoli.protobson import bson_format
@@ -14,6 +18,7 @@ from rivoli.protobson import bson_format
 from rivoli import admin_entities
 from rivoli import db
 from rivoli import status_scheduler
+from rivoli.utils import line_index
 from rivoli.utils import logging
 from rivoli.utils import tasks
 from rivoli.utils import utils
@@ -22,20 +27,45 @@ logger = logging.get_logger(__name__)
 
 FILES_BASE_DIR = pathlib.Path(config.get('FILES'))
 
+_SCHEDULE_LOCK = threading.Lock()
+""" Lock around scheduling the next step for new Files. """
+
+_HASH_LOCKS = [threading.Lock() for _ in range(64)]
+""" Locks around checking for duplicates of, and creating, Files, striped by
+file hash, so that identical files created at once are still duplicates. """
+
+FileEntry = t.Union[os.DirEntry[str], pathlib.Path]
+""" A file in the input directory, from a directory listing or a path. """
+
 @tasks.app.task
 def setup_scan_tasks():
-  """ Schedule a copy() task for each active partner. """
-  logger.info('Setting up scanning for %s partners',
-              len(admin_entities.get_all_partners()))
-  for partner in admin_entities.get_all_partners().values():
-    if partner.active:
-      scan.delay(partner.id)
+  """ Schedule a single scan_all() task for all active partners. """
+  scan_all.delay()
 
 @tasks.app.task
-def scan(partner_id: str):
-  """ Search for new files for a partner and set them up for processing. """
-  dest_dir = FILES_BASE_DIR / 'processed'
+def scan_all():
+  """ Search for new files for all active partners in a single pass. """
+  partners = [partner for partner
+              in admin_entities.get_all_partners().values() if partner.active]
+
+  logger.info('Scanning for files for %s partners', len(partners))
 
+  _scan(partners)
+
+@tasks.app.task
+def scan_file(name: str):
+  """ Route a single new file in the input directory for all active partners.
+  This is scheduled by the watcher when a file arrives, and skips listing the
+  entire directory.
+  """
+  partners = [partner for partner
+              in admin_entities.get_all_partners().values() if partner.active]
+
+  scanner = InputDirScanner(partners, _get_dest_dir())
+  scanner.scan_file(get_input_dir() / name)
+
+def get_input_dir() -> pathlib.Path:
+  """ Return (and create) the directory which is scanned for new files. """
   # Use configured input_dir or default to base_dir/input
   if config.get('FILES_INPUT', strict=False):
     input_dir = pathlib.Path(config.get('FILES_INPUT'))
@@ -43,28 +73,105 @@ def scan(partner_id: str):
     input_dir = FILES_BASE_DIR / 'input'
 
   input_dir.mkdir(parents=True, exist_ok=True)
-  dest_dir.mkdir(parents=True, exist_ok=True)
 
-  partner = admin_entities.get_partner(partner_id)
+  return input_dir
 
-  logger.info('Scanning for files for Partner ID %s', partner_id)
+def _get_dest_dir() -> pathlib.Path:
+  """ Return (and create) the directory which Files are copied to. """
+  dest_dir = FILES_BASE_DIR / 'processed'
+  dest_dir.mkdir(parents=True, exist_ok=True)
 
-  copier = LocalFileCopier(partner, dest_dir)
-  copier.scan(input_dir)
+  return dest_dir
+
+def get_partition_dir(dest_dir: pathlib.Path, partner_id: str,
+    created: int) -> pathlib.Path:
+  """ Return the subdirectory of dest_dir for a Partner's File.
+  Files are partitioned by Partner and the (UTC) year and month they were
+  created so that no single directory grows without bound.
+  """
+  created_time = time.gmtime(created)
+  return (dest_dir / partner_id / f'{created_time.tm_year:04}' /
+          f'{created_time.tm_mon:02}')
+
+def relocate_processed_files(dry_run: bool = False) -> int:
+  """ Move Files from older layouts into their partition directories.
+  The File's location is updated after each file is moved, so this can be
+  interrupted and re-run. Returns the number of Files relocated.
+  """
+  dest_dir = _get_dest_dir()
+  relocated = 0
+
+  cursor = db.get_db().files.find(
+      {}, {'partnerId': 1, 'name': 1, 'location': 1, 'created': 1})
+
+  for doc in cursor:
+    file = bson_format.to_proto(protos.File, doc)
+
+    target_dir = get_partition_dir(dest_dir, file.partnerId, file.created)
+    if pathlib.Path(file.location) == target_dir:
+      continue
+
+    name = Copier.file_longterm_name(pathlib.Path(file.name), file.id)
+    src_file = pathlib.Path(file.location) / name
+    target_file = target_dir / name
+
+    if not src_file.exists() and not target_file.exists():
+      logger.warning('File ID %s not found at %s; not relocating', file.id,
+                     src_file)
+      continue
+
+    logger.info('Relocating File ID %s to %s', file.id, target_dir)
+    if dry_run:
+      relocated += 1
+      continue
+
+    # The file might have been moved by an earlier, interrupted run
+    if not target_file.exists():
+      target_dir.mkdir(parents=True, exist_ok=True)
+
+      # The index is moved first, so a moved file always has its index
+      if line_index.get_index_path(src_file).exists():
+        utils.move_file(line_index.get_index_path(src_file),
+                        line_index.get_index_path(target_file))
+      utils.move_file(src_file, target_file)
+
+    file.location = str(target_dir)
+    db.get_db().files.update_one(
+        *bson_format.get_update_args(file, ['location']))
+    relocated += 1
+
+  return relocated
+
+def _scan(partners: list[protos.Partner]) -> None:
+  """ Scan the input directory and route files to the given partners. """
+  scanner = InputDirScanner(partners, _get_dest_dir())
+  scanner.scan(get_input_dir())
 
 @tasks.app.task
 def copy_from_upload(orig_filename: str, temp_filename: str, partner_id: str,
     filetype_id: str):
   input_file = FILES_BASE_DIR / 'uploads' / temp_filename
-  dest_dir = FILES_BASE_DIR / 'processed'
+  dest_dir = _get_dest_dir()
 
   partner = admin_entities.get_partner(partner_id)
   filetype = admin_entities.get_filetype(filetype_id)
 
   logger.info('Copying uploaded file for Partner ID %s', partner_id)
 
+  filelog = protos.CopyLog.EvaluatedFile(
+    name=orig_filename,
+    sizeBytes=input_file.stat().st_size,
+    fileTypeId=filetype.id,
+  )
+
   copier = LocalFileCopier(partner, dest_dir)
-  copier.create_file(input_file, filetype, orig_filename)
+  file_r = copier.create_file(input_file, filetype, orig_filename, filelog)
+
+  filelog.fileId = file_r.id
+  filelog.resolution = protos.CopyLog.EvaluatedFile.COPIED
+
+  db.get_db().copylog.insert_one(bson_format.from_proto(protos.CopyLog(
+      partnerId=partner.id, time=bson_format.now(), files=[filelog])))
 
 class Copier(abc.ABC):
   """ Class to look for files and prep them for loading. """
@@ -73,13 +180,24 @@ class Copier(abc.ABC):
     self.partner = partner
 
   def create_file(self, src_file: pathlib.Path, filetype: protos.FileType,
-        orig_filename: t.Optional[str] = None) -> protos.File:
-    """ Move file to processed directory, create record, schedule lodading. """
+        orig_filename: t.Optional[str] = None,
+        filelog: t.Optional[protos.CopyLog.EvaluatedFile] = None
+        ) -> protos.File:
+    """ Move file to processed directory, create record, schedule lodading.
+    The strategy used to move the file is recorded in `filelog`, if provided.
+    """
     # Move the file to the destination but with a temporary file name
     # The filename will be changed right after the record is created,
     # and this approach makes orphans obvious
-    tmp_file = self.dest_dir / self._file_temp_name(src_file.name)
-    shutil.move(src_file, tmp_file)
+    partition_dir = get_partition_dir(self.dest_dir, self.partner.id,
+                                      bson_format.now())
+    partition_dir.mkdir(parents=True, exist_ok=True)
+
+    tmp_file = partition_dir / self._file_temp_name(src_file.name)
+    move_strategy = utils.move_file(src_file, tmp_file)
+
+    if filelog is not None:
+      filelog.moveStrategy = move_strategy
 
     # create_file_record() only uses the src_file for parsing values and
     # setting the display File.name. Allow for overriding that. The full path +
@@ -90,7 +208,11 @@ class Copier(abc.ABC):
     # Create the file record, which also renames the file
     file_r = self.create_file_record(orig_file, tmp_file, filetype)
 
-    status_scheduler.next_step(file_r, filetype)
+    # Duplicate files are kept and recorded but not processed
+    if file_r.status != protos.File.DUPLICATE:
+      # Files might be created from multiple threads; serialize the scheduling
+      with _SCHEDULE_LOCK:
+        status_scheduler.next_step(file_r, filetype)
 
     return file_r
 
@@ -115,11 +237,19 @@ class Copier(abc.ABC):
     if date:
       tags['_DATE'] = date
 
+    # Hash, size, rows, sample, and the line index all come from a single read
+    # of the file
+    summary = utils.get_file_summary(local_file, index_lines=True)
+
     file = protos.File(
       id=file_id,
       partnerId=self.partner.id,
-      sizeBytes=local_file.stat().st_size,
-      hash=utils.get_file_hash(local_file),
+      sizeBytes=summary.size_bytes,
+      hash=summary.hash,
+      sample=summary.sample,
+      compression=summary.compression,
+      contentHash=summary.content_hash,
+      contentSizeBytes=summary.content_size_bytes,
       tags=tags,
       fileDate=date,
       name=orig_file.name,
@@ -136,17 +266,47 @@ class Copier(abc.ABC):
         time=bson_format.now(),
         message='File Created'))
 
-    # Get # of lines from the file
-    with open(local_file, 'r', encoding='UTF-8', errors='surrogateescape') as fobj:
-      file.stats.approximateRows = sum(1 for _ in fobj)
+    file.stats.approximateRows = summary.rows
+
+    new_file = local_file.with_name(
+        self.file_longterm_name(orig_file, file_id))
 
-    db.get_db().files.insert_one(bson_format.from_proto(file))
+    # Write the index before the File exists so that it's always available
+    if summary.line_offsets is not None:
+      line_index.write_index(new_file, summary.line_offsets)
+      file.lineIndex = True
 
-    new_name = self._file_longterm_name(orig_file, file_id)
-    local_file.rename(local_file.with_name(new_name))
+    # Files are created from multiple threads, and an identical file mustn't
+    # be created between the duplicate check and the insert
+    with _HASH_LOCKS[summary.hash[0] % len(_HASH_LOCKS)]:
+      # A partner might re-send a file under a different name. Short-circuit
+      # processing so that the records don't get processed again.
+      original_id = self._get_duplicate_file_id(summary.hash)
+      if original_id:
+        file.status = protos.File.DUPLICATE
+        file.duplicateOfFileId = original_id
+
+        file.log.append(protos.ProcessingLog(
+            source=protos.ProcessingLog.COPIER,
+            level=protos.ProcessingLog.WARNING,
+            time=bson_format.now(),
+            message=f'Duplicate of File ID {original_id}; not processing'))
+
+      db.get_db().files.insert_one(bson_format.from_proto(file))
+
+    local_file.rename(new_file)
 
     return file
 
+  def _get_duplicate_file_id(self, file_hash: bytes) -> t.Optional[int]:
+    """ Return the ID of an earlier File with the same contents, if any. """
+    resp = db.get_db().files.find_one(
+        {'partnerId': self.partner.id, 'hash': file_hash,
+         'status': {'$ne': protos.File.DUPLICATE}},
+        {'_id': 1}, sort=[('_id', 1)])
+
+    return resp['_id'] if resp else None
+
   def _parse_date(self, orig_file: pathlib.Path,
       filetype: protos.FileType) -> t.Optional[str]:
     """ Parse optional "file date" from the filename. """
@@ -180,69 +340,325 @@ class Copier(abc.ABC):
   def _file_temp_name(self, filename: str) -> str:
     return f'tmp_{int(time.time())}_{filename}.tmp'
 
-  def _file_longterm_name(self, orig_file: pathlib.Path, file_id: int) -> str:
+  @staticmethod
+  def file_longterm_name(orig_file: pathlib.Path, file_id: int) -> str:
+    """ Return the name of a File's local file. """
     # ascii85 isn't good for the filesystem, so we convert to hex?
     return f'{orig_file.stem}-{file_id}{orig_file.suffix}'
 
 class LocalFileCopier(Copier):
-  """ Copier class that scans the local filesystem for files. """
-  def scan(self, input_dir: pathlib.Path):
-    """ Scan source directory and import new, matching files. """
-    # Create a log entry
-    log = protos.CopyLog(partnerId=self.partner.id, time=bson_format.now())
+  """ Copier class for files on the local filesystem. """
+
+class FileMatcher():
+  """ Match file names against every Partner's FileType patterns at once.
+  Consecutive `fileMatches` patterns are compiled into a single alternation
+  with a named group wrapping each pattern, so a file name is only evaluated
+  once per run of patterns regardless of the number of partners and patterns.
+  Patterns which can't be combined are matched individually, between the runs
+  around them, so the first matching pattern (in partner, filetype, pattern
+  order) wins.
+  """
+  def __init__(self, partners: t.Sequence[protos.Partner]):
+    self._segments: list[tuple[re.Pattern[str],
+                               dict[int, tuple[protos.Partner,
+                                               protos.FileType]]]] = []
+    """ Patterns in order, with their group index to matching Partner and
+    FileType. Individual patterns' target is group 0 (the whole match). """
+
+    group_targets: dict[str, tuple[protos.Partner, protos.FileType]] = {}
+    alternatives: list[str] = []
+
+    for partner in partners:
+      for filetype in partner.fileTypes:
+        for exp in filetype.fileMatches:
+          if utils.is_combinable_pattern(exp):
+            group = f'_m{len(alternatives)}'
+            group_targets[group] = (partner, filetype)
+            alternatives.append(f'(?P<{group}>{exp})')
+            continue
+
+          self._add_combined(alternatives, group_targets)
+          alternatives, group_targets = [], {}
+          self._segments.append((re.compile(exp), {0: (partner, filetype)}))
+
+    self._add_combined(alternatives, group_targets)
+
+  def _add_combined(self, alternatives: list[str],
+      group_targets: dict[str, tuple[protos.Partner, protos.FileType]]):
+    """ Add a run of combinable patterns as a single segment. """
+    if not alternatives:
+      return
+
+    combined = re.compile('|'.join(alternatives))
+    self._segments.append((combined, {
+        combined.groupindex[group]: target
+        for group, target in group_targets.items()}))
+
+  def match(self, name: str
+      ) -> t.Optional[tuple[protos.Partner, protos.FileType]]:
+    """ Return the Partner and FileType for a file name, or None. """
+    for exp, targets in self._segments:
+      matches = exp.fullmatch(name)
+      if not matches:
+        continue
+
+      if 0 in targets:
+        return targets[0]
+      # The wrapping group closes last and so is always the lastindex, even if
+      # the pattern has its own (unnamed) groups
+      if matches.lastindex:
+        return targets[matches.lastindex]
 
-    # Loop through every child in the root directory
-    for child in input_dir.iterdir():
-      # Currently only support files and not sub directories
-      if child.is_file():
-        log.files.append(self.evaluate_file(child))
+    return None
 
-    db.get_db().copylog.insert_one(bson_format.from_proto(log))
+class InputDirScanner():
+  """ Scan the shared input directory and route files to partners.
+  The directory is listed once and each file is matched, claimed, and copied
+  once for whichever Partner's FileType it matches.
+  """
+  def __init__(self, partners: t.Sequence[protos.Partner],
+      dest_dir: pathlib.Path):
+    self.partners = {partner.id: partner for partner in partners}
+    self.dest_dir = dest_dir
 
+    self.matcher = FileMatcher(partners)
 
-  def evaluate_file(self, file: pathlib.Path) -> protos.CopyLog.EvaluatedFile:
-    """ Evaluate a file to determine if it should be copied. """
-    # This can cause a race condition if another process (for another partner)
-    # finds the file first and already copied it in which case this might
-    # generate a FileNotFoundError
-    filelog = protos.CopyLog.EvaluatedFile(
-      name=file.name,
-      sizeBytes=file.stat().st_size
-    )
+    # Copiers are shared by the worker threads so they're all created upfront
+    self._copiers = {partner.id: LocalFileCopier(partner, dest_dir)
+                     for partner in partners}
 
-    # Has this file already been copied? If so then ignore it.
-    testdb = db.get_db()
-    files_filter = bson_format.get_filter_map(
-        protos.File(partnerId=self.partner.id, name=file.name),
-        ['partnerId', 'name'])
-    resp = testdb.files.find_one(files_filter)
+    self._max_workers = int(config.get('COPIER_WORKERS',
+                                       str(min(8, os.cpu_count() or 1))))
+    """ Number of files to copy (hash, create records for) at once. """
 
-    if resp:
+  def scan(self, input_dir: pathlib.Path):
+    """ Scan source directory and import new, matching files.
+    Files which are unchanged since they were last evaluated (according to the
+    scan index) are skipped without touching the database. The rest are checked
+    against existing File records with a single query. A CopyLog is only
+    written for partners with at least one evaluated file.
+    """
+    with os.scandir(input_dir) as entries:
+      # Currently only support files and not sub directories
+      files: list[FileEntry] = [entry for entry in entries if entry.is_file()]
+
+    self._evaluate_files(files, prune_index=True)
+
+  def scan_file(self, file: pathlib.Path):
+    """ Evaluate a single file in the input directory. """
+    if not file.is_file():
+      # Already claimed by another scan, or not a regular file
+      return
+
+    self._evaluate_files([file], prune_index=False)
+
+  def _evaluate_files(self, files: list[FileEntry], prune_index: bool):
+    """ Evaluate (changed) files, copy them, and update the log and index.
+    If `prune_index` is set then `files` is the complete directory listing,
+    and index entries for other files are removed.
+    """
+    # A full scan needs the whole index to prune it, but single files only need
+    # their own entries
+    scan_index = self._get_scan_index(
+        None if prune_index else [entry.name for entry in files])
+    matches_hash = self._get_matches_hash()
+
+    # Files which are new or changed since the last scan, keyed by name
+    candidates: dict[str, FileEntry] = {}
+    seen_names: set[str] = set()
+
+    for entry in files:
+      index_entry = scan_index.get(entry.name)
+      try:
+        unchanged = bool(index_entry) and self._is_unchanged(
+            index_entry, entry, matches_hash)
+      except FileNotFoundError:
+        # Claimed by another scan or removed since the listing, so its index
+        # entry is pruned
+        continue
+
+      seen_names.add(entry.name)
+      if not unchanged:
+        candidates[entry.name] = entry
+
+    routes = {name: self.matcher.match(name) for name in candidates}
+    known_files = self._get_known_files(
+        [(route[0].id, name) for name, route in routes.items() if route])
+
+    # CopyLogs keyed by Partner ID. Files which don't match any partner are
+    # logged without a Partner ID.
+    logs: dict[str, protos.CopyLog] = {}
+    index_updates: list[pymongo.ReplaceOne] = []
+
+    # Files are independent, and most of the work is I/O and hashing (which
+    # releases the GIL), so a backlog of files is copied in parallel
+    filelogs = {name: protos.CopyLog.EvaluatedFile(name=name)
+                for name in candidates}
+    with futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+      evaluations = {
+          name: executor.submit(self.evaluate_file, pathlib.Path(entry),
+                                routes[name], known_files, filelogs[name])
+          for name, entry in candidates.items()}
+
+    for name, entry in candidates.items():
+      route = routes[name]
+      partner_id = route[0].id if route else ''
+
+      try:
+        filelog = evaluations[name].result()
+      except FileNotFoundError:
+        # The file was claimed by another scan or removed since the listing
+        logger.info('File %s disappeared before it could be copied', name)
+        continue
+      except Exception as exc: # pylint: disable=broad-exception-caught
+        # Other files have already been copied, so keep going in order to log
+        # and index them. The file might already have been moved, so it's
+        # logged even though it has no File.
+        logger.exception('Unable to copy file %s', name)
+        filelog = filelogs[name]
+        filelog.resolution = protos.CopyLog.EvaluatedFile.FAILED
+        filelog.error = str(exc)
+
+      if partner_id not in logs:
+        logs[partner_id] = protos.CopyLog(partnerId=partner_id,
+                                          time=bson_format.now())
+      logs[partner_id].files.append(filelog)
+
+      # Copied files have been moved out of the input directory and don't need
+      # to be indexed, and failed files are evaluated again by the next scan
+      if filelog.resolution not in (protos.CopyLog.EvaluatedFile.COPIED,
+                                    protos.CopyLog.EvaluatedFile.DUPLICATE,
+                                    protos.CopyLog.EvaluatedFile.FAILED):
+        try:
+          index_updates.append(self._make_scan_index_update(
+              entry, partner_id, filelog, matches_hash))
+        except FileNotFoundError:
+          logger.info('File %s disappeared before it could be indexed', name)
+          seen_names.discard(name)
+
+    # Remove index entries for files which are no longer in the directory
+    stale_ids = [index_entry.id for name, index_entry in scan_index.items()
+                 if prune_index and name not in seen_names]
+
+    mydb = db.get_db()
+    if index_updates:
+      mydb.scanindex.bulk_write(index_updates, ordered=False)
+    if stale_ids:
+      mydb.scanindex.delete_many({'_id': {'$in': stale_ids}})
+
+    if logs:
+      mydb.copylog.insert_many(
+          [bson_format.from_proto(log) for log in logs.values()])
+
+  def evaluate_file(self, file: pathlib.Path,
+      route: t.Optional[tuple[protos.Partner, protos.FileType]],
+      known_files: dict[tuple[str, str], int],
+      filelog: t.Optional[protos.CopyLog.EvaluatedFile] = None
+      ) -> protos.CopyLog.EvaluatedFile:
+    """ Evaluate a routed file to determine if it should be copied.
+    `known_files` is a mapping of (Partner ID, file name) to File IDs for
+    existing File records, pre-fetched for the batch of files. The evaluation
+    is logged to `filelog`, if provided, so that it's kept if copying fails.
+    """
+    if filelog is None:
+      filelog = protos.CopyLog.EvaluatedFile(name=file.name)
+    filelog.sizeBytes = file.stat().st_size
+
+    if not route:
+      # No matches
+      filelog.resolution = protos.CopyLog.EvaluatedFile.NO_MATCH
+      return filelog
+
+    partner, filetype = route
+    filelog.fileTypeId = filetype.id
+
+    # Has this file already been copied? If so then ignore it.
+    if (partner.id, file.name) in known_files:
       # File has already been copied and we have a File record; update the log
       # and exit.
       filelog.resolution = protos.CopyLog.EvaluatedFile.FILE_EXISTS
-      filelog.fileId = resp['_id']
+      filelog.fileId = known_files[(partner.id, file.name)]
       return filelog
 
     # This creates a lot of logspam, at least until (if?) we decide to delete
     # the file after copying
     #logger.info('Found new file: %s', file.name)
 
-    # A partner can have multiple filetypes, and we're looking for any that are
-    # available
-    for filetype in self.partner.fileTypes:
-      # A filetype can have multiple match expressions
-      for exp in filetype.fileMatches:
-        if re.fullmatch(exp, file.name):
-          filelog.fileTypeId = filetype.id
-
-          file_r = self.create_file(file, filetype)
+    file_r = self._copiers[partner.id].create_file(file, filetype,
+                                                   filelog=filelog)
 
-          filelog.fileId = file_r.id
-          filelog.resolution = protos.CopyLog.EvaluatedFile.COPIED
+    filelog.fileId = file_r.id
 
-          return filelog
+    if file_r.status == protos.File.DUPLICATE:
+      filelog.resolution = protos.CopyLog.EvaluatedFile.DUPLICATE
+      filelog.duplicateOfFileId = file_r.duplicateOfFileId
+    else:
+      filelog.resolution = protos.CopyLog.EvaluatedFile.COPIED
 
-    # No matches
-    filelog.resolution = protos.CopyLog.EvaluatedFile.NO_MATCH
     return filelog
+
+  def _get_known_files(self, partner_names: list[tuple[str, str]]
+      ) -> dict[tuple[str, str], int]:
+    """ Return mapping of (Partner ID, file name) to File ID for Files. """
+    if not partner_names:
+      return {}
+
+    cursor = db.get_db().files.find(
+        {'partnerId': {'$in': list({pid for pid, _ in partner_names})},
+         'name': {'$in': list({name for _, name in partner_names})}},
+        {'partnerId': 1, 'name': 1})
+
+    return {(doc['partnerId'], doc['name']): doc['_id'] for doc in cursor}
+
+  def _get_scan_index(self, names: t.Optional[list[str]] = None
+      ) -> dict[str, protos.ScanIndexEntry]:
+    """ Return the scan index entries keyed by file name.
+    Only the entries for `names` are returned, if given.
+    """
+    cursor = db.get_db().scanindex.find(
+        {} if names is None else {'_id': {'$in': names}})
+    entries = [bson_format.to_proto(protos.ScanIndexEntry, doc)
+               for doc in cursor]
+
+    return {entry.name: entry for entry in entries}
+
+  def _get_matches_hash(self) -> bytes:
+    """ Return a hash of the partners' FileType file matching patterns.
+    Index entries are only valid while the patterns are unchanged, since a
+    file which didn't match before might match a new pattern.
+    """
+    return utils.get_dict_hash(
+        {f'{partner.id}:{filetype.id}': '\n'.join(filetype.fileMatches)
+         for partner in self.partners.values()
+         for filetype in partner.fileTypes})
+
+  def _is_unchanged(self, index_entry: protos.ScanIndexEntry,
+      entry: FileEntry, matches_hash: bytes) -> bool:
+    """ Return whether a file matches its scan index entry. """
+    stat = entry.stat()
+
+    return (index_entry.inode == stat.st_ino
+            and index_entry.sizeBytes == stat.st_size
+            and index_entry.mtimeNs == stat.st_mtime_ns
+            and index_entry.matchesHash == matches_hash)
+
+  def _make_scan_index_update(self, entry: FileEntry, partner_id: str,
+      filelog: protos.CopyLog.EvaluatedFile, matches_hash: bytes
+      ) -> pymongo.ReplaceOne:
+    """ Create an upsert for a file's scan index entry. """
+    stat = entry.stat()
+
+    index_entry = protos.ScanIndexEntry(
+      id=entry.name,
+      partnerId=partner_id,
+      name=entry.name,
+      inode=stat.st_ino,
+      sizeBytes=stat.st_size,
+      mtimeNs=stat.st_mtime_ns,
+      matchesHash=matches_hash,
+      resolution=filelog.resolution,
+      fileId=filelog.fileId,
+    )
+
+    return pymongo.ReplaceOne({'_id': index_entry.id},
+                              bson_format.from_proto(index_entry), upsert=True)
@@ -96,7 +96,8 @@ class Record(collections.UserDict[str, t.Any]):
 
 def register_func(function_type: FunctionType, deprecated: bool = False,
     function_id: t.Optional[str] = None, tags: list[str] = None,
-    fields_in: list[Field] = None, fields_out: list[Field] = None):
+    fields_in: list[Field] = None, fields_out: list[Field] = None,
+    pure: bool = False):
   """ Register a handler function.
   Registered functions can be scanned-for and inserted into the application.
   `fields_in` should be used for any record-level function to declare the
@@ -104,6 +105,9 @@ def register_func(function_type: FunctionType, deprecated: bool = False,
   returns a dict (ie, record validations). Where `fields_in` is provided but
   not `fields_out` and a dict is returned, then `fields_out` will have the same
   values as `fields_in`.
+  `pure` functions' results only depend on their input and parameters (e.g.,
+  they don't call APIs or use the current date), so field validation results
+  can be cached.
   """
   # pyright: reportGeneralTypeIssues=false, reportUnknownVariableType=false
   # pylint: disable=protected-access
@@ -120,6 +124,7 @@ def register_func(function_type: FunctionType, deprecated: bool = False,
 
     wrapped_f._fields_in = fields_in or []
     wrapped_f._fields_out = fields_out or []
+    wrapped_f._pure = pure
     return wrapped_f
 
   return wrapped
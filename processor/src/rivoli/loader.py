@@ -1,63 +1,307 @@
 """ Load file into multiple records. """
-import codecs
+import collections
 import csv
-import hashlib
 import itertools
 import io
 import pathlib
+import queue
+import threading
 import typing as t
-import unicodedata
+import uuid
+
+import celery
+import pymongo
 
 from rivoli import admin_entities
+from rivoli import config
+from rivoli import db
+from rivoli import parser
 from rivoli import protos
 from rivoli.record_processor import record_processor
 from rivoli import status_scheduler
 from rivoli.function_helpers import exceptions
 from rivoli.protobson import bson_format
+from rivoli.utils import column_profile
+from rivoli.utils import compression
+from rivoli.utils import decoding
+from rivoli.utils import fingerprint
+from rivoli.utils import line_index
 from rivoli.utils import logging
 from rivoli.utils import tasks
+from rivoli.utils import utils
 
 # pylint: disable=too-few-public-methods
 
 logger = logging.get_logger(__name__)
 
-LineGenerator = t.Generator[t.Tuple[str, t.Optional[list[str]]], None, None]
-
-BYTE_REPLACEMENTS = {
-  b'\xa0': ' ', # Non-breaking space
-}
-
-def _decode_error_handler(exc: UnicodeError) -> t.Tuple[str, int]:
-  exc = t.cast(UnicodeDecodeError, exc)
-  byt = exc.object[exc.start:exc.end]
-  if byt in BYTE_REPLACEMENTS:
-    return (BYTE_REPLACEMENTS[byt], exc.end)
+LineGenerator = t.Generator[
+    t.Tuple[str, t.Optional[list[str]], int, t.Optional[bytes]], None, None]
+""" Generates (line text, line fields, line index line number, line bytes)
+tuples. The line number is 0 if the row can't be read back from the line index.
+Fixed-width lines are parsed from their bytes, and their text is only decoded
+if it's needed. """
+
+class _LineTracker():
+  """ Track which line index line each row of a file was read from.
+  The line index only splits lines on \\n, but Python (and so the csv module)
+  also splits them on a bare \\r, and csv rows can span multiple lines. Rows
+  which aren't exactly one indexed line get a line number of 0.
+  """
+  def __init__(self, fileobj: t.Iterable[str], first_line: int = 1):
+    self._fileobj = fileobj
+
+    self._pieces = 0
+    """ Lines read, as split by Python """
+    self._lines = first_line - 1
+    """ Complete lines read, as split by the line index """
+    self._ends_line = True
+    """ The last piece ended an indexed line (or the file) """
+
+    self._row_pieces = 0
+    self._row_lines = self._lines
+    self._row_at_line_start = True
+
+  def __iter__(self) -> t.Iterator[str]:
+    for piece in self._fileobj:
+      self._pieces += 1
+      self._ends_line = not piece.endswith('\r')
+      if piece.endswith('\n'):
+        self._lines += 1
+
+      yield piece
+
+  def end_row(self) -> int:
+    """ Return the line number of the row which was just read, or 0. """
+    line_num = 0
+    if (self._row_at_line_start and self._ends_line and
+        self._pieces == self._row_pieces + 1):
+      line_num = self._row_lines + 1
+
+    self._row_pieces = self._pieces
+    self._row_lines = self._lines
+    self._row_at_line_start = self._ends_line
+
+    return line_num
+
+  def next_line(self) -> int:
+    """ Return the line number where the next row starts, or 0.
+    This is 0 if the last row ended partway through an indexed line.
+    """
+    return self._row_lines + 1 if self._row_at_line_start else 0
 
-  # Otherwise log it and return a unicode represenation
-  # This assumes that mongo and -- more importantly -- upstream services can
-  # handle unicode. Maybe a setting to return normalized unicode or a backslash
-  # representation. And maybe have our own unicode normalization map to do
-  # like convert german eszett into ss?
-  escaped = byt.decode('utf8', errors='rivoli_handler')
-  char = unicodedata.normalize('NFKD', byt.decode('unicode_escape'))
-  logger.warning('Found unexpected unicode character %s (%s)', char, escaped)
-  return (char, exc.end)
+RANGE_LINES = int(config.get('LOADER_RANGE_LINES', '1000000'))
+""" Lines per task when loading large files in parallel ranges. 0 disables
+parallel loading. """
 
-codecs.register_error('rivoli_handler', _decode_error_handler)
+PROFILE_INTERVAL = int(config.get('LOADER_PROFILE_INTERVAL', '10'))
+""" Every Nth row is profiled, for FileTypes which profile columns. 1 profiles
+every row, which roughly doubles the time to load wide files. """
 
 @tasks.app.task
-def load_from_id(file_id: int):
+def load_from_id(file_id: int, parallel: bool = True):
   """ Loader entrypoint for celery.
   Loads file based on just a file_id, and relies on using the currently-live
   FileType from the database.
+  Large files might be split into ranges of lines which are loaded by separate
+  tasks, in which case finish_range_load() schedules the next step.
+  """
+  file, partner, filetype = admin_entities.get_file_entities(file_id)
+
+  loader = _make_loader(file, partner, filetype,
+                        range_lines=RANGE_LINES if parallel else 0)
+  loader.process()
+
+  if (isinstance(loader, DelimitedLoader) and loader.ranges and
+      file.status == protos.File.LOADING):
+    celery.chord(load_range.s(file_id, start, end)
+                 for start, end in loader.ranges)(
+        finish_range_load.s(file_id, loader.ranges[-1][1]).on_error(
+            fail_range_load.s(file_id)))
+    return
+
+  status_scheduler.next_step(file, filetype)
+
+def _make_loader(file: protos.File, partner: protos.Partner,
+    filetype: protos.FileType, range_lines: int = 0) -> 'Loader':
+  """ Create the Loader for the FileType's format.
+  Only delimited files are loaded in parallel ranges.
+  """
+  if filetype.format == protos.FileType.FLAT_FILE_FIXED_WIDTH:
+    return FixedWidthLoader(file, partner, filetype)
+
+  return DelimitedLoader(file, partner, filetype, range_lines=range_lines)
+
+@tasks.app.task(ignore_result=False)
+def load_range(file_id: int, start_line: int, end_line: int) -> bool:
+  """ Load a range of lines of a file as part of a parallel load.
+  Returns False if the range didn't line up with the file's rows.
   """
   file, partner, filetype = admin_entities.get_file_entities(file_id)
 
-  loader = DelimitedLoader(file, partner, filetype)
+  loader = RangeLoader(file, partner, filetype, start_line, end_line)
   loader.process()
 
+  return loader.aligned
+
+@tasks.app.task
+def finish_range_load(aligned: list[bool], file_id: int, total_rows: int):
+  """ Complete a parallel load once all of the ranges have been loaded.
+  If any range didn't line up with the file's rows (e.g., a quoted value
+  contains a newline) then the file is loaded again in a single task.
+  """
+  file, partner, filetype = admin_entities.get_file_entities(file_id)
+
+  if file.status == protos.File.LOADING and not all(aligned):
+    logger.info('Reloading File ID %s without ranges', file_id)
+
+    # Loading requires that the File is NEW, and also deletes the Records
+    # from the ranges
+    db.get_db().files.update_one(
+        {'_id': file_id, 'status': protos.File.LOADING},
+        {'$set': {'status': protos.File.NEW}})
+    load_from_id.delay(file_id, parallel=False)
+    return
+
+  if file.status == protos.File.LOADING:
+    RangeLoadFinisher(file, partner, filetype, total_rows).process()
+
   status_scheduler.next_step(file, filetype)
 
+@tasks.app.task
+def fail_range_load(request: t.Any, exc: BaseException, traceback: t.Any,
+                    file_id: int):
+  """ Error callback for a parallel load.
+  Called if a range's task or finish_range_load() raised, which would
+  otherwise leave the File LOADING.
+  """
+  del request, traceback
+  record_processor.fail_file(file_id, protos.File.LOADING,
+                             protos.File.LOAD_ERROR,
+                             protos.ProcessingLog.LOADER, exc)
+
+def migrate_record_fingerprints(dry_run: bool = False) -> int:
+  """ Replace Records' older (md5) hashes with fingerprints.
+  Each File's Records are updated as they're read, so this can be interrupted
+  and re-run. Returns the number of Records updated.
+  """
+  migrated = 0
+
+  for doc in db.get_db().files.find({}, {'_id': 1}):
+    file, partner, filetype = admin_entities.get_file_entities(doc['_id'])
+
+    migrator = FingerprintMigrator(file, partner, filetype, dry_run)
+    migrator.process()
+    migrated += migrator.migrated
+
+  return migrated
+
+
+class _LoadClaimLost(Exception):
+  """ Another Loader resumed loading the File. """
+
+class _RecordWriter():
+  """ Insert chunks of Records from writer threads.
+  Lines are read and turned into Records while earlier chunks are inserted.
+  The queue is bounded so that reading can't get too far ahead of writing.
+  Progress stats (and the load checkpoint) are written once a chunk and all of
+  the chunks before it have been inserted, so they never get ahead of the
+  Records in the database. They're only written while the File's loadOwner is
+  the one in the stats, so a Loader stops once another has resumed the load.
+  """
+  def __init__(self, mydb: t.Any, threads: int):
+    self._db = mydb
+    self._queue: queue.Queue[t.Optional[tuple[
+        int, list[dict[str, t.Any]], t.Optional[protos.File]]]] = (
+        queue.Queue(maxsize=threads * 2))
+
+    self._lock = threading.Lock()
+    self._chunks = 0
+    self._inserted_chunk = 0
+    """ Chunk number up to which every chunk has been inserted """
+    self._pending_stats: dict[int, t.Optional[protos.File]] = {}
+    """ Stats of inserted chunks which are after a chunk still being inserted """
+    self._error: t.Optional[BaseException] = None
+
+    self._threads = [threading.Thread(target=self._run, daemon=True)
+                     for _ in range(threads)]
+    for thread in self._threads:
+      thread.start()
+
+  def write(self, records: list[dict[str, t.Any]],
+      stats: t.Optional[protos.File]) -> None:
+    """ Insert the Records (eventually) and update the File stats, if given.
+    Raises any error from the writer threads.
+    """
+    if self._error:
+      raise self._error
+
+    self._chunks += 1
+
+    if not self._threads:
+      self._write(self._chunks, records, stats)
+    else:
+      self._queue.put((self._chunks, records, stats))
+
+  def close(self) -> None:
+    """ Wait for the queued Records to be written. Raises any errors. """
+    for _ in self._threads:
+      self._queue.put(None)
+    for thread in self._threads:
+      thread.join()
+
+    if self._error:
+      raise self._error
+
+  def _run(self) -> None:
+    while item := self._queue.get():
+      # Keep taking chunks after an error so that the reader doesn't block
+      if self._error:
+        continue
+
+      try:
+        self._write(*item)
+      except BaseException as exc: # pylint: disable=broad-exception-caught
+        with self._lock:
+          self._error = self._error or exc
+
+  def _write(self, chunk: int, records: list[dict[str, t.Any]],
+      stats: t.Optional[protos.File]) -> None:
+    self._db.records.insert_many(records, ordered=False)
+
+    with self._lock:
+      self._pending_stats[chunk] = stats
+
+      latest: t.Optional[protos.File] = None
+      while self._inserted_chunk + 1 in self._pending_stats:
+        self._inserted_chunk += 1
+        latest = self._pending_stats.pop(self._inserted_chunk) or latest
+
+      if not latest:
+        return
+
+      fields = ['stats']
+      if latest.HasField('loadCheckpoint'):
+        fields.append('loadCheckpoint')
+
+      result = self._db.files.update_one(*bson_format.get_update_args(
+          latest, fields, ['id', 'loadOwner'] if latest.loadOwner else None))
+
+      if not result.matched_count:
+        raise _LoadClaimLost('Another Loader resumed loading the File')
+
+  def __enter__(self) -> '_RecordWriter':
+    return self
+
+  def __exit__(self, exc_type: t.Optional[type[BaseException]],
+      *_: t.Any) -> None:
+    if exc_type:
+      # Stop the threads, but the original exception takes priority
+      try:
+        self.close()
+      except BaseException: # pylint: disable=broad-exception-caught
+        pass
+    else:
+      self.close()
 
 class Loader(record_processor.RecordProcessor):
   """ Iterate through a local file and create Records. """
@@ -69,29 +313,196 @@ class Loader(record_processor.RecordProcessor):
   _step_stat_prefix = 'LOAD'
 
   local_file: pathlib.Path
-  fileobj: t.Optional[io.TextIOWrapper] = None
+  fileobj: t.Optional[t.IO[t.Any]] = None
 
   _line_num: int = 1
+  _index_lines: bool = False
+  """ Raw values can be read from the line index, so Records don't save them """
+  _line_tracker: _LineTracker
+
+  _writer_threads = int(config.get('LOADER_WRITER_THREADS', '2'))
+  """ Threads inserting Records while lines are read. 0 inserts each chunk
+  before reading the next. """
+  _write_progress_stats = True
+  """ Write the File stats after each chunk of Records """
+  # Quoted because the parser module imports (via the validator) this one
+  _field_map: t.Union['parser.DelimitedFieldMap', 'parser.FixedWidthFieldMap',
+                     None] = None
+  """ Parses Records as they're loaded, if the FileType parses while loading """
+  _checkpoint: t.Optional[protos.LoadCheckpoint] = None
+  """ Checkpoint which this load was resumed from """
+  _stored_columns: list[int] = []
+  """ Positions of the raw columns which Records store, if they're pruned """
+  _profiler: t.Optional[column_profile.ColumnProfiler] = None
+  """ Profiles the raw columns, if the FileType profiles them """
+  _anomalies: 'collections.Counter[int]'
+  """ Counts of the bytes replaced while decoding the file, by byte value """
+  _claim_lost = False
+  """ Another Loader resumed loading the File, so this one doesn't update it """
+
+  def process(self, limit_records: t.Optional[int] = None):
+    """ Load the Records, counting the bytes replaced while decoding. """
+    with decoding.count_anomalies() as self._anomalies:
+      super().process(limit_records)
 
   def _begin_processing(self):
-    """ Setup the File and Records to begin loading. """
-    name = pathlib.Path(self.file.name)
-    new_name = f'{name.stem}-{self.file.id}{name.suffix}'
-    self.local_file = pathlib.Path(self.file.location) / new_name
+    """ Setup the File and Records to begin loading.
+    A load which was interrupted (e.g., the worker was restarted) is resumed
+    from its checkpoint.
+    """
+    self.local_file = self._get_local_file()
+    self._index_lines = (self.file.lineIndex and
+                         line_index.get_index_path(self.local_file).exists())
+
+    if (self.file.status == protos.File.LOADING and self._index_lines and
+        self.file.loadCheckpoint.lineNum):
+      return self._resume_processing()
 
     # check size and md5?
 
     self._update_status_to_processing(protos.File.LOADING,
         protos.File.NEW)
+    # The status update claimed the File, so no other Loader can have it yet
+    owner = uuid.uuid4().hex
+    self.db.files.update_one({'_id': self.file.id},
+                             {'$set': {'loadOwner': owner}})
+    self.file.loadOwner = owner
+
     # Delete any existing records
     self.db.records.delete_many(self._all_records_filter())
     self._clear_stats('LOAD')
 
     # Clear out any previous header column value from the file object
     del self.file.headerColumns[:]
+    del self.file.storedColumns[:]
+    del self.file.columnProfiles[:]
 
     self.file.times.loadingStartTime = bson_format.now()
 
+  def _resume_processing(self) -> None:
+    """ Setup the File and Records to continue loading from the checkpoint.
+    The File is claimed by replacing its loadOwner, if no other Loader has
+    finished with it or resumed it since it was read. The Loader which was
+    running stops at its next progress update.
+    """
+    self._checkpoint = protos.LoadCheckpoint()
+    self._checkpoint.CopyFrom(self.file.loadCheckpoint)
+
+    owner = uuid.uuid4().hex
+    result = self.db.files.update_one(
+        # Files which were being loaded before owners were added don't have one
+        {'_id': self.file.id, 'status': protos.File.LOADING,
+         'loadOwner': self.file.loadOwner or None},
+        {'$set': {'loadOwner': owner, 'updated': bson_format.now()}})
+
+    if not result.matched_count:
+      self._claim_lost = True
+      raise _LoadClaimLost('Another Loader resumed or finished loading the '
+                           'File')
+
+    self.file.loadOwner = owner
+
+    # Records after the checkpoint might not all have been inserted
+    self.db.records.delete_many({'_id': {
+        '$gte': self.record_prefix + self._checkpoint.lineNum,
+        '$lte': self.record_prefix + ((1 << 32) - 1)}})
+
+    self.file.stats.CopyFrom(self._checkpoint.stats)
+    self._line_num = self._checkpoint.lineNum
+
+    self.file.log.append(self._make_log_entry(False,
+        f'Resuming loading at line {self._checkpoint.rawLineNum}'))
+
+  def _open_binary_file(self) -> t.BinaryIO:
+    """ Open the local file, decompressing it if necessary.
+    A resumed load starts reading at the checkpoint.
+    """
+    if self._checkpoint:
+      # Checkpoints are only saved with a line index, so the file is
+      # uncompressed and can seek
+      fobj = open(self.local_file, 'rb') # pylint: disable=consider-using-with
+      fobj.seek(self._checkpoint.byteOffset)
+      return fobj
+
+    return compression.open_binary(self.local_file,
+                                   self.file.compression or None)
+
+  def _open_file(self, **kwargs: t.Any) -> io.TextIOWrapper:
+    """ Open the local file as text, decompressing it if necessary. """
+    return io.TextIOWrapper(self._open_binary_file(),
+                            **decoding.get_codec(self.file.encoding), **kwargs)
+
+  def _read_sample(self) -> bytes:
+    """ Return the first bytes of the file and detect its encoding. """
+    sample = self.file.sample
+    if not sample:
+      # The Copier didn't capture the sample, so read it
+      with compression.open_binary(self.local_file,
+                                   self.file.compression or None) as fobj:
+        sample = fobj.read(utils.SAMPLE_SIZE)
+
+    self.file.encoding = decoding.detect(sample)
+    return sample
+
+  def _log_anomalies(self) -> None:
+    """ Add a summary of any bytes replaced while decoding to the File log. """
+    if not self._anomalies:
+      return
+
+    message = decoding.summarize_anomalies(self._anomalies)
+    logger.warning('File ID %s: %s', self.file.id, message)
+
+    log = self._make_log_entry(False, message)
+    log.level = protos.ProcessingLog.WARNING
+    self.file.log.append(log)
+
+  def _update_file(self, update_fields: list[str],
+        status: t.Optional['protos.File.Status'] = None,
+        list_append_fields: t.Optional[list[str]] = None) -> None:
+    """ Update the File, unless another Loader resumed loading it. """
+    if self._claim_lost:
+      if status:
+        self.file.status = status
+      logger.warning('Not updating File ID %s, which another Loader resumed',
+                     self.file.id)
+      return
+
+    super()._update_file(update_fields, status, list_append_fields)
+
+  def _get_file_filter_fields(self) -> list[str]:
+    return ['id', 'loadOwner'] if self.file.loadOwner else ['id']
+
+  def _track_lines(self, fileobj: io.TextIOWrapper) -> t.Iterable[str]:
+    """ Return the file's lines, tracked for the line index. """
+    self._line_tracker = _LineTracker(fileobj, self._checkpoint.rawLineNum
+                                      if self._checkpoint else 1)
+    return self._line_tracker
+
+  def _next_raw_line(self) -> int:
+    """ Return the line index line number where the next row starts, or 0. """
+    return self._line_tracker.next_line()
+
+  def _set_checkpoint(self, update: protos.File) -> None:
+    """ Add a checkpoint after the last Record to the File update, if possible.
+    Resuming needs to seek to the next row, so the line index is required, and
+    the last row must have ended at the end of an indexed line.
+    """
+    if not self._index_lines:
+      return
+
+    raw_line_num = self._next_raw_line()
+    index = self._get_line_index()
+    if not raw_line_num or raw_line_num > len(index):
+      return
+
+    start, _ = index.get_offsets(raw_line_num)
+    update.loadCheckpoint.CopyFrom(protos.LoadCheckpoint(
+        lineNum=self._line_num,
+        rawLineNum=raw_line_num,
+        byteOffset=start,
+        stats=self.file.stats,
+    ))
+
   def _create_db_records(self, lines: LineGenerator):
     """ Create records from lines and into the database.
     Iterate through a chunk of lines, create new records, and insert those into
@@ -99,6 +510,16 @@ class Loader(record_processor.RecordProcessor):
     This accepts a generator so that the generator can do any formatting
     without pre-processing the entire file.
     """
+    try:
+      with _RecordWriter(self.db, self._writer_threads) as writer:
+        self._create_db_records_chunks(lines, writer)
+    except _LoadClaimLost:
+      self._claim_lost = True
+      raise
+
+  def _create_db_records_chunks(self, lines: LineGenerator,
+      writer: '_RecordWriter') -> None:
+    """ Create records from chunks of lines and queue them to be written. """
     while line_chunk := list(itertools.islice(lines,
                                               self._max_pending_updates)):
       records: list[dict[str, t.Any]] = []
@@ -106,21 +527,20 @@ class Loader(record_processor.RecordProcessor):
       for line in line_chunk:
         recordtype: t.Optional[protos.RecordType] = None
 
-        line_raw = line[0]
-        line_fields = line[1]
+        line_raw, line_fields, raw_line_num, line_bytes = line
 
         if len(self.filetype.recordTypes) == 1:
           recordtype = self.filetype.recordTypes[0]
         else:
           # Find the matching RecordType based on each RecordType's patterns
-          # Re-create the line's values as a single string
-          recordtype = self._get_regexp_matching_record(
-              line_raw, self.filetype.recordTypes,
-              'recordMatches')
+          recordtype = self.recordtype_matcher.match(line_raw)
 
         if recordtype:
           records.append(self._create_new_record(
-            self._line_num, line_raw, line_fields, recordtype.id))
+            self._line_num, line_raw, line_fields, recordtype.id,
+            raw_line_num=raw_line_num,
+            **self._parse_row(recordtype.id, line_fields if line_bytes is None
+                              else line_bytes)))
           self._get_step_stat(recordtype.id).input += 1
           self._get_step_stat(recordtype.id).success += 1
           self.file.stats.loadedRecordsSuccess += 1
@@ -128,40 +548,167 @@ class Loader(record_processor.RecordProcessor):
           # No RecordType found. Create an error record.
           records.append(self._create_new_record(
             self._line_num, line_raw, line_fields, None,
-            protos.Record.LOAD_ERROR, 'No record type match found'))
+            protos.Record.LOAD_ERROR, 'No record type match found',
+            raw_line_num=raw_line_num))
           self.file.stats.loadedRecordsError += 1
 
         self._line_num += 1
 
-      self.db.records.insert_many(records, ordered=False)
-      self._update_file(['stats'])
+      if self._profiler:
+        self._profiler.add_rows([line[1] for line in line_chunk
+                                 if line[1] is not None])
+
+      # The writer might be updating the File from another thread, so it gets
+      # a snapshot of the stats
+      stats: t.Optional[protos.File] = None
+      if self._write_progress_stats:
+        stats = protos.File(id=self.file.id, loadOwner=self.file.loadOwner)
+        stats.stats.CopyFrom(self.file.stats)
+        self._set_checkpoint(stats)
+
+      writer.write(records, stats)
+
+  def _begin_pruning(self) -> None:
+    """ Choose which raw columns Records store, if the FileType prunes them.
+    Columns aren't pruned if an Output duplicates the input fields, and files
+    with a line index don't store raw columns at all (or store all of them, if
+    the FileType parses in the database).
+    """
+    if (not self.filetype.pruneColumns or self._index_lines or
+        any(output.configuration.duplicateInputFields
+            for output in self.filetype.outputs)):
+      return
+
+    fieldtypes = [field for recordtype in self.filetype.recordTypes
+                  for field in recordtype.fieldTypes if field.active]
+
+    if self.file.headerColumns:
+      used = {field.headerColumn for field in fieldtypes}
+      columns = [idx for idx, column in enumerate(self.file.headerColumns)
+                 if column in used]
+    else:
+      # Field indices entered in UI are 1-based
+      columns = sorted({field.columnIndex - 1 for field in fieldtypes
+                        if field.columnIndex})
+
+    self.file.storedColumns.extend(columns)
+    self._stored_columns = columns
+
+  def _begin_parsing(self) -> None:
+    """ Set up parsing Records while loading, if the FileType does that. """
+    if not self.filetype.parseWhileLoading:
+      return
+
+    if self.filetype.format == protos.FileType.FLAT_FILE_FIXED_WIDTH:
+      self._field_map = parser.FixedWidthFieldMap(self.filetype,
+                                                  self.file.encoding)
+    else:
+      self._field_map = parser.DelimitedFieldMap(self.filetype,
+                                                 self.file.headerColumns)
+
+    del self.file.parsedColumns[:]
+    self.file.parsedColumns.extend(self._field_map.parsed_columns)
+
+  def _parse_row(self, recordtype_id: int,
+      row: t.Union[list[str], bytes, None]) -> dict[str, t.Any]:
+    """ Parse a row while loading it, like the Parser would.
+    Returns the _create_new_record() kwargs for the parsed Record, which are
+    empty if the FileType doesn't parse while loading.
+    """
+    if not self._field_map or row is None:
+      return {}
+
+    step_stat = self.file.stats.steps[f'PARSE:{recordtype_id}']
+    step_stat.input += 1
+
+    if error := self._field_map.check_row(recordtype_id, row):
+      log = self._make_log_entry(True, error,
+          protos.ProcessingLog.OTHER_CONFIGURATION_ERROR)
+      log.source = protos.ProcessingLog.PARSER
+
+      step_stat.failure += 1
+      return {'status': protos.Record.PARSE_ERROR, 'log': log}
+
+    parsed, shared_key = self._field_map.parse(recordtype_id, row)
+
+    step_stat.success += 1
+    self.file.stats.parsedRecordsSuccess += 1
+    return {'status': protos.Record.PARSED, 'parsed_fields': parsed,
+            'shared_key': shared_key,
+            'parsed_fingerprint': self.fingerprinter.parsed(parsed)}
 
   def _create_new_record(self, line_num: int, line: str,
       columns: t.Optional[list[str]],
       record_type: t.Union[int, 'protos.Record.RecordTypeRef', None],
       status: protos.Record.Status = protos.Record.LOADED,
-      log_msg: t.Optional[str] = None) -> dict[str, t.Any]:
-    """ Create an individual Record to be uploaded. Return a dict. """
+      log_msg: t.Optional[str] = None,
+      raw_line_num: int = 0,
+      parsed_fields: t.Optional[dict[str, str]] = None,
+      shared_key: str = '',
+      log: t.Optional[protos.ProcessingLog] = None,
+      parsed_fingerprint: bytes = b'') -> dict[str, t.Any]:
+    """ Create an individual Record to be uploaded. Return a dict.
+    The raw values aren't saved if they can be read from the line index at
+    `raw_line_num` (unless the File stores raw columns anyway), and only the
+    stored columns are saved if they're pruned.
+    Records parsed while loading also have their parsed fields and shared key,
+    and might be fingerprinted by their parsed fields rather than their line.
+    An error log is created from `log_msg`, or `log` is used.
+    This is called for every line of the file, so it builds the document
+    directly rather than through a protos.Record and bson_format.from_proto().
+    The document must match what from_proto() would generate: only non-default
+    fields, in field number order, with the ID last as `_id`.
+    """
+    indexed = (self._index_lines and raw_line_num and
+               not self.file.rawColumnsStored)
+    pruned = bool(self._stored_columns and columns and
+                  record_type != protos.Record.HEADER)
+
+    record: dict[str, t.Any] = {}
+
+    # Header rows are never uploaded, so they don't need a fingerprint
+    if record_type != protos.Record.HEADER:
+      if record_hash := self.fingerprinter.line(line) or parsed_fingerprint:
+        record['hash'] = record_hash
+
+    if record_type:
+      record['recordType'] = int(record_type)
+    if status:
+      record['status'] = int(status)
 
     # line (string) will always be passed but only save it if columns
     # is not passed.
-    record = protos.Record(
-        id=self.record_prefix + line_num,
-        rawLine=None if columns else line,
-        rawColumns=columns,
-        hash=hashlib.md5(','.join(line).encode()).digest(),
-        recordType=record_type,
-        status=status,
-    )
+    if not indexed:
+      if line and not columns:
+        record['rawLine'] = line
+      if pruned:
+        record['rawColumns'] = [columns[idx] for idx in self._stored_columns
+                                if idx < len(columns)]
+      elif columns:
+        record['rawColumns'] = list(columns)
+
+    if parsed_fields:
+      record['parsedFields'] = dict(parsed_fields)
+    if shared_key:
+      record['sharedKey'] = shared_key
 
     if log_msg:
       # If log_msg is passed then it's only due to an error
       log = self._make_log_entry(True, log_msg,
           protos.ProcessingLog.OTHER_OPERATION_ERROR)
-      record.log.append(log)
-      record.recentErrors.append(log)
+    if log:
+      log_doc = bson_format.from_proto(log, rename_id=False)
+      record['log'] = [log_doc]
+      record['recentErrors'] = [dict(log_doc)]
+
+    if indexed and raw_line_num != line_num:
+      record['rawLineNum'] = raw_line_num
+    if pruned and not indexed:
+      record['rawColumnCount'] = len(columns)
 
-    return bson_format.from_proto(record)
+    record['_id'] = self.record_prefix + line_num
+
+    return record
 
   def _close_processing(self) -> None:
     """ Close the file object and update the db File fields. """
@@ -178,21 +725,62 @@ class Loader(record_processor.RecordProcessor):
     stepstats.failure = self.file.stats.loadedRecordsError
 
     self.file.log.append(self._make_log_entry(False, 'Loaded records'))
+    self._log_anomalies()
 
     self.file.times.loadingEndTime = bson_format.now()
 
-    return super()._update_file(
-      ['headerColumns', 'status', 'stats', 'times', 'log', 'recentErrors'])
+    if self.file.status == protos.File.PARSED:
+      self.file.log.append(self._make_log_entry(False, 'Parsed records'))
+      self.file.times.parsingEndTime = self.file.times.loadingEndTime
+
+    if self._profiler:
+      del self.file.columnProfiles[:]
+      self.file.columnProfiles.extend(self._profiler.get_profiles())
+
+    # Loading finished (or failed), so there's nothing to resume
+    self.file.ClearField('loadCheckpoint')
+
+    return self._update_file(
+      ['headerColumns', 'parsedColumns', 'dialect', 'encoding',
+       'storedColumns', 'columnProfiles', 'status', 'stats', 'times', 'log',
+       'recentErrors', 'loadCheckpoint'])
 
 class DelimitedLoader(Loader):
-  """ Iterate through a local delimited file and create Records. """
+  """ Iterate through a local delimited file and create Records.
+  If range_lines is set, files with at least two ranges' worth of data lines
+  are split into ranges for RangeLoaders instead of being loaded here.
+  """
   _has_header: bool
   _detected_delimiter: str
 
+  def __init__(self, file: protos.File, partner: protos.Partner,
+               filetype: protos.FileType, range_lines: int = 0) -> None:
+    super().__init__(file, partner, filetype)
+
+    self._range_lines = range_lines
+
+    self.ranges: list[tuple[int, int]] = []
+    """ (first line, last line) of each range to be loaded by a RangeLoader """
+
   def _process(self):
     """ Load CSV rows. """
     self._begin_processing()
-    reader = self._open_and_validate_file()
+
+    if self._checkpoint:
+      # The file was validated and the header was loaded before the checkpoint
+      self._has_header = False
+      self.fileobj = self._open_file(newline='')
+      reader = csv.reader(self._track_lines(self.fileobj),
+                          **self._get_csv_dialect())
+    else:
+      reader = self._open_and_validate_file()
+      self.file.rawColumnsStored = (self._index_lines and
+                                    self.filetype.parseInDatabase and
+                                    not self.filetype.parseWhileLoading)
+      # A resumed load re-reads lines with the same encoding and dialect, and
+      # RangeLoaders store raw columns the same way
+      self._update_file(['dialect', 'encoding', 'rawColumnsStored'])
+
     self._process_csv_file(reader)
 
     # Parent method is responsible for updating File status and updating db
@@ -200,12 +788,10 @@ class DelimitedLoader(Loader):
   def _open_and_validate_file(self) -> t.Iterator[list[str]]:
     """ Open file from the filesystem and confirm file properties. """
     # Get 8k of sample text from the file and use that to try to detect the
-    # dialect and existence of a header
-    self.fileobj = open(self.local_file, 'rt', newline='', encoding='UTF-8',
-                        errors='rivoli_handler')
+    # encoding, dialect and existence of a header
+    sample = decoding.decode_sample(self._read_sample(), self.file.encoding)
 
-    sample = self.fileobj.read(8192)
-    self.fileobj.seek(0)
+    self.fileobj = self._open_file(newline='')
 
     sniffer = csv.Sniffer()
     dialect = sniffer.sniff(sample)
@@ -216,8 +802,17 @@ class DelimitedLoader(Loader):
     # Regardless of the sniffed delimiter, set it to the configured delimiter
     dialect.delimiter = self.filetype.delimitedSeparator
 
+    # Save the dialect so that raw lines can be read back from the line index
+    self.file.dialect.CopyFrom(protos.CsvDialect(
+        delimiter=dialect.delimiter,
+        quoteChar=dialect.quotechar,
+        doubleQuote=dialect.doublequote,
+        skipInitialSpace=dialect.skipinitialspace,
+        escapeChar=dialect.escapechar,
+    ))
+
     # Create a CSV reader iterator
-    reader = csv.reader(self.fileobj, dialect)
+    reader = csv.reader(self._track_lines(self.fileobj), dialect)
 
     if self._has_header != self.filetype.hasHeader:
       # File configuration doesn't match what we see in the file. This is a
@@ -245,13 +840,15 @@ class DelimitedLoader(Loader):
     values.
     """
     for row in reader:
-      yield (self.filetype.delimitedSeparator.join(row), row)
+      yield (self.filetype.delimitedSeparator.join(row), row,
+             self._line_tracker.end_row(), None)
 
   def _process_csv_file(self, reader: t.Iterator[list[str]]) -> None:
     """ Iterate through file rows and upload to database. """
     if self._has_header:
       # File has header so we treat this first row differently
       line = next(reader)
+      self._line_tracker.end_row()
 
       self.db.records.insert_one(self._create_new_record(self._line_num, '',
           line, record_type=protos.Record.HEADER))
@@ -279,33 +876,333 @@ class DelimitedLoader(Loader):
 
       self._line_num += 1
 
-    self._create_db_records(self._delimited_rows(reader))
+    self._begin_pruning()
+    self._begin_parsing()
+    if self._field_map:
+      self._success_status = protos.File.PARSED
+      if not self._checkpoint:
+        self.file.times.parsingStartTime = bson_format.now()
 
-class FixedWidthLoader(Loader):
-  """ Iterate through a fixed-width file and create Records. """
+    self.ranges = self._plan_ranges()
+    if self.ranges:
+      # RangeLoaders will load the rows, and the File stays LOADING
+      self._success_status = None
+      return
 
-  def _raw_lines(self, fileobj: io.TextIOWrapper) -> LineGenerator:
-    """ Generate line data from a CSV reader.
-    Since this is a CSV we return the line as both text and a list of cell
-    values.
+    # Resumed loads would only profile the rest of the file
+    if self.filetype.profileColumns and not self._checkpoint:
+      self._profiler = column_profile.ColumnProfiler(self.file.headerColumns,
+                                                     PROFILE_INTERVAL)
+
+    self._create_db_records(self._delimited_rows(reader))
+
+  def _plan_ranges(self) -> list[tuple[int, int]]:
+    """ Split the data lines into ranges to load in parallel, if possible.
+    Ranges need the line index to find their lines. Record IDs are row
+    numbers, so a range's first line number is only its first row number if
+    rows and lines line up. That's checked by each RangeLoader.
+    Files whose columns are profiled are loaded in one task, since hash() (and
+    so the sketches) differs between worker processes, and the sketches can't
+    be merged.
     """
-    for line in fileobj:
-      # File lines end in the newline character
-      line = line.strip()
+    if (not self._range_lines or not self._index_lines or self._checkpoint or
+        self.file.compression or self.file.dialect.escapeChar or
+        self.filetype.profileColumns):
+      return []
+
+    with line_index.LineIndex(self.local_file) as index:
+      total_lines = len(index)
+
+    data_lines = total_lines - self._line_num + 1
+    num_ranges = data_lines // self._range_lines
+    if num_ranges < 2:
+      return []
+
+    # Spread any remainder across the ranges
+    bounds = [self._line_num + (data_lines * idx) // num_ranges
+              for idx in range(num_ranges + 1)]
+
+    return [(start, end - 1) for start, end in zip(bounds, bounds[1:])]
+
+  def _close_processing(self) -> None:
+    """ Update the db File fields, unless RangeLoaders are loading the rows. """
+    if not self.ranges or self.file.status != protos.File.LOADING:
+      return super()._close_processing()
+
+    if self.fileobj:
+      self.fileobj.close()
+
+    self.file.log.append(self._make_log_entry(False,
+        f'Loading records in {len(self.ranges)} ranges'))
+    self._log_anomalies()
+
+    return self._update_file(['headerColumns', 'parsedColumns', 'dialect',
+                              'encoding', 'stats', 'times', 'log'])
+
+class FixedWidthLoader(Loader):
+  """ Iterate through a fixed-width file and create Records.
+  The file is read as bytes, so lines are split the same way as the line
+  index. If the FileType parses while loading then fields are sliced from the
+  lines' bytes, and lines are only decoded if their text is needed.
+  """
+  _next_line: int = 1
+  """ Line index line number of the next line """
+  _at_line_start = True
+  """ The last row ended at the end of a line index line """
+
+  def _next_raw_line(self) -> int:
+    return self._next_line if self._at_line_start else 0
+
+  def _raw_lines(self, fileobj: t.BinaryIO) -> LineGenerator:
+    """ Generate line data from the file's lines. """
+    # The text is needed to match RecordTypes, for the raw line if it can't be
+    # read from the line index, and for raw line fingerprints
+    needs_text = (len(self.filetype.recordTypes) > 1 or
+                  not self._index_lines or
+                  self.fingerprinter.source == protos.Fingerprint.RAW_LINE)
+    encoding = self.file.encoding
+
+    for raw_line in fileobj:
+      raw_line_num = self._next_line
+      self._next_line += 1
+
+      # Lines are stripped of trailing whitespace (and the newline), but not
+      # of leading whitespace, since fields are at fixed positions
+      raw_line = raw_line.rstrip()
 
       # The file might end with a double-newline. Though this will also stop
       # iteration if there are any empty lines within the file
-      if not line:
+      if not raw_line:
         return
 
-      yield (line, None)
+      if b'\r' in raw_line:
+        # Python splits lines on a bare \r too, but the line index doesn't,
+        # so these lines can't be read back from it
+        pieces = raw_line.split(b'\r')
+        for idx, line in enumerate(pieces):
+          if not (line := line.rstrip()):
+            return
+
+          self._at_line_start = idx == len(pieces) - 1
+          yield (decoding.decode(line, encoding), None, 0, line)
+        continue
+
+      if raw_line.isascii():
+        # ASCII lines don't need to go through the decoder
+        line_text = raw_line.decode('ascii') if needs_text else ''
+      else:
+        # Decoding counts any replaced bytes, so the fields aren't counted
+        line_text = decoding.decode(raw_line, encoding)
+
+      yield (line_text, None, raw_line_num, raw_line)
 
   def _process(self):
     self._begin_processing()
 
     # Equivalent of _open_and_validate_file()
-    self.fileobj = open(self.local_file, 'rt', encoding='UTF-8',
-                        errors='rivoli_handler')
+    if self._checkpoint:
+      self._next_line = self._checkpoint.rawLineNum
+    else:
+      self._read_sample()
+      # A resumed load re-reads lines in the same encoding
+      self._update_file(['encoding'])
+    self.fileobj = self._open_binary_file()
+
+    self._begin_parsing()
+    if self._field_map:
+      self._success_status = protos.File.PARSED
+      if not self._checkpoint:
+        self.file.times.parsingStartTime = bson_format.now()
 
     # Equivalent of _process_csv_file()
     self._create_db_records(self._raw_lines(self.fileobj))
+
+class _MisalignedRange(Exception):
+  """ A range's lines didn't line up with the rows of the file. """
+
+class RangeLoader(Loader):
+  """ Load a range of lines from a delimited file, as part of a parallel load.
+  The DelimitedLoader already validated the file, loaded the header and set
+  the File to LOADING. Rows are parsed strictly so that a quoted value which
+  continues past the end of the range is an error rather than a short row.
+  Stats are added to the File's stats, which other ranges are also updating.
+  """
+  _success_status = None
+  _write_progress_stats = False
+
+  def __init__(self, file: protos.File, partner: protos.Partner,
+               filetype: protos.FileType, start_line: int, end_line: int
+               ) -> None:
+    super().__init__(file, partner, filetype)
+
+    self._start_line = start_line
+    self._end_line = end_line
+
+    self.aligned = True
+    """ Every line in the range was exactly one row """
+
+  def _process(self):
+    if self.file.status != protos.File.LOADING:
+      raise ValueError(('Unable to load range because File status is '
+                        f'{protos.File.Status.Name(self.file.status)}'))
+
+    self.local_file = self._get_local_file()
+    self._index_lines = True
+    self._line_num = self._start_line
+
+    # Only this range's stats and logs are added to the File
+    self.file.stats.Clear()
+    del self.file.log[:]
+    del self.file.recentErrors[:]
+
+    self._begin_parsing()
+
+    with line_index.LineIndex(self.local_file) as index:
+      start, _ = index.get_offsets(self._start_line)
+      _, end = index.get_offsets(self._end_line)
+
+    try:
+      self._create_db_records(self._range_rows(start, end))
+    except (_MisalignedRange, csv.Error):
+      self.aligned = False
+
+  def _range_lines(self, start: int, end: int) -> t.Iterator[str]:
+    """ Generate the decoded lines between two offsets. """
+    with open(self.local_file, 'rb') as fobj:
+      fobj.seek(start)
+
+      remaining = end - start
+      for line in fobj:
+        yield decoding.decode(line[:remaining], self.file.encoding)
+
+        remaining -= len(line)
+        if remaining <= 0:
+          return
+
+  def _range_rows(self, start: int, end: int) -> LineGenerator:
+    """ Generate line data for each row in the range. """
+    tracker = _LineTracker(self._range_lines(start, end))
+    reader = csv.reader(tracker, strict=True, **self._get_csv_dialect())
+
+    for line_num, row in enumerate(reader, self._start_line):
+      if not tracker.end_row():
+        raise _MisalignedRange()
+
+      yield (self.filetype.delimitedSeparator.join(row), row, line_num, None)
+
+  def _close_processing(self) -> None:
+    """ Add this range's stats and any errors to the File. """
+    if not self.aligned:
+      return
+
+    stats = bson_format.from_proto(self.file.stats)
+    increments = {f'stats.{key}': value for key, value in stats.items()
+                  if key != 'steps'}
+    for key, step in stats.get('steps', {}).items():
+      increments.update({f'stats.steps.{key}.{field}': value
+                         for field, value in step.items()})
+
+    update: dict[str, t.Any] = {'$inc': increments}
+
+    self._log_anomalies()
+    if self.file.log:
+      update['$push'] = {
+        'log': {'$each': [bson_format.from_proto(log, rename_id=False)
+                          for log in self.file.log]},
+      }
+
+    if self.file.status == protos.File.LOAD_ERROR:
+      update['$set'] = {'status': protos.File.LOAD_ERROR}
+      update.setdefault('$push', {})['recentErrors'] = {
+        '$each': [bson_format.from_proto(log, rename_id=False)
+                  for log in self.file.recentErrors]}
+
+    self.db.files.update_one({'_id': self.file.id}, update)
+
+class RangeLoadFinisher(Loader):
+  """ Complete a parallel load after all of the ranges have been loaded. """
+  def __init__(self, file: protos.File, partner: protos.Partner,
+               filetype: protos.FileType, total_rows: int) -> None:
+    super().__init__(file, partner, filetype)
+
+    self._line_num = total_rows + 1
+
+    if filetype.parseWhileLoading:
+      self._success_status = protos.File.PARSED
+
+  def _process(self):
+    # The RangeLoaders already added their stats to the File
+    if self.file.status != protos.File.LOADING:
+      raise ValueError(('Unable to finish loading because File status is '
+                        f'{protos.File.Status.Name(self.file.status)}'))
+
+class FingerprintMigrator(record_processor.RecordProcessor):
+  """ Fingerprint a File's Records which have older hashes.
+  Records are fingerprinted from their raw line or from their fields, as the
+  FileType is now configured. The File itself isn't changed.
+  """
+  log_source = protos.ProcessingLog.LOADER
+
+  def __init__(self, file: protos.File, partner: protos.Partner,
+               filetype: protos.FileType, dry_run: bool = False) -> None:
+    super().__init__(file, partner, filetype)
+
+    self._dry_run = dry_run
+    self.migrated = 0
+    """ Records which were (or would be) updated """
+
+  def _process(self):
+    outdated = self._all_records_filter() | {
+      'hash': {'$exists': True},
+      '$expr': {'$ne': [{'$binarySize': '$hash'},
+                        fingerprint.FINGERPRINT_SIZE]},
+    }
+
+    updates: list[pymongo.UpdateOne] = []
+    for doc in self.db.records.find(outdated).sort('_id'):
+      record = bson_format.to_proto(protos.Record, doc)
+      record.hash = self._get_fingerprint(record)
+      updates.append(pymongo.UpdateOne(
+          *bson_format.get_update_args(record, ['hash'])))
+
+      if len(updates) >= self._max_pending_updates:
+        self._write_updates(updates)
+        updates = []
+
+    self._write_updates(updates)
+
+  def _get_fingerprint(self, record: protos.Record) -> bytes:
+    """ Return the Record's fingerprint, as it would be fingerprinted now. """
+    if record.recordType == protos.Record.HEADER:
+      return b''
+
+    if self.fingerprinter.source == protos.Fingerprint.RAW_LINE:
+      if record.rawColumnCount:
+        # Pruned columns can't be joined back into the line
+        return record.hash
+
+      # Fingerprint the line as the Loader would have
+      if self.filetype.format == protos.FileType.FLAT_FILE_FIXED_WIDTH:
+        line = self._get_raw_line(record)
+      else:
+        line = self.filetype.delimitedSeparator.join(
+            self._get_raw_columns(record))
+
+      return self.fingerprinter.line(line)
+
+    # Fields are only fingerprinted once the Record got that far
+    if self.fingerprinter.source == protos.Fingerprint.PARSED_FIELDS:
+      return (self.fingerprinter.parsed(record.parsedFields)
+              if record.parsedFields else b'')
+
+    return (self.fingerprinter.validated(record.validatedFields)
+            if record.validatedFields else b'')
+
+  def _write_updates(self, updates: list[pymongo.UpdateOne]) -> None:
+    if updates and not self._dry_run:
+      self.db.records.bulk_write(updates, ordered=False)
+
+    self.migrated += len(updates)
+
+  def _close_processing(self) -> None:
+    """ The File isn't updated. """
@@ -1,7 +1,9 @@
 """ Parsing classes """
 import collections
+import struct
 import typing as t
 
+import celery
 import pymongo
 
 from rivoli import admin_entities
@@ -9,11 +11,12 @@ from rivoli import admin_entities
 from rivoli.protobson import bson_format
 from rivoli import protos
 
-from rivoli import db
 from rivoli.record_processor import db_chunk_processor
+from rivoli.record_processor import record_processor
 from rivoli.utils import tasks
 from rivoli import validator
 from rivoli.function_helpers import helpers
+from rivoli.utils import decoding
 
 # Disable pyright checks due to Celery
 # pyright: reportFunctionMemberAccess=false
@@ -23,21 +26,77 @@ from rivoli.function_helpers import helpers
 
 FieldList = list[t.Tuple[t.Tuple[int, int], str]]
 
+Pipeline = list[dict[str, t.Any]]
+
+_FEWER_VALUES = ('Fewer values than fields: Found {} values but expected at '
+                 'least {}')
+
 @tasks.app.task
 def parse(file_id: int) -> None:
-  """ Parse a file that's already been loaded into the db. """
-  file = bson_format.to_proto(protos.File,
-      db.get_db().files.find_one({'_id': file_id}))
+  """ Parse a file that's already been loaded into the db.
+  Large files might be split into shards which are parsed by separate tasks,
+  in which case finish_parse_shards() schedules the next step.
+  """
+  file, partner, filetype = admin_entities.get_file_entities(file_id)
+
+  parser = _make_parser(file, partner, filetype,
+                        shard_records=db_chunk_processor.SHARD_RECORDS)
+  parser.process()
+
+  if parser.shards and file.status == protos.File.PARSING:
+    celery.chord(parse_shard.s(file_id, start, end)
+                 for start, end in parser.shards)(
+        finish_parse_shards.s(file_id).on_error(
+            fail_parse_shards.s(file_id)))
+    return
+
+  validator.validate.delay(file_id)
 
-  # get the filetype config
-  partner = admin_entities.get_partner(file.partnerId)
-  filetype = admin_entities.get_filetype(file.fileTypeId)
+@tasks.app.task(ignore_result=False)
+def parse_shard(file_id: int, start_line: int, end_line: int
+    ) -> dict[str, t.Any]:
+  """ Parse a shard of a file's Records as part of a parallel parse.
+  Returns the shard's status, stats and logs.
+  """
+  file, partner, filetype = admin_entities.get_file_entities(file_id)
 
-  parser = DelimitedParser(file, partner, filetype)
+  parser = _make_parser(file, partner, filetype, shard=(start_line, end_line))
   parser.process()
 
+  return parser.get_shard_result()
+
+@tasks.app.task
+def finish_parse_shards(results: list[dict[str, t.Any]], file_id: int
+    ) -> None:
+  """ Complete a parallel parse once all of the shards have been parsed. """
+  file, partner, filetype = admin_entities.get_file_entities(file_id)
+
+  if file.status == protos.File.PARSING:
+    _make_parser(file, partner, filetype).finish_shards(results)
+
   validator.validate.delay(file_id)
 
+@tasks.app.task
+def fail_parse_shards(request: t.Any, exc: BaseException, traceback: t.Any,
+                      file_id: int):
+  """ Error callback for a parallel parse.
+  Called if a shard's task or finish_parse_shards() raised, which would
+  otherwise leave the File PARSING.
+  """
+  del request, traceback
+  record_processor.fail_file(file_id, protos.File.PARSING,
+                             protos.File.PARSE_ERROR,
+                             protos.ProcessingLog.PARSER, exc)
+
+def _make_parser(file: protos.File, partner: protos.Partner,
+    filetype: protos.FileType, shard_records: int = 0,
+    shard: t.Optional[tuple[int, int]] = None) -> 'Parser':
+  """ Create the Parser for the FileType's format. """
+  if filetype.format == protos.FileType.FLAT_FILE_FIXED_WIDTH:
+    return FixedWidthParser(file, partner, filetype, shard_records, shard)
+
+  return DelimitedParser(file, partner, filetype, shard_records, shard)
+
 class Parser(db_chunk_processor.DbChunkProcessor):
   """ Generic Parser """
   log_source = protos.ProcessingLog.PARSER
@@ -50,16 +109,28 @@ class Parser(db_chunk_processor.DbChunkProcessor):
   _record_error_status = protos.Record.PARSE_ERROR
 
   _step_stat_prefix = 'PARSE'
+  _finished_message = 'Parsed records'
 
   def __init__(self, file: protos.File, partner: protos.Partner,
-      filetype: protos.FileType) -> None:
-    super().__init__(file, partner, filetype)
+      filetype: protos.FileType, shard_records: int = 0,
+      shard: t.Optional[tuple[int, int]] = None) -> None:
+    super().__init__(file, partner, filetype, shard_records, shard)
 
     self.shared_keys: dict[int, list[str]] = {}
     """ Shared Keys by RecordType ID.
     Shared keys are used to look up matching records in the aggregation step.
     """
 
+  def _set_fingerprint(self, record: protos.Record) -> list[str]:
+    """ Fingerprint the Record by its parsed fields, if configured.
+    Returns the fields to update.
+    """
+    if record_hash := self.fingerprinter.parsed(record.parsedFields):
+      record.hash = record_hash
+      return ['hash']
+
+    return []
+
   def _close_processing(self) -> None:
     """ Close the file object and update the db File fields. """
     self.file.times.parsingEndTime = bson_format.now()
@@ -68,12 +139,13 @@ class Parser(db_chunk_processor.DbChunkProcessor):
       ['headerColumns', 'parsedColumns', 'status', 'stats', 'times', 'log',
        'recentErrors'])
 
-class DelimitedParser(Parser):
-  """ Delimited file parser """
-  def __init__(self, file: protos.File, partner: protos.Partner,
-      filetype: protos.FileType) -> None:
-    super().__init__(file, partner, filetype)
-
+class DelimitedFieldMap():
+  """ Maps delimited rows' values to each RecordType's fields.
+  This is shared by the DelimitedParser and by the Loader, when the FileType
+  parses records while loading them.
+  """
+  def __init__(self, filetype: protos.FileType,
+      header_columns: t.Sequence[str]) -> None:
     self.fieldnames: dict[int, list[t.Optional[str]]] = {}
     """ Fieldnames by RecordType ID, indexed by position.
     Not all headers will have an associated field and fieldname; we don't care
@@ -81,15 +153,21 @@ class DelimitedParser(Parser):
     needs to have None placeholder for each field.
     """
 
-  def _process(self):
-    """ Parse the "raw data" in the records and save the struct. """
-    # If File.headerColumns has been set then we have a header row
-    if self.file.headerColumns and len(self.filetype.recordTypes) > 1:
+    self.shared_keys: dict[int, list[str]] = {}
+    """ Shared Keys by RecordType ID.
+    Shared keys are used to look up matching records in the aggregation step.
+    """
+
+    self.parsed_columns: list[str] = []
+    """ Field names of the header columns, if there's a header. """
+
+    # If there are header columns then we have a header row
+    if header_columns and len(filetype.recordTypes) > 1:
       raise ValueError('Header row but more than one filetype')
 
-    for recordtype in self.filetype.recordTypes:
+    for recordtype in filetype.recordTypes:
       # Set the fieldnames
-      if self.file.headerColumns:
+      if header_columns:
         # If row has a header then we use the columns we got from the loading
         # step plus the mapping from the FieldTypes. Not all columns will have
         # a mapped fieldname, in which case the list value will be None for
@@ -101,10 +179,9 @@ class DelimitedParser(Parser):
                              for field in recordtype.fieldTypes if field.active}
 
         self.fieldnames[recordtype.id] = [fieldname_mapping.get(col)
-                                          for col in self.file.headerColumns]
+                                          for col in header_columns]
 
-        del self.file.parsedColumns[:]
-        self.file.parsedColumns.extend(list(fieldname_mapping.values()))
+        self.parsed_columns = list(fieldname_mapping.values())
       else:
         # Otherwise we have to create a list of fieldnames, but with Nones
         # for columns that don't get imported.
@@ -124,14 +201,309 @@ class DelimitedParser(Parser):
                                          in recordtype.fieldTypes
                                          if field.isSharedKey and field.active]
 
+  def check_row(self, recordtype_id: int, row: t.Sequence[str]
+      ) -> t.Optional[str]:
+    """ Return an error message if the row can't be parsed. """
+    # zip() stops with the shortest iterable, which is OK when fieldnames is
+    # shortest (we lose loaded fields that didn't have FieldTypes), but would
+    # be confusing if the row had less values than the fieldnames
+    num_fields = len(self.fieldnames[recordtype_id])
+    if len(row) < num_fields:
+      # This is probably better treated as a File-level ConfigurationError
+      return _FEWER_VALUES.format(len(row), num_fields)
+
+    return None
+
+  def parse(self, recordtype_id: int, row: t.Sequence[str]
+      ) -> tuple[dict[str, str], str]:
+    """ Return the row's parsed fields and its shared key. """
+    # The fieldname list will likely have None values, which generates a dict
+    # with None keys (sometimes overwritten), which are removed later.
+    parsed = dict(zip(self.fieldnames[recordtype_id], row))
+    # The zipping produces dict items keyed with None -- remove those
+    parsed.pop(None, None)
+
+    shared_keys = self.shared_keys[recordtype_id]
+    shared_key = '++'.join(parsed[key] for key in shared_keys)
+
+    return t.cast(dict[str, str], parsed), shared_key
+
+  def get_update_pipeline(self, recordtype_id: int,
+      error_log: dict[str, t.Any], stored_columns: t.Sequence[int] = ()
+      ) -> t.Optional[Pipeline]:
+    """ Compile the RecordType's parsing into a MongoDB update pipeline.
+    The pipeline parses Records' raw columns in the database like check_row()
+    and parse() would, without a round trip for each Record. Records with
+    fewer values than fields get `error_log` (a ProcessingLog document) with
+    the check_row() message. If the Records' columns were pruned then they
+    only have the `stored_columns`.
+    Returns None if a shared key isn't mapped to a column, which parse() can't
+    handle either.
+    """
+    fieldnames = self.fieldnames[recordtype_id]
+    shared_keys = self.shared_keys[recordtype_id]
+
+    # Later columns overwrite earlier ones with the same fieldname, like the
+    # dict() in parse()
+    positions = {name: idx for idx, name in enumerate(fieldnames)
+                 if name is not None}
+
+    if any(key not in positions for key in shared_keys):
+      return None
+
+    stored = {column: idx for idx, column in enumerate(stored_columns)}
+
+    def get_value(position: int) -> t.Any:
+      if not stored_columns:
+        return {'$arrayElemAt': ['$rawColumns', position]}
+
+      if position not in stored:
+        # Columns which weren't stored are empty
+        return ''
+
+      return {'$arrayElemAt': ['$rawColumns', stored[position]]}
+
+    if stored_columns:
+      num_values: t.Any = {'$ifNull': ['$rawColumnCount', 0]}
+    else:
+      num_values = {'$size': {'$ifNull': ['$rawColumns', []]}}
+
+    parsed: t.Any = '$$REMOVE'
+    if positions:
+      # Fieldnames are $literal so that they can't be read as field paths
+      parsed = {'$arrayToObject': [[
+          {'k': {'$literal': name}, 'v': get_value(idx)}
+          for name, idx in positions.items()]]}
+
+    # Empty shared keys aren't set, like in the DelimitedParser
+    shared_key: t.Any = '$$REMOVE'
+    if shared_keys:
+      values: list[t.Any] = []
+      for key in shared_keys:
+        values.extend(['++', get_value(positions[key])])
+
+      shared_key = {'$let': {
+          'vars': {'key': {'$concat': values[1:]}},
+          'in': {'$cond': [{'$eq': ['$$key', '']}, '$$REMOVE', '$$key']}}}
+
+    prefix, suffix = _FEWER_VALUES.format('{}', len(fieldnames)).split('{}')
+    log = error_log | {
+        'message': {'$concat': [prefix, {'$toString': num_values}, suffix]}}
+
+    failed = {'$lt': [num_values, len(fieldnames)]}
+
+    def on_failure(failure: t.Any, success: t.Any) -> dict[str, t.Any]:
+      return {'$cond': [failed, failure, success]}
+
+    def append_log(field: str) -> dict[str, t.Any]:
+      return {'$concatArrays': [{'$ifNull': [field, []]}, [log]]}
+
+    return [{'$set': {
+        'status': on_failure(protos.Record.PARSE_ERROR, protos.Record.PARSED),
+        'parsedFields': on_failure('$parsedFields', parsed),
+        'sharedKey': on_failure('$sharedKey', shared_key),
+        'log': on_failure(append_log('$log'), '$log'),
+        'recentErrors': on_failure(append_log('$recentErrors'),
+                                   '$recentErrors'),
+    }}]
+
+def get_fixedwidth_fields(recordtypes: t.Sequence[protos.RecordType]
+    ) -> dict[int, FieldList]:
+  """ Create the dict of fields keyed by recordtype id.
+  Fields are represented by a tuple with a start-end tuple and the field name
+  """
+  fields: dict[int, FieldList] = {}
+
+  # A dict keyed by start-end would be the most consistent but that key
+  # doesn't serve any purpose. Flipping it and using the field name as the key
+  # isn't any better.
+  # Maybe just a tuple with ((start, end), field) which means the list is keyed
+  # by unused index
+  for recordtype in recordtypes:
+    # Start and End are stored as 1-based inclusive. We need to convert them
+    # to be compatible with Python slicing
+    fields[recordtype.id] = [
+        ((field.charRange.start - 1 , field.charRange.end), field.name)
+        for field in recordtype.fieldTypes if field.active]
+
+  return fields
+
+class _FixedWidthPlan():
+  """ How to slice one RecordType's fields from its lines.
+  If the fields are in order and don't overlap then a line which is long
+  enough for all of them is unpacked by a single struct call.
+  """
+  def __init__(self, fields: FieldList) -> None:
+    fields = sorted(fields)
+
+    self.names = [name for _, name in fields]
+    self.slices = [slice(start, end) for (start, end), _ in fields]
+
+    self.struct: t.Optional[struct.Struct] = None
+    fmt = ''
+    position = 0
+    for (start, end), _ in fields:
+      if start < position or end <= start:
+        # Overlapping or empty fields can only be sliced
+        return
+
+      if start > position:
+        fmt += f'{start - position}x'
+      fmt += f'{end - start}s'
+      position = end
+
+    self.struct = struct.Struct(fmt)
+
+  def split(self, line: t.Union[bytes, str]) -> t.Sequence[t.Union[bytes, str]]:
+    """ Return the field values of a line, in the order of `names`. """
+    if (self.struct and isinstance(line, bytes) and
+        len(line) >= self.struct.size):
+      return self.struct.unpack_from(line)
+
+    # Values for fields past the end of the line are empty
+    return [line[field] for field in self.slices]
+
+class FixedWidthFieldMap():
+  """ Slices fixed-width lines into each RecordType's fields.
+  This is shared by the FixedWidthParser and by the Loader, when the FileType
+  parses records while loading them. The Loader parses the lines' bytes, and
+  only decodes the active fields. Fields are character positions, so lines
+  with multi-byte characters are decoded first.
+  """
+  def __init__(self, filetype: protos.FileType, encoding: str = '') -> None:
+    self.fields = get_fixedwidth_fields(filetype.recordTypes)
+    """ Field Tuples by RecordType ID. """
+
+    self.shared_keys: dict[int, list[str]] = {
+        recordtype.id: [field.name for field in recordtype.fieldTypes
+                        if field.isSharedKey and field.active]
+        for recordtype in filetype.recordTypes}
+    """ Shared Keys by RecordType ID. """
+
+    self.parsed_columns: list[str] = []
+    """ Fixed-width files don't have header columns. """
+
+    self._plans = {recordtype_id: _FixedWidthPlan(fields)
+                   for recordtype_id, fields in self.fields.items()}
+    self._encoding = encoding
+    self._single_byte = encoding == decoding.LATIN_1
+
+  def check_row(self, recordtype_id: int, line: t.Union[bytes, str]
+      ) -> t.Optional[str]:
+    """ Fixed-width lines can always be parsed. Missing values are empty. """
+    del recordtype_id, line
+
+    return None
+
+  def parse(self, recordtype_id: int, line: t.Union[bytes, str]
+      ) -> tuple[dict[str, str], str]:
+    """ Return the line's parsed fields and its shared key.
+    Values are stripped of whitespace.
+    """
+    if isinstance(line, bytes) and not (self._single_byte or line.isascii()):
+      # The line's bytes were already counted when the Loader decoded it
+      line = decoding.decode(line, self._encoding, count=False)
+
+    plan = self._plans[recordtype_id]
+    values = plan.split(line)
+
+    if isinstance(line, bytes):
+      if self._single_byte:
+        parsed = {name: decoding.decode(value, self._encoding,
+                                        count=False).strip()
+                  for name, value in zip(plan.names, values)}
+      else:
+        parsed = {name: value.decode('ascii').strip()
+                  for name, value in zip(plan.names, values)}
+    else:
+      parsed = {name: value.strip() for name, value in zip(plan.names, values)}
+
+    shared_key = '++'.join(parsed[key]
+                           for key in self.shared_keys[recordtype_id])
+
+    return parsed, shared_key
+
+class DelimitedParser(Parser):
+  """ Delimited file parser """
+  field_map: DelimitedFieldMap
+
+  def _process(self):
+    """ Parse the "raw data" in the records and save the struct. """
+    self.field_map = DelimitedFieldMap(self.filetype, self.file.headerColumns)
+    self.shared_keys = self.field_map.shared_keys
+
+    if self.file.headerColumns:
+      del self.file.parsedColumns[:]
+      self.file.parsedColumns.extend(self.field_map.parsed_columns)
+
     self._update_status_to_processing(protos.File.PARSING, protos.File.LOADED)
     self._clear_stats('PARSE')
     self.file.times.parsingStartTime = bson_format.now()
 
-    self._process_records(self._get_all_records(protos.Record.LOADED))
+    if pipelines := self._get_update_pipelines():
+      self._parse_in_db(pipelines)
+    else:
+      self._process_records(self._get_all_records(protos.Record.LOADED))
 
     # Final update to the File record
-    self.file.log.append(self._make_log_entry(False, 'Parsed records'))
+    self._log_finished()
+
+  def _get_update_pipelines(self) -> t.Optional[dict[int, Pipeline]]:
+    """ Compile the parsing of each RecordType into a MongoDB update pipeline.
+    Returns None if the Records have to be parsed here instead: if their raw
+    values are read from the line index (FileTypes which parse in the database
+    store them anyway), if they're fingerprinted by their parsed fields, or if
+    only some of them are parsed.
+    """
+    if ((self.file.lineIndex and not self.file.rawColumnsStored) or
+        self._limit_records or
+        self.fingerprinter.source == protos.Fingerprint.PARSED_FIELDS):
+      return None
+
+    error_log = bson_format.from_proto(self._make_log_entry(True, '',
+        protos.ProcessingLog.OTHER_CONFIGURATION_ERROR), rename_id=False)
+
+    pipelines: dict[int, Pipeline] = {}
+    for recordtype_id in self.field_map.fieldnames:
+      pipeline = self.field_map.get_update_pipeline(recordtype_id, error_log,
+                                                    self.file.storedColumns)
+      if pipeline is None:
+        return None
+
+      pipelines[recordtype_id] = pipeline
+
+    return pipelines
+
+  def _parse_in_db(self, pipelines: dict[int, Pipeline]) -> None:
+    """ Parse the LOADED Records with one update per RecordType.
+    The step stats are then counted from the parsed Records.
+    """
+    for recordtype_id, pipeline in pipelines.items():
+      self.db.records.update_many(
+          self._all_records_filter(protos.Record.LOADED, False) |
+              {'recordType': recordtype_id},
+          pipeline)
+
+    counts = self.db.records.aggregate([
+        {'$match': self._all_records_filter() | {'status': {
+            '$in': [protos.Record.PARSED, protos.Record.PARSE_ERROR]}}},
+        {'$group': {
+            '_id': {'recordType': '$recordType', 'status': '$status'},
+            'count': {'$sum': 1}}},
+    ])
+
+    for count in counts:
+      step_stat = self._get_step_stat(count['_id']['recordType'])
+      step_stat.input += count['count']
+
+      if count['_id']['status'] == protos.Record.PARSED:
+        step_stat.success += count['count']
+        self.file.stats.parsedRecordsSuccess += count['count']
+      else:
+        step_stat.failure += count['count']
+
+    self._file_complete = True
+    self._processing_finished = True
 
   def _process_record(self, records: list[helpers.Record]
       ) -> t.Sequence[pymongo.UpdateOne]:
@@ -139,27 +511,16 @@ class DelimitedParser(Parser):
     record = records[0].updated_record
 
     # Parent class' pre-processing confirmed that the record type is in the
-    # self.recordtypes_map. We need it in the self.fieldnames, but we assume
+    # self.recordtypes_map. We need it in the self.field_map, but we assume
     # they're equivalent
 
     step_stat = self._get_step_stat(record.recordType)
 
-    fieldnames = self.fieldnames[record.recordType]
-    shared_keys = self.shared_keys[record.recordType]
-
-    row = record.rawColumns
+    row = self._get_raw_columns(record)
 
-    # The fieldname list will likely have None values, which generates a dict
-    # with None keys (sometimes overwritten), which are removed later.
-    # zip() stops with the shortest iterable, which is OK when fieldnames is
-    # shortest (we lose loaded fields that didn't have FieldTypes), but would
-    # be confusing if the row had less values than the fieldnames
-    if len(row) < len(fieldnames):
-      # This is probably better treated as a File-level ConfigurationError
+    if error := self.field_map.check_row(record.recordType, row):
       record.status = protos.Record.PARSE_ERROR
-      log = self._make_log_entry(True,
-          (f'Fewer values than fields: Found {len(row)} values but expected at '
-           f'least {len(fieldnames)}'),
+      log = self._make_log_entry(True, error,
           protos.ProcessingLog.OTHER_CONFIGURATION_ERROR)
       record.log.append(log)
       record.recentErrors.append(log)
@@ -167,68 +528,38 @@ class DelimitedParser(Parser):
       step_stat.failure += 1
       return self._make_update(record, ['status', 'log', 'recentErrors'])
 
-    parsed = dict(zip(fieldnames, row))
-    # The zipping produces dict items keyed with None -- remove those
-    parsed.pop(None, None)
+    parsed, shared_key = self.field_map.parse(record.recordType, row)
 
     # We don't support extra fields or default values
-    record.parsedFields.update(t.cast(dict[str, str], parsed))
+    record.parsedFields.update(parsed)
     step_stat.success += 1
     record.status = protos.Record.PARSED
 
-    if shared_keys:
-      record.sharedKey = '++'.join(parsed[key] for key in shared_keys)
+    if shared_key:
+      record.sharedKey = shared_key
 
     self.file.stats.parsedRecordsSuccess += 1
-    return self._make_update(record, ['parsedFields', 'status', 'sharedKey'])
+    return self._make_update(record, ['parsedFields', 'status', 'sharedKey'] +
+                             self._set_fingerprint(record))
 
 
 class FixedWidthParser(Parser):
   """ Fixed-width field parser. """
-  def __init__(self, file: protos.File, partner: protos.Partner,
-      filetype: protos.FileType) -> None:
-    super().__init__(file, partner, filetype)
+  field_map: FixedWidthFieldMap
 
-    self.fields = self._create_recordtype_fields(self.filetype.recordTypes)
-    """ Field Tuples by RecordType ID.
-    Not all lines will have all fields "populated.
-    """
+  def _process(self):
+    """ Parse the raw lines of the records and save the struct. """
+    self.field_map = FixedWidthFieldMap(self.filetype, self.file.encoding)
+    self.shared_keys = self.field_map.shared_keys
 
-    # process method
-    # Common  process method stuff
+    self._update_status_to_processing(protos.File.PARSING, protos.File.LOADED)
+    self._clear_stats('PARSE')
+    self.file.times.parsingStartTime = bson_format.now()
 
-  def _process(self):
-    pass
+    self._process_records(self._get_all_records(protos.Record.LOADED))
 
-  def _create_recordtype_fields(self, recordtypes: t.Sequence[protos.RecordType]
-      ) -> dict[int, FieldList]:
-    """ Create the dict of fields keyed by recordtype id.
-    Fields are represented by a tuple with a start-end tuple and the field name
-    """
-    fields: dict[int, FieldList] = {}
-
-    # A dict keyed by start-end would be the most consistent but that key
-    # doesn't serve any purpose. Flipping it and using the field name as the key
-    # isn't any better.
-    # Maybe just a tuple with ((start, end), field) which means the list is keyed
-    # by unused index
-    for recordtype in recordtypes:
-      # Start and End are stored as 1-based inclusive. We need to convert them
-      # to be compatible with Python slicing
-      fields[recordtype.id] = [
-          ((field.charRange.start - 1 , field.charRange.end), field.name)
-          for field in recordtype.fieldTypes if field.active]
-
-    return fields
-
-  def _parse_fields(self, line: str,
-      fields: FieldList) -> dict[str, str]:
-    """ Parse fields from the "line" string and return field-name keyed dict
-    Takes the recordtype-specific list of fields.
-    Values are stripped of whitespace and non-existent values (where the index
-    is outside of the string length will be empty strings).
-    """
-    return {f[1]: line[f[0][0] : f[0][1]].strip() for f in fields}
+    # Final update to the File record
+    self._log_finished()
 
   def _process_record(self, records: list[helpers.Record]
       ) -> t.Sequence[pymongo.UpdateOne]:
@@ -236,21 +567,20 @@ class FixedWidthParser(Parser):
     record = records[0].updated_record
 
     # Parent class' pre-processing confirmed that the record type is in the
-    # self.recordtypes_map. We need it in self.fields, but we assume
+    # self.recordtypes_map. We need it in self.field_map, but we assume
     # they're equivalent
 
-    #shared_keys = self.shared_keys[record.recordType]
-    shared_keys: list[str] = []
-
-    parsed = self._parse_fields(record.rawLine, self.fields[record.recordType])
+    parsed, shared_key = self.field_map.parse(record.recordType,
+                                              self._get_raw_line(record))
 
     # We don't support extra fields or default values
     record.parsedFields.update(parsed)
     self._get_step_stat(record.recordType).success += 1
     record.status = protos.Record.PARSED
 
-    if shared_keys:
-      record.sharedKey = '++'.join(parsed[key] for key in shared_keys)
+    if shared_key:
+      record.sharedKey = shared_key
 
     self.file.stats.parsedRecordsSuccess += 1
-    return self._make_update(record, ['parsedFields', 'status', 'sharedKey'])
+    return self._make_update(record, ['parsedFields', 'status', 'sharedKey'] +
+                             self._set_fingerprint(record))
@@ -6,15 +6,20 @@ from rivoli.protos.config_pb2 import Partner
 from rivoli.protos.config_pb2 import FileType
 from rivoli.protos.config_pb2 import RecordType
 from rivoli.protos.config_pb2 import FieldType
+from rivoli.protos.config_pb2 import Fingerprint
 from rivoli.protos.config_pb2 import FunctionConfig
 from rivoli.protos.config_pb2 import Output
 
 from rivoli.protos.processing_pb2 import ApiLog
+from rivoli.protos.processing_pb2 import ColumnProfile
 from rivoli.protos.processing_pb2 import CopyLog
+from rivoli.protos.processing_pb2 import CsvDialect
 from rivoli.protos.processing_pb2 import File
+from rivoli.protos.processing_pb2 import LoadCheckpoint
 from rivoli.protos.processing_pb2 import Record
 from rivoli.protos.processing_pb2 import RecordStats
 from rivoli.protos.processing_pb2 import ProcessingLog
+from rivoli.protos.processing_pb2 import ScanIndexEntry
 from rivoli.protos.processing_pb2 import StepStats
 from rivoli.protos.processing_pb2 import OutputInstance
 
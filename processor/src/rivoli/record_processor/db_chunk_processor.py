@@ -6,6 +6,7 @@ import typing as t
 
 import pymongo
 
+from rivoli import config
 from rivoli import protos
 from rivoli.function_helpers import exceptions
 from rivoli.function_helpers import helpers
@@ -15,13 +16,16 @@ from rivoli.utils import logging
 
 logger = logging.get_logger(__name__)
 
-
-class DbChunkProcessor(record_processor.RecordProcessor):
-  """ Abstract class to handle processing database records in chunks. """
 MONGO_UPDATE = pymongo.UpdateOne | pymongo.UpdateMany
 
+ProtoRecordGroup = list[protos.Record]
+
 T = t.TypeVar('T')
 
+SHARD_RECORDS = int(config.get('PROCESSOR_SHARD_RECORDS', '1000000'))
+""" Records per task when parsing or validating large files in parallel shards.
+0 disables sharding. """
+
 def _listify(inp: t.Sequence[T] | T | None) -> t.Sequence[T]:
   """ Create a list of T out of a single T, a list of T, or None (removed).
   This is used for accepting a variety of ways of returning T and the output is
@@ -36,14 +40,43 @@ def _listify(inp: t.Sequence[T] | T | None) -> t.Sequence[T]:
   # At this point inp must be a single instance of the value but pyright is
   # getting confused
   return inp # pyright: ignore[reportUnknownVariableType]
+
+def _add_stats(stats: protos.RecordStats, delta: protos.RecordStats) -> None:
+  """ Add a shard's stats (and StepStats) to the File's stats. """
+  for field, value in delta.ListFields():
+    if field.name == 'steps':
+      for key, step_delta in delta.steps.items():
+        step = stats.steps[key]
+        for step_field, step_value in step_delta.ListFields():
+          setattr(step, step_field.name,
+                  getattr(step, step_field.name) + step_value)
+    else:
+      setattr(stats, field.name, getattr(stats, field.name) + value)
+
+
+class DbChunkProcessor(record_processor.RecordProcessor):
+  """ Abstract class to handle processing database records in chunks. """
   _fields_field: str = ''
   """ Name of the field on the Record which stores *existing* record data. """
   _only_process_record_status: t.Union['protos.Record.Status', t.Literal[False]]
+  _finished_message: str = ''
+  """ Logged on the File once all of its Records have been processed. """
 
   def __init__(self, file: protos.File, partner: protos.Partner,
-      filetype: protos.FileType) -> None:
+      filetype: protos.FileType, shard_records: int = 0,
+      shard: t.Optional[tuple[int, int]] = None) -> None:
     super().__init__(file, partner, filetype)
 
+    ### Sharding
+    self._shard_records = shard_records
+    """ If set, files with at least two shards' worth of Records are split into
+    shards which are processed by separate tasks instead of here. """
+    self.shard = shard
+    """ (first line, last line) of the Records to process, if this is one of
+    the File's shards. """
+    self.shards: list[tuple[int, int]] = []
+    """ (first line, last line) of each shard to be processed by a task """
+
     self._functions: dict[str, protos.Function]
     """ Function lookup map. """
 
@@ -83,6 +116,111 @@ def _listify(inp: t.Sequence[T] | T | None) -> t.Sequence[T]:
       raise AssertionError(('Batches not supported when FileType has more than '
                             'one RecordType'))
 
+  def _all_records_filter(self,
+      status: t.Optional['protos.Record.Status'] = None,
+      status_filter_gte: bool = True) -> dict[str, t.Any]:
+    """ Create a db filter for all of the File's Records, or the shard's. """
+    filter_ = super()._all_records_filter(status, status_filter_gte)
+
+    if self.shard:
+      start, end = self.shard
+      filter_['_id'] = {'$gte': self.record_prefix + start,
+                        '$lte': self.record_prefix + end}
+
+    return filter_
+
+  def _update_status_to_processing(self, new_status: protos.File.Status,
+      required_status: t.Optional[t.Union['protos.File.Status',
+                                          list['protos.File.Status']]] = None):
+    """ Update the File status, unless this is a shard.
+    The File was already updated when it was split into shards. Shards only
+    collect their own stats and logs, which are merged into the File once
+    every shard has finished.
+    """
+    if not self.shard:
+      return super()._update_status_to_processing(new_status, required_status)
+
+    if self.file.status != new_status:
+      raise ValueError(('Unable to process shard because File status is '
+                        f'{protos.File.Status.Name(self.file.status)}'))
+
+    self.file.stats.Clear()
+    del self.file.log[:]
+    del self.file.recentErrors[:]
+
+  def _update_file(self, update_fields: list[str],
+        status: t.Optional['protos.File.Status'] = None,
+        list_append_fields: t.Optional[list[str]] = None) -> None:
+    """ Update the File record in the database, unless this is a shard. """
+    if not self.shard:
+      return super()._update_file(update_fields, status, list_append_fields)
+
+    if status:
+      self.file.status = status
+
+  def _plan_shards(self) -> list[tuple[int, int]]:
+    """ Split the File's Records into shards to process in parallel.
+    Record IDs are line numbers, so the shards are ranges of line numbers.
+    """
+    if not self._shard_records or self.shard or self._limit_records:
+      return []
+
+    total_rows = self.file.stats.totalRows
+    num_shards = total_rows // self._shard_records
+    if num_shards < 2:
+      return []
+
+    # Spread any remainder across the shards
+    bounds = [1 + (total_rows * idx) // num_shards
+              for idx in range(num_shards + 1)]
+
+    return [(start, end - 1) for start, end in zip(bounds, bounds[1:])]
+
+  def _log_finished(self) -> None:
+    """ Log that the File's Records were processed, unless this is a shard or
+    shards are processing them. """
+    if not self.shard and not self.shards:
+      self.file.log.append(self._make_log_entry(False, self._finished_message))
+
+  def get_shard_result(self) -> dict[str, t.Any]:
+    """ Return the shard's status, stats and logs, to merge into the File. """
+    return bson_format.from_proto(protos.File(
+        status=self.file.status,
+        stats=self.file.stats,
+        log=self.file.log,
+        recentErrors=self.file.recentErrors,
+        validatedColumns=self.file.validatedColumns,
+    ))
+
+  def finish_shards(self, results: list[dict[str, t.Any]]) -> None:
+    """ Complete processing once every shard has finished.
+    The shards' stats and logs are merged into the File, which gets the error
+    status if any shard failed.
+    """
+    status = self._success_status
+
+    for result in results:
+      shard_file = bson_format.to_proto(protos.File, result)
+
+      _add_stats(self.file.stats, shard_file.stats)
+      self.file.log.extend(shard_file.log)
+      self.file.recentErrors.extend(shard_file.recentErrors)
+
+      for column in shard_file.validatedColumns:
+        if column not in self.file.validatedColumns:
+          self.file.validatedColumns.append(column)
+
+      if shard_file.status != self._success_status:
+        status = self._error_status
+
+    if status == self._success_status:
+      self._log_finished()
+
+    if status:
+      self.file.status = status
+
+    self._close_processing()
+
   def _get_all_records(self, status: t.Optional['protos.Record.Status'] = None,
       status_filter_gte: bool = True, **kwargs: t.Any):
     """ Generator for filtered Records for the class instance's File. """
@@ -119,7 +257,15 @@ def _listify(inp: t.Sequence[T] | T | None) -> t.Sequence[T]:
     This is typically called by the child-implemented _process() and simply
     iterates through chunks (~1000 records) from the records generator. It then
     calls `_preprocess_chunk()` and then `_process_chunk()`.
+    Large files might be split into shards instead, in which case the File
+    stays in its processing status until finish_shards().
     """
+    self.shards = self._plan_shards()
+    if self.shards:
+      self._success_status = None
+      self.file.log.append(self._make_log_entry(False,
+          f'Processing records in {len(self.shards)} shards'))
+      return
 
     while records_chunk := list(itertools.islice(records, self._db_chunk_size)):
       # Pre-process the *chunk*
@@ -265,13 +411,20 @@ def _listify(inp: t.Sequence[T] | T | None) -> t.Sequence[T]:
         self._update_file(['status', 'log', 'times', 'stats'])
 
 
-  @abc.abstractmethod
-  def _preprocess_record(self, record: PBR) -> t.Optional[HR]:
+  def _preprocess_record(self, record: protos.Record) -> helpers.Record | None:
     """ Ensure the Record is ready to be processed, return helpers.Record.
     There may be soft failures, where None is returned, or hard failures, where
     an exception is raised.
     This also decides if a batch should be processed immediately.
     """
+    record_h = self._make_helper_record(record)
+
+    if record_h.record_type.id == protos.Record.HEADER:
+      # Don't process the header record
+      # Not technically a failure, though this should have been excluded
+      return None
+
+    return record_h
 
   def _make_helper_record(self, record: protos.Record) -> helpers.Record:
     """ Create a Helper Record, do basic checks, and log step stats. """
@@ -319,13 +472,6 @@ def _listify(inp: t.Sequence[T] | T | None) -> t.Sequence[T]:
       return [pymongo.UpdateOne(*bson_format.get_update_args(record,
                                                              update_fields))]
 
-    """
-  def _preprocess_record(self, record: protos.Record) -> helpers.Record | None:
-    record_h = self._make_helper_record(record)
-
-    if record_h.record_type.id == protos.Record.HEADER:
-      # Don't process the header record
-      # Not technically a failure, though this should have been excluded
-      return None
-
-    return record_h
+    # Group of records
+    return [pymongo.UpdateOne(*bson_format.get_update_args(rec, update_fields))
+            for rec in record]
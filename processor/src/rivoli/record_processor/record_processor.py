@@ -1,5 +1,7 @@
 """ Abstract class for iterative processing. """
 import abc
+import csv
+import pathlib
 import re
 import traceback
 import typing as t
@@ -8,10 +10,124 @@ from rivoli import db
 from rivoli import protos
 from rivoli.function_helpers import exceptions
 from rivoli.protobson import bson_format
+from rivoli.utils import decoding
+from rivoli.utils import fingerprint
+from rivoli.utils import line_index
 from rivoli.utils import logging
+from rivoli.utils import utils
 
 logger = logging.get_logger(__name__)
 
+class RecordTypeMatcher():
+  """ Match lines against every RecordType's `recordMatches` patterns at once.
+  The first matching pattern (in RecordType, pattern order) wins. When every
+  pattern starts with some literal text (e.g., "H" for header lines), lines
+  are looked up by their first characters and only the patterns sharing those
+  characters are checked. Otherwise all patterns are compiled into a single
+  alternation with a named group wrapping each pattern, unless some of them
+  can't be combined, in which case they're all matched individually.
+  """
+  _SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+  _QUANTIFIERS = frozenset('*+?{')
+
+  def __init__(self, recordtypes: t.Sequence[protos.RecordType]):
+    patterns = [(pattern, recordtype) for recordtype in recordtypes
+                for pattern in recordtype.recordMatches]
+
+    self._prefix_len = min((len(self._literal_prefix(pattern))
+                            for pattern, _ in patterns), default=0)
+    """ Length of the line prefix used to look up patterns, if any. """
+    self._by_prefix: dict[str, list[
+        tuple[re.Pattern[str], protos.RecordType]]] = {}
+    """ Line prefix to the patterns which could match it. """
+    self._combined: t.Optional[re.Pattern[str]] = None
+    self._targets: dict[int, protos.RecordType] = {}
+    """ Combined pattern group index to matching RecordType. """
+    self._patterns: list[tuple[re.Pattern[str], protos.RecordType]] = []
+    """ Individually-compiled patterns, if they couldn't be combined. """
+
+    if self._prefix_len:
+      for pattern, recordtype in patterns:
+        self._by_prefix.setdefault(pattern[:self._prefix_len], []).append(
+            (re.compile(pattern), recordtype))
+
+    elif not all(utils.is_combinable_pattern(pattern)
+                 for pattern, _ in patterns):
+      self._patterns = [(re.compile(pattern), recordtype)
+                        for pattern, recordtype in patterns]
+
+    elif patterns:
+      self._combined = re.compile('|'.join(
+          f'(?P<_m{idx}>{pattern})' for idx, (pattern, _) in
+          enumerate(patterns)))
+      self._targets = {self._combined.groupindex[f'_m{idx}']: recordtype
+                       for idx, (_, recordtype) in enumerate(patterns)}
+
+  @classmethod
+  def _literal_prefix(cls, pattern: str) -> str:
+    """ Return the literal text which every match of the pattern starts with.
+    This is conservative: escapes, and alternations anywhere in the pattern,
+    end the prefix.
+    """
+    if '|' in pattern:
+      return ''
+
+    for idx, char in enumerate(pattern):
+      if char in cls._SPECIAL_CHARS:
+        # A quantified character might not be in the match
+        if char in cls._QUANTIFIERS:
+          return pattern[:max(idx - 1, 0)]
+        return pattern[:idx]
+
+    return pattern
+
+  def match(self, text: str) -> t.Optional[protos.RecordType]:
+    """ Return the RecordType for a line, or None. """
+    if self._prefix_len:
+      for exp, recordtype in self._by_prefix.get(text[:self._prefix_len], []):
+        if exp.fullmatch(text):
+          return recordtype
+      return None
+
+    if self._combined:
+      matches = self._combined.fullmatch(text)
+      # The wrapping group closes last and so is always the lastindex, even if
+      # the pattern has its own (unnamed) groups
+      if matches and matches.lastindex:
+        return self._targets[matches.lastindex]
+      return None
+
+    for exp, recordtype in self._patterns:
+      if exp.fullmatch(text):
+        return recordtype
+
+    return None
+
+def fail_file(file_id: int, status: 'protos.File.Status',
+    error_status: 'protos.File.Status',
+    source: 'protos.ProcessingLog.LogSource', exc: BaseException) -> None:
+  """ Give a File the error status after a task failed outside of a
+  RecordProcessor, e.g. one of a chord's tasks. The File is only updated if it
+  still has the processing status, so a later step's status isn't overwritten.
+  """
+  classname = exc.__class__.__name__
+  log = bson_format.from_proto(protos.ProcessingLog(
+    source=source,
+    level=protos.ProcessingLog.ERROR,
+    errorCode=protos.ProcessingLog.ERRORCODE_UNKNOWN,
+    time=bson_format.now(),
+    summary=classname,
+    message=f'{classname}: {exc}',
+  ), rename_id=False)
+
+  logger.error('Updating File ID %s status to %s because of exception %s',
+      file_id, protos.File.Status.Name(error_status), str(exc))
+
+  db.get_db().files.update_one(
+      {'_id': file_id, 'status': status},
+      {'$set': {'status': error_status},
+       '$push': {'log': log, 'recentErrors': log}})
+
 class RecordProcessor(abc.ABC):
   """ Abstract class to handle processing records in files or database. """
   log_source: protos.ProcessingLog.LogSource
@@ -38,6 +154,10 @@ class RecordProcessor(abc.ABC):
     """ Processing records limit. None == unlimited. """
 
     self.recordtypes_map = {rt.id: rt for rt in filetype.recordTypes}
+    self.recordtype_matcher = RecordTypeMatcher(filetype.recordTypes)
+    """ Finds a line's RecordType from the RecordTypes' patterns. """
+    self.fingerprinter = fingerprint.Fingerprinter(filetype)
+    """ Fingerprints Records to find ones which were already uploaded. """
 
     self.record_prefix: int = self.file.id << 32
     """ 32-bit-shifted File ID """
@@ -54,6 +174,9 @@ class RecordProcessor(abc.ABC):
     self._file_complete = False
     """ Processing is finished because all records were processed. """
 
+    self._line_index: t.Optional[line_index.LineIndex] = None
+    """ Opened on demand to read raw lines which Records don't store. """
+
     self.db = db.get_db() # pylint: disable=invalid-name
 
   def process(self, limit_records: t.Optional[int] = None):
@@ -77,10 +200,10 @@ class RecordProcessor(abc.ABC):
         self.file.status = self._success_status
 
     except Exception as exc: # pylint: disable=broad-exception-caught
-      # Specify the record_id as a kwarg here so that _make_exc_log_entry
+      # Specify the recordId as a kwarg here so that _make_exc_log_entry
       # doesn't include it on record-level exceptions
       record_id = getattr(exc, 'rivoli_record_id', None)
-      log = self._make_exc_log_entry(exc, record_id=record_id)
+      log = self._make_exc_log_entry(exc, recordId=record_id)
       self.file.log.append(log)
       self.file.recentErrors.append(log)
 
@@ -101,6 +224,10 @@ class RecordProcessor(abc.ABC):
     finally:
       self._close_processing()
 
+      if self._line_index:
+        self._line_index.close()
+        self._line_index = None
+
   @abc.abstractmethod
   def _process(self):
     """ Do the module-specific processing.
@@ -161,7 +288,68 @@ class RecordProcessor(abc.ABC):
 
     self.db.files.update_one(
       *bson_format.get_update_args(self.file, update_fields,
-                                   list_append_fields=list_append_fields))
+                                   self._get_file_filter_fields(),
+                                   list_append_fields))
+
+  def _get_file_filter_fields(self) -> list[str]:
+    """ Return the File fields which File updates are filtered on. """
+    return ['id']
+
+  def _get_local_file(self) -> pathlib.Path:
+    """ Return the path of the File's copy in the processed directory. """
+    name = pathlib.Path(self.file.name)
+    new_name = f'{name.stem}-{self.file.id}{name.suffix}'
+    return pathlib.Path(self.file.location) / new_name
+
+  def _read_indexed_line(self, record: protos.Record) -> t.Optional[str]:
+    """ Return a Record's line from the line index, if it isn't stored. """
+    if record.rawLine or record.rawColumns or not self.file.lineIndex:
+      return None
+
+    line_num = record.rawLineNum or record.id - self.record_prefix
+    return decoding.decode(self._get_line_index().get_line(line_num),
+                           self.file.encoding)
+
+  def _get_line_index(self) -> line_index.LineIndex:
+    """ Return the File's line index, opening it if necessary. """
+    if not self._line_index:
+      self._line_index = line_index.LineIndex(self._get_local_file())
+
+    return self._line_index
+
+  def _get_raw_line(self, record: protos.Record) -> str:
+    """ Return the Record's raw line, as it was loaded. """
+    line = self._read_indexed_line(record)
+
+    # The Loader strips trailing whitespace from lines
+    return record.rawLine if line is None else line.rstrip()
+
+  def _get_raw_columns(self, record: protos.Record) -> list[str]:
+    """ Return the Record's raw (delimited) columns, as they were loaded. """
+    line = self._read_indexed_line(record)
+    if line is None and record.rawColumnCount:
+      # Only the File's storedColumns were stored, and the others are empty
+      columns = [''] * record.rawColumnCount
+      for idx, value in zip(self.file.storedColumns, record.rawColumns):
+        columns[idx] = value
+      return columns
+
+    if line is None:
+      return list(record.rawColumns)
+
+    return next(csv.reader([line], **self._get_csv_dialect()), [])
+
+  def _get_csv_dialect(self) -> dict[str, t.Any]:
+    """ Return csv.reader() arguments for the dialect the Loader used. """
+    dialect = self.file.dialect
+    return {
+      'delimiter': dialect.delimiter or self.filetype.delimitedSeparator,
+      'quotechar': dialect.quoteChar or None,
+      'doublequote': dialect.doubleQuote,
+      'skipinitialspace': dialect.skipInitialSpace,
+      'escapechar': dialect.escapeChar or None,
+      'quoting': csv.QUOTE_MINIMAL if dialect.quoteChar else csv.QUOTE_NONE,
+    }
 
   def _all_records_filter(self,
       status: t.Optional['protos.Record.Status'] = None,
@@ -255,22 +443,6 @@ class RecordProcessor(abc.ABC):
 
     return self.file.stats.steps[self._get_step_stat_key(*args)]
 
-  def _get_regexp_matching_record(self, text: str,
-        records: t.Sequence[protos.RecordType],
-        matches_field: str) -> t.Optional[protos.RecordType]:
-    """ Find matching entity from a list based on any of its matching patterns.
-    This addresses the pattern in which we look for a match against a string
-    from a number of "records" (e.g., filetypes or recordtypes) which can each
-    have multiple matching patterns.
-    """
-    for record in records:
-      matches_list: list[str] = getattr(record, matches_field)
-      for pattern in matches_list:
-        if re.fullmatch(pattern, text):
-          return record
-
-    return None
-
   def _make_log_entry(self, error: bool, message: str,
       error_code: t.Optional[t.Union['protos.ProcessingLog.ErrorCode', int]] =
           None,
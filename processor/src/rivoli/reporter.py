@@ -68,10 +68,6 @@ def _fval_recent_errors(record: protos.Record) -> list[str]:
   """ Return text of recent errors. """
   return [', '.join([e.message for e in record.recentErrors])]
 
-def _fvals_original_columns(record: protos.Record) -> list[str]:
-  """ Return the original loaded values. """
-  return list(record.rawColumns)
-
 
 class Reporter(db_chunk_processor.DbChunkProcessor):
   """ Base class to create processing reports. """
@@ -172,7 +168,7 @@ class Reporter(db_chunk_processor.DbChunkProcessor):
       # Copy all of the original input fields. These are in the rawColumns field
       # in the Record
       self._field_names.extend(list(self.file.headerColumns))
-      self._field_generators.append(_fvals_original_columns)
+      self._field_generators.append(self._fvals_original_columns)
 
     if self._report_config.configuration.includeRecentErrors:
       # Add a column with any errors
@@ -210,6 +206,10 @@ class Reporter(db_chunk_processor.DbChunkProcessor):
     msg = f'Generated "{self._report_config.name}" and saved to CSV'
     self.file.log.append(self._make_log_entry(False, msg))
 
+  def _fvals_original_columns(self, record: protos.Record) -> list[str]:
+    """ Return the original loaded values. """
+    return self._get_raw_columns(record)
+
   def _process_record(self, records: list[helpers.Record]) -> None:
     """ Write a single record to the report. """
     assert len(records) == 1
@@ -205,8 +205,9 @@ class RecordUploader(db_chunk_processor.DbChunkProcessor):
       self.file.stats.uploadedRecordsError += 1
       raise ValueError('uploadConfirmationId is not empty')
 
-    if (record.hash in self._uploaded_hashes
-        or record.hash in self._chunk_hashes):
+    # Records without a fingerprint aren't checked for duplicates
+    if record.hash and (record.hash in self._uploaded_hashes
+                        or record.hash in self._chunk_hashes):
       # A record with the same hash already exists, either in the database or
       # earlier in this chunk
       step_stat.failure += 1
@@ -216,7 +217,8 @@ class RecordUploader(db_chunk_processor.DbChunkProcessor):
              else 'Duplicate record data found in previous row')
       raise exceptions.ValidationError(msg)
 
-    self._chunk_hashes.add(record.hash)
+    if record.hash:
+      self._chunk_hashes.add(record.hash)
 
     # Do any necessary field coercion
     fields = self._functions[record_h.record_type.upload.id].fieldsIn
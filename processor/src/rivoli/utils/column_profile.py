@@ -0,0 +1,171 @@
+""" Streaming profiles of a file's raw columns, computed while loading.
+Profiles are of every Nth row, so that profiling adds little to loading. Each
+chunk of those rows is transposed into columns, and each column's statistics
+are computed with builtins which loop in C. Memory is bounded by the sketch
+sizes rather than by the number of rows: distinct values are estimated from
+the smallest value hashes (a "k minimum values" sketch) and common values are
+kept from each chunk's most common values.
+"""
+import bisect
+import collections
+import itertools
+import sys
+import typing as t
+
+from rivoli import protos
+
+DISTINCT_SKETCH_SIZE = 256
+""" Smallest hashes kept to estimate distinct values. The error is about
+1/sqrt(DISTINCT_SKETCH_SIZE). """
+
+TOP_VALUES = 10
+""" Most common values saved in a profile. """
+
+_TOP_CANDIDATES = 5 * TOP_VALUES
+""" Most common values kept while profiling, so that values which are common
+over the whole file but not in every chunk aren't dropped. """
+
+_MAX_VALUE_LENGTH = 100
+""" Saved values are truncated to this many characters. """
+
+_MAX_INSERTS = 32
+""" New hashes which are inserted into a full sketch rather than sorted. """
+
+_HASH_BITS = sys.hash_info.width
+
+class _ColumnSketch():
+  """ Bounded-size summary of one column's values. """
+  def __init__(self) -> None:
+    self.count = 0
+    self.empty_count = 0
+    self.min_length: t.Optional[int] = None
+    self.max_length = 0
+
+    self.hashes: list[int] = []
+    """ The smallest distinct value hashes, in order """
+    self.top: collections.Counter[str] = collections.Counter()
+
+  def add(self, values: t.Sequence[str]) -> None:
+    """ Add a chunk of the column's values. """
+    self.count += len(values)
+    self.empty_count += values.count('')
+
+    lengths = list(map(len, values))
+    min_length = min(lengths)
+    if self.min_length is None or min_length < self.min_length:
+      self.min_length = min_length
+    self.max_length = max(self.max_length, max(lengths))
+
+    # hash() differs between processes, but a sketch is only built by one.
+    # Strings cache their hash, so the Counter below doesn't hash them again.
+    hashes: t.Iterable[int] = map(hash, values)
+    full = len(self.hashes) == DISTINCT_SKETCH_SIZE
+    if full:
+      # Only hashes smaller than the largest kept hash would be kept
+      hashes = filter(self.hashes[-1].__gt__, hashes)
+    new = set(hashes)
+
+    if full and len(new) < _MAX_INSERTS:
+      for value_hash in new:
+        # The largest kept hash might have changed since the filter
+        idx = bisect.bisect_left(self.hashes, value_hash)
+        if idx < len(self.hashes) and self.hashes[idx] != value_hash:
+          self.hashes.insert(idx, value_hash)
+          self.hashes.pop()
+    elif new:
+      new.update(self.hashes)
+      self.hashes = sorted(new)[:DISTINCT_SKETCH_SIZE]
+
+    if self.mostly_distinct():
+      # Counting the values of ID-like columns is slow, and none of them are
+      # common anyway
+      return
+
+    counts = collections.Counter(values)
+    if len(counts) <= _TOP_CANDIDATES:
+      self.top.update(counts)
+    elif max(counts.values()) > 1:
+      # Chunks where every value is distinct don't have any common values
+      self.top.update(dict(counts.most_common(_TOP_CANDIDATES)))
+
+    if len(self.top) > _TOP_CANDIDATES:
+      self.top = collections.Counter(
+          dict(self.top.most_common(_TOP_CANDIDATES)))
+
+  def mostly_distinct(self) -> bool:
+    """ Return whether almost every value is distinct, once there are enough.
+    """
+    return (len(self.hashes) == DISTINCT_SKETCH_SIZE and
+            self.distinct_estimate() > self.count * 0.9)
+
+  def distinct_estimate(self) -> int:
+    """ Return the estimated number of distinct values. """
+    if len(self.hashes) < DISTINCT_SKETCH_SIZE:
+      # Every distinct hash was kept
+      return len(self.hashes)
+
+    # Hashes are signed, so shift them to start at 0
+    position = self.hashes[-1] + (1 << (_HASH_BITS - 1)) + 1
+    return round((DISTINCT_SKETCH_SIZE - 1) * (1 << _HASH_BITS) / position)
+
+class ColumnProfiler():
+  """ Profile the columns of delimited rows as they're loaded.
+  Every `interval`th row is profiled, starting with the first.
+  """
+  def __init__(self, names: t.Sequence[str] = (), interval: int = 1) -> None:
+    self._names = list(names)
+    self._interval = max(interval, 1)
+    self._seen = 0
+    """ Rows added, including those which weren't profiled """
+    self._rows = 0
+    """ Rows profiled """
+    self._columns: list[_ColumnSketch] = []
+
+  def add_rows(self, rows: t.Sequence[t.Sequence[str]]) -> None:
+    """ Add a chunk of rows. """
+    start = -self._seen % self._interval
+    self._seen += len(rows)
+
+    rows = rows[start::self._interval]
+    if not rows:
+      return
+
+    self._rows += len(rows)
+
+    lengths = set(map(len, rows))
+    width = max(lengths)
+    while len(self._columns) < width:
+      self._columns.append(_ColumnSketch())
+
+    if len(lengths) == 1:
+      columns: t.Iterable[t.Sequence[str]] = zip(*rows)
+    else:
+      # Short rows don't have the last columns
+      columns = ([value for value in column if value is not None]
+                 for column in itertools.zip_longest(*rows))
+
+    for sketch, values in zip(self._columns, columns):
+      sketch.add(values)
+
+  def get_profiles(self) -> list[protos.ColumnProfile]:
+    """ Return the profile of each column. """
+    profiles: list[protos.ColumnProfile] = []
+
+    for idx, sketch in enumerate(self._columns):
+      profile = protos.ColumnProfile(
+          name=self._names[idx] if idx < len(self._names) else '',
+          count=sketch.count,
+          missingCount=self._rows - sketch.count,
+          emptyCount=sketch.empty_count,
+          minLength=sketch.min_length or 0,
+          maxLength=sketch.max_length,
+          distinctEstimate=sketch.distinct_estimate(),
+          sampleInterval=self._interval,
+      )
+
+      for value, count in sketch.top.most_common(TOP_VALUES):
+        profile.topValues.add(value=value[:_MAX_VALUE_LENGTH], count=count)
+
+      profiles.append(profile)
+
+    return profiles
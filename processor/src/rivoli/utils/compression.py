@@ -0,0 +1,130 @@
+""" Transparent decompression of (partner) input files.
+Compressed files are detected by their magic bytes rather than their names, and
+are decompressed as a stream so that an uncompressed copy is never written.
+"""
+import bz2
+import gzip
+import hashlib
+import io
+import pathlib
+import typing as t
+import zipfile
+
+import zstandard
+
+from rivoli import protos
+
+Compression = protos.File.Compression
+
+MAGIC_BYTES: list[tuple[bytes, 'protos.File.Compression']] = [
+  (b'\x1f\x8b', protos.File.GZIP),
+  (b'\x28\xb5\x2f\xfd', protos.File.ZSTD),
+  (b'BZh', protos.File.BZIP2),
+  (b'PK\x03\x04', protos.File.ZIP),
+]
+""" File signatures for supported compression formats. """
+
+def detect(file_path: pathlib.Path) -> 'protos.File.Compression':
+  """ Detect the file's compression from its first bytes. """
+  with open(file_path, 'rb') as fobj:
+    head = fobj.read(4)
+
+  for magic, compression in MAGIC_BYTES:
+    if head.startswith(magic):
+      return compression
+
+  return protos.File.COMPRESSION_NONE
+
+class HashingReader(io.RawIOBase):
+  """ Read-only file wrapper which hashes the bytes as they're read.
+  This lets a decompressor read the compressed file while we hash it, so the
+  compressed file only has to be read once.
+  """
+  def __init__(self, fobj: t.BinaryIO):
+    super().__init__()
+    self._fobj = fobj
+    self.md5 = hashlib.md5()
+    self.size_bytes = 0
+
+  def readable(self) -> bool:
+    return True
+
+  def readinto(self, buffer: t.Any) -> int:
+    data = self._fobj.read(len(buffer))
+    size = len(data)
+    buffer[:size] = data
+
+    self.md5.update(data)
+    self.size_bytes += size
+
+    return size
+
+  def close(self) -> None:
+    self._fobj.close()
+    super().close()
+
+def _open_zip_member(file_path: pathlib.Path) -> t.BinaryIO:
+  """ Open the single file inside of a zip archive. """
+  archive = zipfile.ZipFile(file_path)
+  members = [info for info in archive.infolist() if not info.is_dir()]
+
+  if len(members) != 1:
+    archive.close()
+    raise ValueError(
+        f'Zip archives must contain exactly one file, found {len(members)}')
+
+  # The member keeps a reference to the archive's file object, which is closed
+  # when the member is closed
+  return t.cast(t.BinaryIO, archive.open(members[0]))
+
+def wrap_binary(fobj: t.BinaryIO, compression: 'protos.File.Compression'
+    ) -> t.BinaryIO:
+  """ Wrap a (streaming) binary file object with a decompressor.
+  Closing the decompressor doesn't close `fobj`; that's left to the caller.
+  """
+  if compression == protos.File.GZIP:
+    return t.cast(t.BinaryIO, gzip.GzipFile(fileobj=fobj, mode='rb'))
+
+  if compression == protos.File.BZIP2:
+    return t.cast(t.BinaryIO, bz2.BZ2File(fobj, mode='rb'))
+
+  if compression == protos.File.ZSTD:
+    # Files might be written as multiple frames (e.g., by streaming writers)
+    return t.cast(t.BinaryIO, zstandard.ZstdDecompressor().stream_reader(
+        fobj, read_across_frames=True, closefd=False))
+
+  if compression == protos.File.COMPRESSION_NONE:
+    return fobj
+
+  raise ValueError(f'{Compression.Name(compression)} cannot be streamed')
+
+def open_binary(file_path: pathlib.Path,
+    compression: t.Optional['protos.File.Compression'] = None) -> t.BinaryIO:
+  """ Open a file for (binary) reading, decompressing it if necessary.
+  The compression is detected if it's not provided.
+  """
+  if compression is None:
+    compression = detect(file_path)
+
+  if compression == protos.File.GZIP:
+    return t.cast(t.BinaryIO, gzip.open(file_path, 'rb'))
+
+  if compression == protos.File.BZIP2:
+    return t.cast(t.BinaryIO, bz2.open(file_path, 'rb'))
+
+  if compression == protos.File.ZSTD:
+    return t.cast(t.BinaryIO, zstandard.ZstdDecompressor().stream_reader(
+        open(file_path, 'rb'), read_across_frames=True, closefd=True))
+
+  if compression == protos.File.ZIP:
+    return _open_zip_member(file_path)
+
+  return t.cast(t.BinaryIO, open(file_path, 'rb'))
+
+def open_text(file_path: pathlib.Path,
+    compression: t.Optional['protos.File.Compression'] = None,
+    **kwargs: t.Any) -> io.TextIOWrapper:
+  """ Open a file for text reading, decompressing it if necessary.
+  kwargs are passed to TextIOWrapper (e.g., encoding, errors, newline).
+  """
+  return io.TextIOWrapper(open_binary(file_path, compression), **kwargs)
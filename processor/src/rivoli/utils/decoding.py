@@ -0,0 +1,170 @@
+""" Decoding of (partner) input file text.
+Files are expected to be UTF-8, but files in a single-byte encoding (e.g.,
+Latin-1 mislabeled as UTF-8) are common. The encoding is detected from a sample
+of the file, and bytes which can't be decoded are replaced using a translation
+table rather than being handled (and logged) one at a time. Replaced bytes are
+counted so that they can be reported once per file.
+"""
+import codecs
+import collections
+import contextlib
+import contextvars
+import typing as t
+import unicodedata
+
+UTF_8 = 'UTF-8'
+LATIN_1 = 'ISO-8859-1'
+
+ERRORS = 'rivoli_handler'
+""" Name of the codecs error handler for input files. """
+
+_LATIN_1_CODEC = 'rivoli_latin_1'
+""" Name of the codec for files detected as LATIN_1. """
+
+BYTE_REPLACEMENTS = {
+  b'\xa0': ' ', # Non-breaking space
+}
+
+def _get_replacement(byte: int) -> str:
+  """ Return the text which replaces a non-ASCII byte. """
+  byt = bytes([byte])
+  if byt in BYTE_REPLACEMENTS:
+    return BYTE_REPLACEMENTS[byt]
+
+  # This assumes that mongo and -- more importantly -- upstream services can
+  # handle unicode. Maybe a setting to return normalized unicode or a backslash
+  # representation. And maybe have our own unicode normalization map to do
+  # like convert german eszett into ss?
+  return unicodedata.normalize('NFKD', byt.decode('latin-1'))
+
+_REPLACEMENTS = {byte: _get_replacement(byte) for byte in range(0x80, 0x100)}
+""" Replacement text by byte value. """
+
+_TRANSLATION = str.maketrans({chr(byte): text
+                              for byte, text in _REPLACEMENTS.items()})
+""" Replaces Latin-1-decoded characters, as for undecodable bytes. """
+
+_ASCII = bytes(range(0x80))
+
+_anomalies: contextvars.ContextVar[t.Optional[collections.Counter[int]]] = (
+    contextvars.ContextVar('anomalies', default=None))
+""" Counts of replaced bytes, when they're being counted. """
+
+@contextlib.contextmanager
+def count_anomalies() -> t.Iterator[collections.Counter[int]]:
+  """ Count the bytes replaced while decoding, by byte value. """
+  counter: collections.Counter[int] = collections.Counter()
+  token = _anomalies.set(counter)
+  try:
+    yield counter
+  finally:
+    _anomalies.reset(token)
+
+def summarize_anomalies(counter: collections.Counter[int], limit: int = 10
+    ) -> str:
+  """ Describe the replaced bytes, most common first. """
+  counts = ', '.join(f'0x{byte:02X} {_REPLACEMENTS[byte]!r} ({count:,})'
+                     for byte, count in counter.most_common(limit))
+  if len(counter) > limit:
+    counts += f' and {len(counter) - limit} others'
+
+  return (f'Replaced {sum(counter.values()):,} unexpected non-UTF-8 bytes: '
+          f'{counts}')
+
+def _decode_error_handler(exc: UnicodeError) -> t.Tuple[str, int]:
+  exc = t.cast(UnicodeDecodeError, exc)
+  byts = exc.object[exc.start:exc.end]
+
+  counter = _anomalies.get()
+  if counter is not None:
+    counter.update(byts)
+
+  return (''.join(_REPLACEMENTS[byte] for byte in byts), exc.end)
+
+codecs.register_error(ERRORS, _decode_error_handler)
+
+def _decode_latin_1(data: bytes, errors: str = 'strict', final: bool = False
+    ) -> t.Tuple[str, int]:
+  """ Decode single-byte text, replacing every non-ASCII byte. """
+  del errors, final # Every byte can be decoded
+
+  counter = _anomalies.get()
+  if counter is not None:
+    non_ascii = bytes(data).translate(None, _ASCII)
+    if non_ascii:
+      counter.update(non_ascii)
+
+  return (codecs.latin_1_decode(data)[0].translate(_TRANSLATION), len(data))
+
+class _Latin1IncrementalDecoder(codecs.BufferedIncrementalDecoder):
+  _buffer_decode = staticmethod(_decode_latin_1) # type: ignore[assignment]
+
+def _search_codec(name: str) -> t.Optional[codecs.CodecInfo]:
+  if name != _LATIN_1_CODEC:
+    return None
+
+  return codecs.CodecInfo(
+      name=_LATIN_1_CODEC,
+      encode=codecs.latin_1_encode,
+      decode=_decode_latin_1,
+      incrementaldecoder=_Latin1IncrementalDecoder,
+  )
+
+codecs.register(_search_codec)
+
+def detect(sample: bytes) -> str:
+  """ Detect the encoding of a file from a sample of its bytes.
+  Samples with bytes which aren't valid UTF-8, and without any valid
+  multi-byte UTF-8 characters, are treated as Latin-1.
+  """
+  # The sample might end partway through a multi-byte character, which the
+  # incremental decoder holds back rather than treating as an error.
+  decoder = codecs.getincrementaldecoder('UTF-8')(errors='surrogateescape')
+  text = decoder.decode(sample)
+
+  # Undecodable bytes are escaped as lone surrogates
+  invalid = any('\udc80' <= char <= '\udcff' for char in text)
+  if invalid and not any('\x80' <= char < '\udc80' or char > '\udcff'
+                         for char in text):
+    return LATIN_1
+
+  return UTF_8
+
+def get_codec(encoding: str) -> dict[str, str]:
+  """ Return the codec name and errors handler for a (detected) encoding. """
+  if encoding == LATIN_1:
+    return {'encoding': _LATIN_1_CODEC, 'errors': 'strict'}
+
+  return {'encoding': UTF_8, 'errors': ERRORS}
+
+@contextlib.contextmanager
+def _uncounted() -> t.Iterator[None]:
+  """ Don't count the bytes replaced while decoding. """
+  token = _anomalies.set(None)
+  try:
+    yield
+  finally:
+    _anomalies.reset(token)
+
+def decode(data: bytes, encoding: str = UTF_8, count: bool = True) -> str:
+  """ Decode bytes from a file in the (detected) encoding.
+  `count` is False for bytes which were already counted (e.g., a field of a
+  line which was decoded).
+  """
+  if count:
+    return data.decode(**get_codec(encoding))
+
+  with _uncounted():
+    return data.decode(**get_codec(encoding))
+
+def decode_sample(sample: bytes, encoding: str) -> str:
+  """ Decode a file's sample, without counting any replaced bytes.
+  The sample might end partway through a multi-byte character, which the
+  incremental decoder holds back rather than treating as an error.
+  """
+  codec = get_codec(encoding)
+  decoder = codecs.getincrementaldecoder(codec['encoding'])(codec['errors'])
+
+  # The sample's bytes are decoded (and counted) again when the file is read
+  with _uncounted():
+    return decoder.decode(sample)
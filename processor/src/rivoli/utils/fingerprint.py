@@ -0,0 +1,61 @@
+""" Record fingerprints, used to find Records which were already uploaded.
+Fingerprints are short keyed hashes of a Record's raw line or of some of its
+fields, depending on the FileType's configuration. They only need to be
+unique enough to find duplicate Records, and they're indexed, so they're
+truncated to keep the index small.
+"""
+import hashlib
+import json
+import typing as t
+
+from rivoli import config
+from rivoli import protos
+
+FINGERPRINT_SIZE = 8
+""" Bytes per fingerprint. """
+
+_KEY = (config.get('FINGERPRINT_KEY', strict=False) or '').encode()
+""" Key for the fingerprint hashes. Changing it changes every fingerprint. """
+
+def fingerprint(data: bytes) -> bytes:
+  """ Return the fingerprint of some bytes. """
+  return hashlib.blake2b(data, digest_size=FINGERPRINT_SIZE,
+                         key=_KEY).digest()
+
+class Fingerprinter():
+  """ Fingerprint Records as configured by a FileType.
+  Each method returns an empty fingerprint if the FileType's Records aren't
+  fingerprinted at that step.
+  """
+  def __init__(self, filetype: protos.FileType):
+    self.source = filetype.fingerprint.source
+    self._fields = list(filetype.fingerprint.fields)
+
+  def line(self, line: str) -> bytes:
+    """ Fingerprint a Record's raw line when it's loaded. """
+    if self.source != protos.Fingerprint.RAW_LINE:
+      return b''
+
+    return fingerprint(line.encode())
+
+  def parsed(self, fields: t.Mapping[str, str]) -> bytes:
+    """ Fingerprint a Record's parsed fields. """
+    if self.source != protos.Fingerprint.PARSED_FIELDS:
+      return b''
+
+    return self._fields_fingerprint(fields)
+
+  def validated(self, fields: t.Mapping[str, str]) -> bytes:
+    """ Fingerprint a Record's validated fields. """
+    if self.source != protos.Fingerprint.VALIDATED_FIELDS:
+      return b''
+
+    return self._fields_fingerprint(fields)
+
+  def _fields_fingerprint(self, fields: t.Mapping[str, str]) -> bytes:
+    """ Fingerprint the configured fields, or all fields. """
+    if self._fields:
+      fields = {name: fields.get(name, '') for name in self._fields}
+
+    # Serialized like utils.get_dict_hash(), so that field order doesn't matter
+    return fingerprint(json.dumps(dict(fields), sort_keys=True).encode())
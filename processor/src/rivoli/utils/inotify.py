@@ -0,0 +1,95 @@
+""" Minimal Linux inotify bindings.
+Only what's needed to watch a directory for new files; this uses libc directly
+through ctypes so that there isn't an additional dependency.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import typing as t
+
+IN_CLOSE_WRITE = 0x00000008
+""" File opened for writing was closed. """
+IN_MOVED_TO = 0x00000080
+""" File was moved into the watched directory. """
+IN_Q_OVERFLOW = 0x00004000
+""" Event queue overflowed and events were lost. """
+IN_ISDIR = 0x40000000
+""" Event subject is a directory. """
+
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+
+_EVENT_HEADER = struct.Struct('iIII')
+""" struct inotify_event: wd, mask, cookie, len; followed by the name. """
+
+class Event(t.NamedTuple):
+  """ A single inotify event. """
+  wd: int
+  """ Watch descriptor """
+  mask: int
+  """ Event mask """
+  cookie: int
+  """ Cookie to connect related (move) events """
+  name: str
+  """ Name of the file within the watched directory """
+
+class Inotify():
+  """ An inotify instance with one or more watches. """
+  def __init__(self):
+    self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    self.fd = self._libc.inotify_init1(_IN_CLOEXEC | _IN_NONBLOCK)
+    if self.fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, f'inotify_init1 failed: {os.strerror(errno)}')
+
+  def add_watch(self, path: t.Union[str, os.PathLike[str]], mask: int) -> int:
+    """ Watch a path for events in mask. Returns the watch descriptor. """
+    wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+    if wd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, f'inotify_add_watch failed: {os.strerror(errno)}',
+                    str(path))
+
+    return wd
+
+  def read_events(self, timeout: t.Optional[float] = None) -> list[Event]:
+    """ Wait for and return available events.
+    Returns an empty list if no events arrive before the timeout (in seconds).
+    """
+    readable, _, _ = select.select([self.fd], [], [], timeout)
+    if not readable:
+      return []
+
+    try:
+      data = os.read(self.fd, 64 * 1024)
+    except BlockingIOError:
+      return []
+
+    events: list[Event] = []
+    offset = 0
+    while offset < len(data):
+      wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+      offset += _EVENT_HEADER.size
+
+      # The name is NUL-padded
+      name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+      offset += length
+
+      events.append(Event(wd, mask, cookie, name))
+
+    return events
+
+  def close(self) -> None:
+    """ Close the inotify instance, which removes all watches. """
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+
+  def __enter__(self) -> 'Inotify':
+    return self
+
+  def __exit__(self, *_: t.Any) -> None:
+    self.close()
@@ -0,0 +1,98 @@
+""" Byte-offset index of the lines in a processed file.
+The index is a flat array of little-endian uint64 offsets stored next to the
+file: the start of each line, followed by the end of the file. Line N (1-based)
+is the bytes between offsets N-1 and N, so any raw line can be read through an
+mmap of the file without keeping a copy of it in the database.
+"""
+import array
+import mmap
+import os
+import pathlib
+import struct
+import sys
+import typing as t
+
+INDEX_SUFFIX = '.idx'
+
+_OFFSET = struct.Struct('<Q')
+_OFFSET_PAIR = struct.Struct('<QQ')
+
+def get_index_path(file_path: pathlib.Path) -> pathlib.Path:
+  """ Return the path of the index for a file. """
+  return file_path.with_name(file_path.name + INDEX_SUFFIX)
+
+def find_line_offsets(chunk: bytes, chunk_offset: int,
+    offsets: 'array.array[int]') -> None:
+  """ Append the start offsets of lines beginning after newlines in chunk. """
+  pos = chunk.find(b'\n')
+  while pos >= 0:
+    offsets.append(chunk_offset + pos + 1)
+    pos = chunk.find(b'\n', pos + 1)
+
+def write_index(file_path: pathlib.Path, offsets: 'array.array[int]') -> None:
+  """ Write the index for a file.
+  `offsets` are the line start offsets followed by the size of the file.
+  """
+  if sys.byteorder != 'little':
+    offsets = array.array('Q', offsets)
+    offsets.byteswap()
+
+  with open(get_index_path(file_path), 'wb') as fobj:
+    offsets.tofile(fobj)
+
+class LineIndex():
+  """ Random access to the raw lines of an indexed file.
+  Both the file and the index are mapped rather than read, since the index of
+  a large file is large itself.
+  """
+  def __init__(self, file_path: pathlib.Path):
+    self._index_fobj = open(get_index_path(file_path), 'rb')
+    self._fobj = open(file_path, 'rb')
+
+    # Empty files can't be mapped
+    self._index_mmap = self._mmap(self._index_fobj)
+    self._file_mmap = self._mmap(self._fobj)
+
+    self._lines = max(len(self._index_mmap or b'') // _OFFSET.size - 1, 0)
+
+  @staticmethod
+  def _mmap(fobj: t.BinaryIO) -> t.Optional[mmap.mmap]:
+    if not os.fstat(fobj.fileno()).st_size:
+      return None
+    return mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def __len__(self) -> int:
+    """ Number of lines in the file. """
+    return self._lines
+
+  def get_offsets(self, line_num: int) -> tuple[int, int]:
+    """ Return the start and end offsets of a (1-based) line.
+    The end is the start of the next line, so it includes the line ending.
+    """
+    if not self._index_mmap or not 0 < line_num <= self._lines:
+      raise IndexError(f'Line {line_num} is not in the index')
+
+    return _OFFSET_PAIR.unpack_from(self._index_mmap,
+                                    (line_num - 1) * _OFFSET.size)
+
+  def get_line(self, line_num: int) -> bytes:
+    """ Return a (1-based) line, without its line ending. """
+    start, end = self.get_offsets(line_num)
+    assert self._file_mmap
+
+    return self._file_mmap[start:end].rstrip(b'\r\n')
+
+  def close(self) -> None:
+    """ Unmap and close the files. """
+    for mapped in (self._file_mmap, self._index_mmap):
+      if mapped:
+        mapped.close()
+
+    self._fobj.close()
+    self._index_fobj.close()
+
+  def __enter__(self) -> 'LineIndex':
+    return self
+
+  def __exit__(self, *_: t.Any) -> None:
+    self.close()
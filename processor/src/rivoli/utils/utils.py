@@ -1,7 +1,51 @@
 """ Utils for processing files. """
+import array
+import errno
 import hashlib
 import json
+import os
 import pathlib
+import re
+import shutil
+import typing as t
+
+from rivoli import protos
+from rivoli.utils import compression
+from rivoli.utils import line_index
+
+READ_BUFFER_SIZE = 1 << 20
+""" Buffer size for streaming reads of (potentially very large) files. """
+
+SAMPLE_SIZE = 8192
+""" Size of the sample from the start of a file used to detect its format. """
+
+MoveStrategy = protos.CopyLog.EvaluatedFile.MoveStrategy
+
+_CROSS_DEVICE_ERRNOS = {errno.EXDEV, errno.EPERM, errno.ENOTSUP}
+""" Errors from rename() or link() which mean we have to fall back to a copy. """
+
+_UNCOMBINABLE_RE = re.compile(r'\(\?P[<=]|\\\d|\(\?[aiLmsux-]')
+
+class FileSummary(t.NamedTuple):
+  """ Summary of a file's contents. """
+  hash: bytes
+  """ md5 of the file contents (as stored, ie, compressed) """
+  size_bytes: int
+  """ File size (as stored) """
+  rows: int
+  """ Number of (decompressed) lines, including a final line without a
+  newline """
+  sample: bytes
+  """ First SAMPLE_SIZE bytes of the (decompressed) file """
+  compression: 'protos.File.Compression' = protos.File.COMPRESSION_NONE
+  """ Compression format, if the file is compressed """
+  content_hash: bytes = b''
+  """ md5 of the decompressed contents, if the file is compressed """
+  content_size_bytes: int = 0
+  """ Decompressed size, if the file is compressed """
+  line_offsets: t.Optional['array.array[int]'] = None
+  """ Line start offsets followed by the file size (see utils.line_index), if
+  requested for an uncompressed file """
 
 def get_file_hash(file_path: pathlib.Path) -> bytes:
   """ Return an md5 from file contents.
@@ -14,6 +58,160 @@ def get_file_hash(file_path: pathlib.Path) -> bytes:
 
     return md5.digest()
 
+def _summarize_stream(fobj: t.BinaryIO,
+    line_offsets: t.Optional['array.array[int]'] = None
+    ) -> tuple[bytes, int, int, bytes]:
+  """ Return the hash, size, row count, and sample of a binary stream.
+  Line start offsets are appended to `line_offsets`, if provided.
+  """
+  md5 = hashlib.md5()
+  size = 0
+  rows = 0
+  sample = b''
+  last_byte = b''
+
+  while chunk := fobj.read(READ_BUFFER_SIZE):
+    md5.update(chunk)
+    if line_offsets is not None:
+      line_index.find_line_offsets(chunk, size, line_offsets)
+    size += len(chunk)
+    rows += chunk.count(b'\n')
+
+    if len(sample) < SAMPLE_SIZE:
+      # Decompressors might return less than the requested size
+      sample += chunk[:SAMPLE_SIZE - len(sample)]
+    last_byte = chunk[-1:]
+
+  # The last line doesn't necessarily end with a newline
+  if last_byte and last_byte != b'\n':
+    rows += 1
+
+    if line_offsets is not None:
+      line_offsets.append(size)
+
+  return (md5.digest(), size, rows, sample)
+
+def get_file_summary(file_path: pathlib.Path, index_lines: bool = False
+    ) -> FileSummary:
+  """ Return the hash, size, row count, and sample of a file in a single read.
+  Rows are counted as raw newline bytes, so there's no need to decode the file.
+  Compressed files are decompressed as they're read; the hash and size are of
+  the file as stored, while the rows and sample are of the decompressed
+  contents (which are also hashed and sized).
+  If `index_lines` is set then uncompressed files also get their line offsets.
+  Compressed files can't be read at an offset so they aren't indexed.
+  """
+  file_compression = compression.detect(file_path)
+
+  if file_compression == protos.File.COMPRESSION_NONE:
+    line_offsets = array.array('Q', [0]) if index_lines else None
+
+    with open(file_path, 'rb') as fobj:
+      return FileSummary(*_summarize_stream(fobj, line_offsets),
+                         line_offsets=line_offsets)
+
+  if file_compression == protos.File.ZIP:
+    # Zip archives need random access, so the archive is hashed separately
+    raw_hash = get_file_hash(file_path)
+    raw_size = file_path.stat().st_size
+
+    with compression.open_binary(file_path, file_compression) as fobj:
+      content = _summarize_stream(fobj)
+  else:
+    # Hash the compressed bytes as the decompressor reads them
+    raw = compression.HashingReader(t.cast(t.BinaryIO, open(file_path, 'rb')))
+    with raw, compression.wrap_binary(t.cast(t.BinaryIO, raw),
+                                      file_compression) as fobj:
+      content = _summarize_stream(fobj)
+
+      # Include anything after the end of the compressed stream
+      while raw.read(READ_BUFFER_SIZE):
+        pass
+
+    raw_hash = raw.md5.digest()
+    raw_size = raw.size_bytes
+
+  content_hash, content_size, rows, sample = content
+
+  return FileSummary(raw_hash, raw_size, rows, sample, file_compression,
+                     content_hash, content_size)
+
+def is_combinable_pattern(pattern: str) -> bool:
+  """ Return whether a pattern can be combined into an alternation with others.
+  Patterns with their own named groups or backreferences can't be safely
+  combined (group names could collide and group numbers are shifted), and
+  neither can patterns with inline flags, since global flags are only allowed
+  at the start of the combined pattern.
+  """
+  return not _UNCOMBINABLE_RE.search(pattern)
+
 def get_dict_hash(dct: dict[str, str]) -> bytes:
   """ Return an md5 hash of a dictionary. """
   return hashlib.md5(json.dumps(dct, sort_keys=True).encode()).digest()
+
+
+def move_file(src_file: pathlib.Path, dest_file: pathlib.Path
+    ) -> 'protos.CopyLog.EvaluatedFile.MoveStrategy':
+  """ Move a file, avoiding a byte copy wherever possible.
+  Tries an atomic rename, then a hardlink and unlink (which some network and
+  overlay filesystems allow when they refuse a rename), and finally copies the
+  file for moves across filesystems. Returns the strategy that was used.
+  If the source can't be removed after it was linked or copied then the
+  destination is removed, so the file is never in both directories.
+  """
+  try:
+    os.rename(src_file, dest_file)
+    return protos.CopyLog.EvaluatedFile.RENAME
+  except OSError as exc:
+    if exc.errno not in _CROSS_DEVICE_ERRNOS:
+      raise
+
+  try:
+    os.link(src_file, dest_file)
+  except OSError as exc:
+    if exc.errno not in _CROSS_DEVICE_ERRNOS:
+      raise
+  else:
+    _unlink_source(src_file, dest_file)
+    return protos.CopyLog.EvaluatedFile.HARDLINK
+
+  try:
+    _copy_file(src_file, dest_file)
+  except BaseException:
+    # Don't leave a partial copy behind
+    dest_file.unlink(missing_ok=True)
+    raise
+
+  _unlink_source(src_file, dest_file)
+  return protos.CopyLog.EvaluatedFile.COPY
+
+def _unlink_source(src_file: pathlib.Path, dest_file: pathlib.Path) -> None:
+  """ Remove a moved file's source, or else its destination. """
+  try:
+    os.unlink(src_file)
+  except BaseException:
+    dest_file.unlink(missing_ok=True)
+    raise
+
+def _copy_file(src_file: pathlib.Path, dest_file: pathlib.Path) -> None:
+  """ Copy a file's contents and metadata, keeping the bytes in the kernel.
+  Uses copy_file_range() (which can also reflink or copy server-side on some
+  filesystems), then sendfile(), then a regular userspace copy.
+  """
+  with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+    src_fd = src.fileno()
+    dest_fd = dest.fileno()
+
+    try:
+      while os.copy_file_range(src_fd, dest_fd, READ_BUFFER_SIZE * 64):
+        pass
+    except (AttributeError, OSError):
+      # Unsupported by the platform, kernel, or filesystem. Resume from the
+      # current offsets since some bytes might have been copied.
+      try:
+        while os.sendfile(dest_fd, src_fd, None, READ_BUFFER_SIZE * 64):
+          pass
+      except (AttributeError, OSError):
+        shutil.copyfileobj(src, dest, READ_BUFFER_SIZE)
+
+  shutil.copystat(src_file, dest_file)
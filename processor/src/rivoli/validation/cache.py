@@ -0,0 +1,135 @@
+""" Cache of pure validation functions' results.
+A pure function's result only depends on its input value and its parameters,
+and partner files repeat values heavily, so each distinct value only needs to
+be validated once. Results are kept in a bounded LRU for the run, which can be
+backed by a Redis cache shared by workers and files. Besides values, the cache
+keeps ValidationErrors, which are raised again for the cached value.
+"""
+import collections
+import hashlib
+import json
+import typing as t
+
+import redis
+
+from rivoli import config
+from rivoli import protos
+from rivoli.function_helpers import exceptions
+from rivoli.utils import logging
+
+logger = logging.get_logger(__name__)
+
+CACHE_SIZE = int(config.get('VALIDATION_CACHE_SIZE', '100000'))
+""" Results kept for the run, per Validator. """
+
+REDIS_URL = config.get('VALIDATION_CACHE_REDIS_URL', strict=False) or ''
+""" Redis for results shared by workers and files. Empty disables it. """
+
+REDIS_TTL = int(config.get('VALIDATION_CACHE_TTL', '86400'))
+""" Seconds that results are kept in Redis. """
+
+_REDIS_PREFIX = 'rivoli:validation:'
+
+Key = tuple[str, str]
+""" (function key, input value) """
+
+class Result(t.NamedTuple):
+  """ A function's return value, or the message of its ValidationError. """
+  value: str = ''
+  error: t.Optional[str] = None
+  summary: str = ''
+  error_code: int = protos.ProcessingLog.OTHER_VALIDATION_ERROR
+
+  def replay(self, value: str) -> str:
+    """ Return the cached value, or raise the cached ValidationError. """
+    del value
+
+    if self.error is not None:
+      raise exceptions.ValidationError(self.error, summary=self.summary,
+                                       error_code=self.error_code)
+
+    return self.value
+
+def get_function_key(cfg: protos.FunctionConfig,
+    function: protos.Function) -> str:
+  """ Return the key of a configured function, for its cached results.
+  The key includes the function's statement and the configured parameters, so
+  that results aren't shared after either changes.
+  """
+  statement = function.WhichOneof('functionStatement') or ''
+  return json.dumps([function.id, getattr(function, statement, ''),
+                     list(cfg.parameters)])
+
+def get_error_result(exc: exceptions.ValidationError) -> t.Optional[Result]:
+  """ Return the cacheable Result of a ValidationError, if it's cacheable.
+  Subclasses, and errors with API logs, can't be replayed exactly.
+  """
+  if type(exc) is not exceptions.ValidationError or exc.api_log_id:
+    return None
+
+  return Result(error=str(exc), summary=exc.summary,
+                error_code=int(exc.error_code))
+
+class ResultCache():
+  """ LRU cache of Results, optionally backed by Redis. """
+  def __init__(self, size: int = CACHE_SIZE, redis_url: str = REDIS_URL,
+               ttl: int = REDIS_TTL) -> None:
+    self._results: collections.OrderedDict[Key, Result] = (
+        collections.OrderedDict())
+    self._size = size
+    self._ttl = ttl
+
+    self._redis: t.Optional[redis.Redis] = (
+        redis.Redis.from_url(redis_url) if redis_url else None)
+
+  def get(self, key: Key) -> t.Optional[Result]:
+    """ Return the cached Result, if there is one. """
+    result = self._results.get(key)
+    if result is not None:
+      self._results.move_to_end(key)
+      return result
+
+    if not self._redis:
+      return None
+
+    try:
+      data = self._redis.get(self._get_redis_key(key))
+    except redis.RedisError as exc:
+      self._disable_redis(exc)
+      return None
+
+    if data is None:
+      return None
+
+    result = Result(*json.loads(data))
+    self._add(key, result)
+    return result
+
+  def set(self, key: Key, result: Result) -> None:
+    """ Cache a Result. """
+    self._add(key, result)
+
+    if not self._redis:
+      return
+
+    try:
+      self._redis.set(self._get_redis_key(key), json.dumps(result),
+                      ex=self._ttl)
+    except redis.RedisError as exc:
+      self._disable_redis(exc)
+
+  def _add(self, key: Key, result: Result) -> None:
+    self._results[key] = result
+
+    if len(self._results) > self._size:
+      self._results.popitem(last=False)
+
+  def _get_redis_key(self, key: Key) -> str:
+    """ Redis keys are hashed, since values could be long. """
+    digest = hashlib.blake2b(json.dumps(key).encode(), digest_size=16)
+    return _REDIS_PREFIX + digest.hexdigest()
+
+  def _disable_redis(self, exc: Exception) -> None:
+    """ Stop using Redis for the rest of the run, which is still cached. """
+    logger.warning('Disabling the shared validation cache: %s', exc)
+    self._redis = None
@@ -1,4 +1,5 @@
 """ Module responsible for functions that call the actual validation. """
+import functools
 import types
 import typing as t
 
@@ -39,3 +40,22 @@ def call_function(function_type: protos.Function.FunctionType,
   mod = HANDLER_MODULE_MAP[function.WhichOneof('functionStatement')]
   func = getattr(mod, funcname)
   return func(cfg, function, *args, **kwargs)
+
+def bind_function(function_type: protos.Function.FunctionType,
+    cfg: protos.FunctionConfig, function: protos.Function
+    ) -> t.Callable[..., typing.ValReturn]:
+  """ Resolve a "function" through a handler once, to call it many times.
+  The returned callable takes the same arguments as call_function() after
+  `function`. Handlers can bind a function themselves, e.g. to only import it
+  and convert its parameters once, with a `bind_<function type>` function.
+  Otherwise the handler function is bound to the FunctionConfig and Function.
+  Any exception from resolving the function (e.g., a ConfigurationError) is
+  raised here rather than by the call.
+  """
+  funcname = protos.Function.FunctionType.Name(function_type).lower()
+  mod = HANDLER_MODULE_MAP[function.WhichOneof('functionStatement')]
+
+  if binder := getattr(mod, f'bind_{funcname}', None):
+    return binder(cfg, function)
+
+  return functools.partial(getattr(mod, funcname), cfg, function)
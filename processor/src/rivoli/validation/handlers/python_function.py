@@ -34,10 +34,13 @@ Parameters = list[t.Union[str, int, float, bool, protos.Function, enum.EnumMeta]
 # automatically?
 # Probably not?
 
-def _call_python_function(cfg: protos.FunctionConfig,
-    function_msg: protos.Function, value: FunctionInputValue
-    ) -> t.Union[str, dict[str, str]]:
-  """ Call a python function.
+def _bind_python_function(cfg: protos.FunctionConfig,
+    function_msg: protos.Function
+    ) -> t.Callable[[FunctionInputValue], t.Union[str, dict[str, str]]]:
+  """ Import a python function and bind its parameters.
+  The returned callable only takes the value, so that a function which is
+  called for many values is only imported and has its parameters converted
+  once.
   """
   fq_fn_pieces = function_msg.pythonFunction.split('.')
   # Remove the function name and leave the package + module
@@ -52,13 +55,28 @@ def _call_python_function(cfg: protos.FunctionConfig,
       f'Python function module {module_name} could not be imported')
 
   # Get the function from the module
-  func: t.Callable[[t.Any], str] = getattr(mod, fq_fn_pieces[-1])
+  func: t.Callable[..., t.Union[str, dict[str, str]]] = getattr(
+      mod, fq_fn_pieces[-1])
   # Create parameters list from the Function and FunctionConfig messages
   # Parameters are set by the user in the Config message
   fn_parameters = _create_parameters(func, cfg, function_msg)
 
+  return lambda value: func(value, *fn_parameters)
+
+def _call_python_function(cfg: protos.FunctionConfig,
+    function_msg: protos.Function, value: FunctionInputValue
+    ) -> t.Union[str, dict[str, str]]:
+  """ Call a python function.
+  """
   # Call the python function and return
-  return func(value, *fn_parameters)
+  return _bind_python_function(cfg, function_msg)(value)
+
+def bind_field_validation(cfg: protos.FunctionConfig,
+    function_msg: protos.Function) -> t.Callable[[str], str]:
+  """ Bind field_validation() to a FunctionConfig, to validate many values. """
+  func = _bind_python_function(cfg, function_msg)
+
+  return lambda value: str(func(value))
 
 def field_validation(cfg: protos.FunctionConfig,
     function_msg: protos.Function, value: str) -> str:
@@ -66,7 +84,25 @@ def field_validation(cfg: protos.FunctionConfig,
   "Validation" could also modify the field. We return the function result
   regardless.
   """
-  return str(_call_python_function(cfg, function_msg, value))
+  return bind_field_validation(cfg, function_msg)(value)
+
+def bind_record_validation(cfg: protos.FunctionConfig,
+    function_msg: protos.Function
+    ) -> t.Callable[[helpers.Record], typing.ValRecordReturn]:
+  """ Bind record_validation() to a FunctionConfig, to validate many records.
+  """
+  func = _bind_python_function(cfg, function_msg)
+
+  def validate(record: helpers.Record) -> typing.ValRecordReturn:
+    result = func(record)
+
+    if not typing.is_typing_instance(result, typing.ValRecordReturn):
+      raise TypeError((f'Python function returned a {type(result)} instead '
+                       f'of {typing.ValRecordReturn}'))
+
+    return t.cast(typing.ValRecordReturn, result)
+
+  return validate
 
 def record_validation(cfg: protos.FunctionConfig,
     function_msg: protos.Function, record: helpers.Record
@@ -76,13 +112,7 @@ def record_validation(cfg: protos.FunctionConfig,
   those validations did not raise an exception.
   "Validation" could also modify the record. We return the entire record dict.
   """
-  result = _call_python_function(cfg, function_msg, record)
-
-  if not typing.is_typing_instance(result, typing.ValRecordReturn):
-    raise TypeError((f'Python function returned a {type(result)} instead '
-                     f'of {typing.ValRecordReturn}'))
-
-  return t.cast(typing.ValRecordReturn, result)
+  return bind_record_validation(cfg, function_msg)(record)
 
 def record_upload(cfg: protos.FunctionConfig, function_msg: protos.Function,
     records: list[helpers.Record]) -> str:
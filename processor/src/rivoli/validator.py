@@ -2,16 +2,18 @@
 import collections
 import typing as t
 
+import celery
 import pymongo
 
 from rivoli import admin_entities
 from rivoli.protobson import bson_format
 from rivoli import protos
-from rivoli import db
 from rivoli.record_processor import db_chunk_processor
+from rivoli.record_processor import record_processor
 from rivoli import status_scheduler
 from rivoli.function_helpers import exceptions
 from rivoli.function_helpers import helpers
+from rivoli.validation import cache
 from rivoli.validation import handler
 from rivoli.validation import typing
 from rivoli.utils import processing
@@ -23,23 +25,81 @@ from rivoli.utils import tasks
 # pyright: reportFunctionMemberAccess=false
 # pyright: reportUnknownMemberType=false
 
+class _BoundValidation(t.NamedTuple):
+  """ A validation's FunctionConfig and its function, resolved once per run.
+  """
+  cfg: protos.FunctionConfig
+  call: t.Callable[..., typing.ValReturn]
+  cache_key: str = ''
+  """ Key for the function's cached results, if it's a pure field validation
+  """
+
+def _raise_on_call(exc: Exception) -> t.Callable[..., t.NoReturn]:
+  """ Return a callable which raises an exception from binding a function, so
+  that the exception is handled like one from calling the function. """
+  def call(*args: t.Any) -> t.NoReturn:
+    del args
+    raise exc
+
+  return call
+
 @tasks.app.task
 def validate(file_id: int) -> None:
-  mydb = db.get_db()
+  """ Validate a file's parsed Records.
+  Large files might be split into shards which are validated by separate
+  tasks, in which case finish_validate_shards() schedules the next step.
+  """
+  file, partner, filetype = admin_entities.get_file_entities(file_id)
+
+  v = Validator(file, partner, filetype,
+                shard_records=db_chunk_processor.SHARD_RECORDS)
+  v.process()
+
+  if v.shards and file.status == protos.File.VALIDATING:
+    celery.chord(validate_shard.s(file_id, start, end)
+                 for start, end in v.shards)(
+        finish_validate_shards.s(file_id).on_error(
+            fail_validate_shards.s(file_id)))
+    return
 
-  file = bson_format.to_proto(protos.File,
-      mydb.files.find_one({'_id': file_id}))
+  status_scheduler.next_step(file, filetype)
 
-  # get the filetype config
-  partner = admin_entities.get_partner(file.partnerId)
-  filetype = admin_entities.get_filetype(file.fileTypeId)
+@tasks.app.task(ignore_result=False)
+def validate_shard(file_id: int, start_line: int, end_line: int
+    ) -> dict[str, t.Any]:
+  """ Validate a shard of a file's Records as part of a parallel validation.
+  Returns the shard's status, stats and logs.
+  """
+  file, partner, filetype = admin_entities.get_file_entities(file_id)
 
-  #_validate(file, ft)
-  v = Validator(file, partner, filetype)
+  v = Validator(file, partner, filetype, shard=(start_line, end_line))
   v.process()
 
+  return v.get_shard_result()
+
+@tasks.app.task
+def finish_validate_shards(results: list[dict[str, t.Any]], file_id: int
+    ) -> None:
+  """ Complete a parallel validation once all of the shards are validated. """
+  file, partner, filetype = admin_entities.get_file_entities(file_id)
+
+  if file.status == protos.File.VALIDATING:
+    Validator(file, partner, filetype).finish_shards(results)
+
   status_scheduler.next_step(file, filetype)
 
+@tasks.app.task
+def fail_validate_shards(request: t.Any, exc: BaseException,
+                         traceback: t.Any, file_id: int):
+  """ Error callback for a parallel validation.
+  Called if a shard's task or finish_validate_shards() raised, which would
+  otherwise leave the File VALIDATING.
+  """
+  del request, traceback
+  record_processor.fail_file(file_id, protos.File.VALIDATING,
+                             protos.File.VALIDATE_ERROR,
+                             protos.ProcessingLog.VALIDATOR, exc)
+
 class Validator(db_chunk_processor.DbChunkProcessor):
   """ Class to validate records.
   No need to subclass this as validation will not differ by file type. """
@@ -54,10 +114,12 @@ class Validator(db_chunk_processor.DbChunkProcessor):
   _record_error_status = protos.Record.VALIDATION_ERROR
 
   _step_stat_prefix = 'VALIDATE'
+  _finished_message = 'Validated records'
 
   def __init__(self, file: protos.File, partner: protos.Partner,
-      filetype: protos.FileType) -> None:
-    super().__init__(file, partner, filetype)
+      filetype: protos.FileType, shard_records: int = 0,
+      shard: t.Optional[tuple[int, int]] = None) -> None:
+    super().__init__(file, partner, filetype, shard_records, shard)
 
     self.errors: list[protos.ProcessingLog] = []
     """ Accumulation of a Record's errors. """
@@ -68,9 +130,14 @@ class Validator(db_chunk_processor.DbChunkProcessor):
     self._field_name_ids: dict[str, str] = {}
     """ Map of field names to field IDs. """
 
-    # Dict in the form of dct[RecordTypeId, dct[FieldTypeId, functionconfigs]
-    self.field_validations: dict[int, dict[str, list[protos.FunctionConfig]]] = \
+    self._cache = cache.ResultCache()
+    """ Results of pure field validation functions. """
+
+    # Dict in the form of dct[RecordTypeId, dct[FieldTypeId, validations]
+    self.field_validations: dict[int, dict[str, list[_BoundValidation]]] = \
         collections.defaultdict(lambda: collections.defaultdict(list))
+    self.record_validations: dict[int, list[_BoundValidation]] = {}
+    """ Record validations by RecordType ID. """
 
     # Keep track of every field name output from the validation function(s).
     # In most cases this will be the same as the input (parsed) fields, but
@@ -85,23 +152,29 @@ class Validator(db_chunk_processor.DbChunkProcessor):
     function_ids: set[str] = set()
 
     # 1) Get all function_ids that we'll need so that we can create a dict
-    # 2) Create a mapping of this file's FieldTypes to list of
-    #    validation configurations. We already have a recordtypes_map
+    # 2) Create a mapping of this file's FieldTypes to list of validations,
+    #    with their functions bound. We already have a recordtypes_map
     for recordtype in self.filetype.recordTypes:
       function_ids.update([val.functionId for val in recordtype.validations])
 
       for fieldtype in recordtype.fieldTypes:
         self._field_name_ids[fieldtype.name] = fieldtype.id
-
-        for validation in fieldtype.validations:
-          self.field_validations[recordtype.id][fieldtype.name].append(
-              validation)
-          function_ids.add(validation.functionId)
+        function_ids.update([val.functionId for val in fieldtype.validations])
 
     self._functions = admin_entities.get_functions_by_ids(function_ids)
     self._all_fields = [field for func in self._functions.values()
                         for field in func.fieldsOut]
 
+    for recordtype in self.filetype.recordTypes:
+      self.record_validations[recordtype.id] = [
+          self._bind_function(protos.Function.RECORD_VALIDATION, cfg)
+          for cfg in recordtype.validations]
+
+      for fieldtype in recordtype.fieldTypes:
+        self.field_validations[recordtype.id][fieldtype.name].extend(
+            self._bind_function(protos.Function.FIELD_VALIDATION, cfg)
+            for cfg in fieldtype.validations)
+
     self._clear_stats('VALIDATE')
     del self.file.validatedColumns[:]
 
@@ -115,7 +188,7 @@ class Validator(db_chunk_processor.DbChunkProcessor):
     # Then do we go onto processing or place it on PROCESSING_HOLD?
 
     # Final update to the File record
-    self.file.log.append(self._make_log_entry(False, 'Validated records'))
+    self._log_finished()
     self.file.validatedColumns.extend(list(self._validated_field_keys.keys()))
 
   # Will also need an entrypoint to call this so that the UI can try to
@@ -142,13 +215,14 @@ class Validator(db_chunk_processor.DbChunkProcessor):
       ss_field = self._get_step_stat(raw_record.recordType, field_id)
       ss_field.input += 1
 
-      for cfg in self.field_validations[record_type_id][field_name]:
+      for validation in self.field_validations[record_type_id][field_name]:
         ss_field_func = self._get_step_stat(
-            raw_record.recordType, field_id, cfg.id)
+            raw_record.recordType, field_id, validation.cfg.id)
         ss_field_func.input += 1
 
         try:
-          value = self._validate_field(cfg, value, field_name)
+          value = self._validate_field(validation, value, field_name,
+                                       ss_field_func)
           ss_field.success += 1
           ss_field_func.success += 1
         except Exception as exc: # pylint: disable=broad-exception-caught
@@ -176,15 +250,16 @@ class Validator(db_chunk_processor.DbChunkProcessor):
     record.update(validated_fields)
 
     if not self.errors:
-      for cfg in self.recordtypes_map[record_type_id].validations:
-        ss_record_func = self._get_step_stat(raw_record.recordType, cfg.id)
+      for validation in self.record_validations[record_type_id]:
+        ss_record_func = self._get_step_stat(raw_record.recordType,
+                                             validation.cfg.id)
         ss_record_func.input += 1
 
         try:
-          fields = self._functions[cfg.functionId].fieldsIn
+          fields = self._functions[validation.cfg.functionId].fieldsIn
           record.coerce_fields(fields)
 
-          validated_fields = self._validate_record(cfg, record)
+          validated_fields = self._validate_record(validation, record)
           ss_record_func.success += 1
         except Exception as exc: # pylint: disable=broad-exception-caught
           ss_record_func.failure += 1
@@ -238,9 +313,15 @@ class Validator(db_chunk_processor.DbChunkProcessor):
 
       step_stat.failure += 1
 
+    update_fields = ['status', 'validatedFields', 'log', 'recentErrors']
+
+    if record_hash := self.fingerprinter.validated(
+        record.updated_record.validatedFields):
+      record.updated_record.hash = record_hash
+      update_fields.append('hash')
+
     # update the record
-    update = self._make_update(record.updated_record,
-        ['status', 'validatedFields', 'log', 'recentErrors'])
+    update = self._make_update(record.updated_record, update_fields)
 
     # file_exception is any exception that's of a type that's not a record-
     # level exception and thus needs to be handled up-stack. If that was set
@@ -253,19 +334,60 @@ class Validator(db_chunk_processor.DbChunkProcessor):
 
     return update
 
-  def _validate_field(self, cfg: 'protos.FunctionConfig', value: str,
-      field_name: str) -> str:
-    """ Validate a field. """
-    ret_value = self._call_function(protos.Function.FIELD_VALIDATION, cfg,
-                                    value, field_name)
-    # FIELD_VALIDATION will always return a string
-    return t.cast(str, ret_value)
+  def _bind_function(self, typ: 'protos.Function.FunctionType',
+      cfg: 'protos.FunctionConfig') -> _BoundValidation:
+    """ Resolve a validation's function once, rather than for every value.
+    Exceptions from resolving the function are raised when it's called, so
+    that they're logged on the Records like any other exception.
+    """
+    if cfg.functionId not in self._functions:
+      # _call_function() raises a KeyError before calling it
+      return _BoundValidation(cfg, _raise_on_call(KeyError(cfg.functionId)))
+
+    function = self._functions[cfg.functionId]
+    try:
+      call = handler.bind_function(typ, cfg, function)
+    except Exception as exc: # pylint: disable=broad-exception-caught
+      call = _raise_on_call(exc)
+
+    cache_key = ''
+    if function.pure and typ == protos.Function.FIELD_VALIDATION:
+      cache_key = cache.get_function_key(cfg, function)
+
+    return _BoundValidation(cfg, call, cache_key)
+
+  def _validate_field(self, validation: _BoundValidation, value: str,
+      field_name: str, step_stat: protos.StepStats) -> str:
+    """ Validate a field.
+    Results of pure functions are cached, including ValidationErrors, which
+    are raised again (and logged and counted) like the original.
+    """
+    if not validation.cache_key:
+      # FIELD_VALIDATION will always return a string
+      return t.cast(str, self._call_function(validation, value, field_name))
+
+    key = (validation.cache_key, value)
+    if result := self._cache.get(key):
+      step_stat.cacheHits += 1
+      return t.cast(str, self._call_function(validation, value, field_name,
+                                             result.replay))
+
+    step_stat.cacheMisses += 1
+    try:
+      ret_value = t.cast(str, self._call_function(validation, value,
+                                                  field_name))
+    except exceptions.ValidationError as exc:
+      if error_result := cache.get_error_result(exc):
+        self._cache.set(key, error_result)
+      raise
+
+    self._cache.set(key, cache.Result(ret_value))
+    return ret_value
 
-  def _validate_record(self, cfg: 'protos.FunctionConfig',
+  def _validate_record(self, validation: _BoundValidation,
                        record: helpers.Record) -> dict[str, str]:
     """ Validate a record and coerce the return value to a dict.  """
-    ret_val = self._call_function(protos.Function.RECORD_VALIDATION, cfg,
-                                  record)
+    ret_val = self._call_function(validation, record)
     # If None is returned then use the "input" fields
     # If the function doesn't want to modify the Record values then it can
     # simply return None and we will return the original record.
@@ -281,13 +403,16 @@ class Validator(db_chunk_processor.DbChunkProcessor):
     # `str but that's not allowed for RECORD_VALIDATION
     return t.cast(dict[str, str], ret_val)
 
-  def _call_function(self, typ: 'protos.Function.FunctionType',
-      cfg: 'protos.FunctionConfig', value: typing.ValInput,
-      field_name: str = '') -> typing.ValReturn:
-    """ Call a validation function, handle exceptions, and return result. """
-    validator = self._functions[cfg.functionId]
+  def _call_function(self, validation: _BoundValidation,
+      value: typing.ValInput, field_name: str = '',
+      call: t.Optional[t.Callable[..., typing.ValReturn]] = None
+      ) -> typing.ValReturn:
+    """ Call a validation function, handle exceptions, and return result.
+    `call` replaces the bound function, e.g. to replay a cached result.
+    """
+    validator = self._functions[validation.cfg.functionId]
     try:
-      return handler.call_function(typ, cfg, validator, value)
+      return (call or validation.call)(value)
 
     except Exception as exc:
       self.errors.append(self._make_exc_log_entry(exc, field=field_name,
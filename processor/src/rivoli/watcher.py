@@ -0,0 +1,47 @@
+""" Watch the input directory and route new files as soon as they arrive.
+This is a long-running process (rather than a Celery task) which schedules a
+copier.scan_file() task for each file that's written to, or moved into, the
+input directory. The periodic copier scan still runs as a (low-frequency)
+fallback to reconcile anything that the watcher missed.
+
+Run with `python -m rivoli.watcher`.
+"""
+from rivoli import copier
+from rivoli.utils import inotify
+from rivoli.utils import logging
+
+logger = logging.get_logger(__name__)
+
+# Disable pyright checks due to Celery
+# pyright: reportFunctionMemberAccess=false
+
+WATCH_MASK = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO
+""" Events for a complete file in the directory. """
+
+def watch() -> None:
+  """ Watch the input directory forever. """
+  input_dir = copier.get_input_dir()
+
+  with inotify.Inotify() as notifier:
+    notifier.add_watch(input_dir, WATCH_MASK)
+    logger.info('Watching %s for new files', input_dir)
+
+    # Files might have arrived while the watcher wasn't running
+    copier.scan_all.delay()
+
+    while True:
+      for event in notifier.read_events():
+        if event.mask & inotify.IN_Q_OVERFLOW:
+          # Events were dropped so fall back to scanning the whole directory
+          logger.warning('inotify queue overflowed; scheduling a full scan')
+          copier.scan_all.delay()
+          continue
+
+        if event.mask & inotify.IN_ISDIR or not event.name:
+          continue
+
+        logger.info('Found new file: %s', event.name)
+        copier.scan_file.delay(event.name)
+
+if __name__ == '__main__':
+  watch()
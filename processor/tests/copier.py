@@ -0,0 +1,468 @@
+""" Unit tests for rivoli.copier. """
+import itertools
+import pathlib
+import tempfile
+import time
+import typing as t
+import unittest
+from unittest import mock
+
+from rivoli import copier
+from rivoli import protos
+from rivoli.protobson import bson_format
+from rivoli.utils import line_index
+
+import tests
+
+# pylint: disable=protected-access
+# pyright: reportPrivateUsage=false
+
+def _get_partners() -> list[protos.Partner]:
+  return [
+    protos.Partner(id='pABC', fileTypes=[
+        protos.FileType(id='ftA1', fileMatches=['abc_.*\\.csv', 'abc.txt']),
+        protos.FileType(id='ftA2', fileMatches=['(abc|xyz)_.*\\.dat']),
+    ]),
+    protos.Partner(id='pXYZ', fileTypes=[
+        protos.FileType(id='ftX1', fileMatches=['xyz_.*\\.dat', 'xyz.csv']),
+        protos.FileType(id='ftX2',
+                        fileMatches=['(?P<pre>q)_(?P=pre)\\.csv']),
+    ]),
+  ]
+
+class FileMatcherTests(unittest.TestCase):
+  def test_match(self):
+    matcher = copier.FileMatcher(_get_partners())
+
+    def _match(name: str):
+      match = matcher.match(name)
+      return (match[0].id, match[1].id) if match else None
+
+    self.assertEqual(_match('abc_1.csv'), ('pABC', 'ftA1'))
+    self.assertEqual(_match('abc.txt'), ('pABC', 'ftA1'))
+    # Patterns with groups map back to the wrapping group
+    self.assertEqual(_match('abc_1.dat'), ('pABC', 'ftA2'))
+    # Earlier partners' patterns take precedence
+    self.assertEqual(_match('xyz_1.dat'), ('pABC', 'ftA2'))
+    self.assertEqual(_match('xyz.csv'), ('pXYZ', 'ftX1'))
+    # Backreferences are matched individually
+    self.assertEqual(_match('q_q.csv'), ('pXYZ', 'ftX2'))
+
+    # Patterns must match the entire name
+    self.assertIsNone(_match('abc.txt.bak'))
+    self.assertIsNone(_match('other.csv'))
+
+  def test_inline_flags(self):
+    # Global flags are only allowed at the start of the combined pattern, so
+    # they don't break other partners' patterns
+    partners = _get_partners()
+    partners[0].fileTypes[0].fileMatches.insert(0, r'(?i)report.*\.csv')
+    matcher = copier.FileMatcher(partners)
+
+    def _match(name: str):
+      match = matcher.match(name)
+      return (match[0].id, match[1].id) if match else None
+
+    # The flagged pattern, the combined run, and the backreference
+    self.assertEqual(len(matcher._segments), 3)
+    self.assertEqual(_match('REPORT_1.CSV'), ('pABC', 'ftA1'))
+    self.assertEqual(_match('xyz.csv'), ('pXYZ', 'ftX1'))
+    self.assertEqual(_match('q_q.csv'), ('pXYZ', 'ftX2'))
+
+  def test_uncombinable_order(self):
+    # Patterns which are matched individually keep their precedence
+    partners = _get_partners()
+    partners[0].fileTypes[1].fileMatches.append(r'(?i)xyz\.csv')
+    partners[1].fileTypes[0].fileMatches.append(r'(?P<d>[0-9])_(?P=d)\.txt')
+    matcher = copier.FileMatcher(partners)
+
+    def _match(name: str):
+      match = matcher.match(name)
+      return (match[0].id, match[1].id) if match else None
+
+    self.assertEqual(len(matcher._segments), 5)
+    # The earlier partner's flagged pattern wins over the later plain one
+    self.assertEqual(_match('xyz.csv'), ('pABC', 'ftA2'))
+    self.assertEqual(_match('XYZ.CSV'), ('pABC', 'ftA2'))
+    # Patterns after an individual pattern are still matched
+    self.assertEqual(_match('xyz_1.dat'), ('pABC', 'ftA2'))
+    self.assertEqual(_match('1_1.txt'), ('pXYZ', 'ftX1'))
+    self.assertEqual(_match('q_q.csv'), ('pXYZ', 'ftX2'))
+    self.assertIsNone(_match('1_2.txt'))
+
+  def test_no_patterns(self):
+    matcher = copier.FileMatcher([protos.Partner(id='pABC')])
+    self.assertIsNone(matcher.match('abc.csv'))
+
+@mock.patch('rivoli.copier.db')
+class InputDirScannerTests(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self.input_dir = pathlib.Path(self._tmpdir.name)
+
+    self.scanner = copier.InputDirScanner(_get_partners(), self.input_dir)
+
+  def tearDown(self):
+    self._tmpdir.cleanup()
+
+  def _make_index_doc(self, path: pathlib.Path) -> dict[str, object]:
+    stat = path.stat()
+    return bson_format.from_proto(protos.ScanIndexEntry(
+        id=path.name, name=path.name,
+        inode=stat.st_ino, sizeBytes=stat.st_size, mtimeNs=stat.st_mtime_ns,
+        matchesHash=self.scanner._get_matches_hash()))
+
+  def test_scan_skips_indexed_files(self, mocked_db: mock.Mock):
+    indexed = self.input_dir / 'abc_indexed.csv'
+    indexed.write_text('a,b\n')
+    existing = self.input_dir / 'xyz.csv'
+    existing.write_text('a,b\n')
+    unmatched = self.input_dir / 'unmatched.csv'
+    unmatched.write_text('a,b\n')
+
+    mocked_db.get_db().scanindex.find.return_value = [
+        self._make_index_doc(indexed),
+        # Stale entry for a file which is no longer in the directory
+        {'_id': 'gone.csv', 'name': 'gone.csv'},
+    ]
+    mocked_db.get_db().files.find.return_value = [
+        {'_id': 5, 'partnerId': 'pXYZ', 'name': 'xyz.csv'}]
+
+    self.scanner.scan(self.input_dir)
+
+    # Only the un-indexed, matching file is looked up, with a single query
+    files_find = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().files.find')
+    self.assertEqual(len(files_find), 1)
+    self.assertEqual(files_find[0][1][0],
+                     {'partnerId': {'$in': ['pXYZ']},
+                      'name': {'$in': ['xyz.csv']}})
+
+    logs = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().copylog.insert_many')[0][1][0]
+    logs = {log.get('partnerId', ''): log['files'] for log in logs}
+
+    self.assertEqual(len(logs['pXYZ']), 1)
+    self.assertEqual(logs['pXYZ'][0]['fileId'], 5)
+    self.assertEqual(logs['pXYZ'][0]['resolution'],
+                     protos.CopyLog.EvaluatedFile.FILE_EXISTS)
+    self.assertEqual(logs[''][0]['resolution'],
+                     protos.CopyLog.EvaluatedFile.NO_MATCH)
+    self.assertNotIn('pABC', logs)
+
+    # The evaluated files get indexed and the stale entry is removed
+    index_writes = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().scanindex.bulk_write')[0][1][0]
+    self.assertEqual(len(index_writes), 2)
+    delete = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().scanindex.delete_many')[0][1][0]
+    self.assertEqual(delete, {'_id': {'$in': ['gone.csv']}})
+
+  def test_scan_without_changes_skips_copylog(self, mocked_db: mock.Mock):
+    indexed = self.input_dir / 'abc_indexed.csv'
+    indexed.write_text('a,b\n')
+
+    mocked_db.get_db().scanindex.find.return_value = [
+        self._make_index_doc(indexed)]
+
+    self.scanner.scan(self.input_dir)
+
+    self.assertFalse(tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().copylog.insert_many'))
+    self.assertFalse(tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().files.find'))
+
+  def test_scan_reevaluates_changed_files(self, mocked_db: mock.Mock):
+    indexed = self.input_dir / 'unmatched.csv'
+    indexed.write_text('a,b\n')
+    index_doc = self._make_index_doc(indexed)
+    index_doc['sizeBytes'] = 1
+
+    mocked_db.get_db().scanindex.find.return_value = [index_doc]
+
+    self.scanner.scan(self.input_dir)
+
+    logs = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().copylog.insert_many')[0][1][0]
+    self.assertEqual(logs[0]['files'][0]['resolution'],
+                     protos.CopyLog.EvaluatedFile.NO_MATCH)
+
+  @mock.patch('rivoli.copier.status_scheduler')
+  def test_scan_copies_backlog(self, mocked_scheduler: mock.Mock,
+      mocked_db: mock.Mock):
+    dest_dir = pathlib.Path(self._tmpdir.name) / 'processed'
+    dest_dir.mkdir()
+    self.scanner = copier.InputDirScanner(_get_partners(), dest_dir)
+
+    for idx in range(20):
+      (self.input_dir / f'abc_{idx}.csv').write_text(f'{idx},b\n')
+
+    mocked_db.get_db().scanindex.find.return_value = []
+    mocked_db.get_db().files.find.return_value = []
+    mocked_db.get_db().files.find_one.return_value = None
+    mocked_db.get_next_id.side_effect = itertools.count(1)
+
+    self.scanner.scan(self.input_dir)
+
+    # Every file is copied and scheduled exactly once
+    self.assertEqual(len(list(dest_dir.glob('pABC/*/*/*.csv'))), 20)
+    self.assertFalse(list(self.input_dir.glob('*.csv')))
+    self.assertEqual(mocked_scheduler.next_step.call_count, 20)
+
+    logs = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().copylog.insert_many')[0][1][0]
+    self.assertEqual(len(logs[0]['files']), 20)
+    self.assertEqual(len({log['fileId'] for log in logs[0]['files']}), 20)
+    self.assertEqual({log['moveStrategy'] for log in logs[0]['files']},
+                     {protos.CopyLog.EvaluatedFile.RENAME})
+
+  @mock.patch('rivoli.copier.status_scheduler')
+  def test_scan_copies_identical_files(self, _: mock.Mock,
+      mocked_db: mock.Mock):
+    dest_dir = pathlib.Path(self._tmpdir.name) / 'processed'
+    dest_dir.mkdir()
+    self.scanner = copier.InputDirScanner(_get_partners(), dest_dir)
+    self.scanner._max_workers = 8
+
+    for idx in range(8):
+      (self.input_dir / f'abc_{idx}.csv').write_text('a,b\n')
+
+    inserted: list[dict[str, t.Any]] = []
+    def find_one(filter_: dict[str, t.Any], *_: t.Any, **__: t.Any):
+      # Give the other threads time to check for duplicates too
+      time.sleep(0.01)
+      return next(({'_id': doc['_id']} for doc in inserted
+                   if doc['hash'] == filter_['hash'] and
+                   doc.get('status') != protos.File.DUPLICATE), None)
+
+    mocked_db.get_db().scanindex.find.return_value = []
+    mocked_db.get_db().files.find.return_value = []
+    mocked_db.get_db().files.find_one.side_effect = find_one
+    mocked_db.get_db().files.insert_one.side_effect = inserted.append
+    mocked_db.get_next_id.side_effect = itertools.count(1)
+
+    self.scanner.scan(self.input_dir)
+
+    # Files in the same batch are still found to be duplicates
+    statuses = sorted(doc.get('status', 0) for doc in inserted)
+    self.assertEqual(statuses, [protos.File.NEW] + [protos.File.DUPLICATE] * 7)
+
+  def test_scan_logs_failed_copies(self, mocked_db: mock.Mock):
+    dest_dir = pathlib.Path(self._tmpdir.name) / 'processed'
+    dest_dir.mkdir()
+    self.scanner = copier.InputDirScanner(_get_partners(), dest_dir)
+    (self.input_dir / 'abc_1.csv').write_text('a,b\n')
+
+    mocked_db.get_db().scanindex.find.return_value = []
+    mocked_db.get_db().files.find.return_value = []
+
+    with mock.patch.object(copier.LocalFileCopier, 'create_file_record',
+                           side_effect=RuntimeError('No more IDs')):
+      self.scanner.scan(self.input_dir)
+
+    # The file was moved before it failed, so the log is all that's left of it
+    self.assertEqual(len(list(dest_dir.glob('pABC/*/*/*.tmp'))), 1)
+    logs = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().copylog.insert_many')[0][1][0]
+    filelog = logs[0]['files'][0]
+    self.assertEqual(logs[0]['partnerId'], 'pABC')
+    self.assertEqual(filelog['name'], 'abc_1.csv')
+    self.assertEqual(filelog['resolution'],
+                     protos.CopyLog.EvaluatedFile.FAILED)
+    self.assertEqual(filelog['moveStrategy'],
+                     protos.CopyLog.EvaluatedFile.RENAME)
+    self.assertEqual(filelog['error'], 'No more IDs')
+
+    # Failed files aren't indexed, so they're evaluated again
+    self.assertFalse(tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().scanindex.bulk_write'))
+
+  def test_scan_skips_removed_files(self, mocked_db: mock.Mock):
+    # Files can be removed (or claimed by another scan) after the listing
+    gone = self.input_dir / 'abc_gone.csv'
+    gone.write_text('a,b\n')
+    unmatched = self.input_dir / 'unmatched.csv'
+    unmatched.write_text('a,b\n')
+
+    changed_doc = self._make_index_doc(unmatched)
+    changed_doc['sizeBytes'] = 1
+    mocked_db.get_db().scanindex.find.return_value = [
+        self._make_index_doc(gone), changed_doc]
+    gone.unlink()
+
+    # The changed file is removed after it's evaluated, before it's indexed
+    evaluate_file = self.scanner.evaluate_file
+    def evaluate_and_remove(file: pathlib.Path, *args: t.Any):
+      filelog = evaluate_file(file, *args)
+      file.unlink()
+      return filelog
+
+    with mock.patch.object(self.scanner, 'evaluate_file',
+                           side_effect=evaluate_and_remove):
+      self.scanner._evaluate_files([gone, unmatched], prune_index=True)
+
+    logs = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().copylog.insert_many')[0][1][0]
+    self.assertEqual([filelog['name'] for filelog in logs[0]['files']],
+                     ['unmatched.csv'])
+
+    # Neither file is indexed, and both of their entries are removed
+    self.assertFalse(tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().scanindex.bulk_write'))
+    delete = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().scanindex.delete_many')[0][1][0]
+    self.assertEqual(delete, {'_id': {'$in': ['abc_gone.csv',
+                                              'unmatched.csv']}})
+
+  def test_scan_file(self, mocked_db: mock.Mock):
+    existing = self.input_dir / 'xyz.csv'
+    existing.write_text('a,b\n')
+
+    mocked_db.get_db().scanindex.find.return_value = [
+        {'_id': 'other.csv', 'name': 'other.csv'}]
+    mocked_db.get_db().files.find.return_value = [
+        {'_id': 5, 'partnerId': 'pXYZ', 'name': 'xyz.csv'}]
+
+    self.scanner.scan_file(existing)
+
+    # Only the file's own index entry is read
+    self.assertEqual(tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().scanindex.find')[0][1][0],
+        {'_id': {'$in': ['xyz.csv']}})
+
+    logs = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().copylog.insert_many')[0][1][0]
+    self.assertEqual(logs[0]['files'][0]['resolution'],
+                     protos.CopyLog.EvaluatedFile.FILE_EXISTS)
+
+    # Other index entries are kept since the directory wasn't listed
+    self.assertFalse(tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().scanindex.delete_many'))
+
+  def test_scan_file_missing(self, mocked_db: mock.Mock):
+    self.scanner.scan_file(self.input_dir / 'claimed.csv')
+
+    self.assertFalse(mocked_db.mock_calls)
+
+@mock.patch('rivoli.copier.status_scheduler')
+@mock.patch('rivoli.copier.db')
+class CopierTests(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self.input_dir = pathlib.Path(self._tmpdir.name) / 'input'
+    self.dest_dir = pathlib.Path(self._tmpdir.name) / 'processed'
+    self.input_dir.mkdir()
+    self.dest_dir.mkdir()
+
+    self.partner = _get_partners()[0]
+    self.copier = copier.LocalFileCopier(self.partner, self.dest_dir)
+
+  def tearDown(self):
+    self._tmpdir.cleanup()
+
+  def test_create_file(self, mocked_db: mock.Mock,
+      mocked_scheduler: mock.Mock):
+    src_file = self.input_dir / 'abc_1.csv'
+    src_file.write_text('a,b\nc,d\n')
+
+    mocked_db.get_next_id.return_value = 10
+    mocked_db.get_db().files.find_one.return_value = None
+
+    file = self.copier.create_file(src_file, self.partner.fileTypes[0])
+
+    partition_dir = copier.get_partition_dir(self.dest_dir, 'pABC',
+                                             file.created)
+
+    self.assertEqual(file.status, protos.File.NEW)
+    self.assertEqual(file.stats.approximateRows, 2)
+    self.assertEqual(file.location, str(partition_dir))
+    self.assertTrue((partition_dir / 'abc_1-10.csv').exists())
+    mocked_scheduler.next_step.assert_called_once()
+
+    # The line index is written next to the file
+    self.assertTrue(file.lineIndex)
+    with line_index.LineIndex(partition_dir / 'abc_1-10.csv') as index:
+      self.assertEqual(index.get_line(2), b'c,d')
+
+  def test_create_file_duplicate(self, mocked_db: mock.Mock,
+      mocked_scheduler: mock.Mock):
+    src_file = self.input_dir / 'abc_1.csv'
+    src_file.write_text('a,b\nc,d\n')
+
+    mocked_db.get_next_id.return_value = 10
+    mocked_db.get_db().files.find_one.return_value = {'_id': 4}
+
+    file = self.copier.create_file(src_file, self.partner.fileTypes[0])
+
+    # The duplicate File is created but doesn't get processed
+    self.assertEqual(file.status, protos.File.DUPLICATE)
+    self.assertEqual(file.duplicateOfFileId, 4)
+    self.assertTrue((pathlib.Path(file.location) / 'abc_1-10.csv').exists())
+    mocked_scheduler.next_step.assert_not_called()
+
+    inserted = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().files.insert_one')[0][1][0]
+    self.assertEqual(inserted['status'], protos.File.DUPLICATE)
+
+@mock.patch('rivoli.copier.db')
+class RelocateProcessedFilesTests(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self.dest_dir = pathlib.Path(self._tmpdir.name) / 'processed'
+    self.dest_dir.mkdir()
+
+    patcher = mock.patch('rivoli.copier._get_dest_dir',
+                         return_value=self.dest_dir)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def tearDown(self):
+    self._tmpdir.cleanup()
+
+  def test_get_partition_dir(self, _: mock.Mock):
+    # 2023-05-31T23:59:59Z
+    self.assertEqual(copier.get_partition_dir(self.dest_dir, 'pABC',
+                                              1685577599),
+                     self.dest_dir / 'pABC' / '2023' / '05')
+
+  def test_relocate(self, mocked_db: mock.Mock):
+    (self.dest_dir / 'abc_1-10.csv').write_text('a,b\n')
+    (self.dest_dir / 'abc_1-10.csv.idx').write_bytes(b'')
+    partition_dir = self.dest_dir / 'pABC' / '2023' / '05'
+
+    mocked_db.get_db().files.find.return_value = [
+      # Flat layout
+      {'_id': 10, 'partnerId': 'pABC', 'name': 'abc_1.csv',
+       'location': str(self.dest_dir), 'created': 1685577599},
+      # Already relocated
+      {'_id': 11, 'partnerId': 'pABC', 'name': 'abc_2.csv',
+       'location': str(partition_dir), 'created': 1685577599},
+      # Missing
+      {'_id': 12, 'partnerId': 'pABC', 'name': 'abc_3.csv',
+       'location': str(self.dest_dir), 'created': 1685577599},
+    ]
+
+    self.assertEqual(copier.relocate_processed_files(), 1)
+
+    self.assertTrue((partition_dir / 'abc_1-10.csv').exists())
+    self.assertTrue((partition_dir / 'abc_1-10.csv.idx').exists())
+    self.assertFalse((self.dest_dir / 'abc_1-10.csv').exists())
+
+    updates = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().files.update_one')
+    self.assertEqual(len(updates), 1)
+    self.assertEqual(updates[0][1],
+                     ({'_id': 10}, {'$set': {'location': str(partition_dir)}}))
+
+  def test_relocate_dry_run(self, mocked_db: mock.Mock):
+    (self.dest_dir / 'abc_1-10.csv').write_text('a,b\n')
+
+    mocked_db.get_db().files.find.return_value = [
+      {'_id': 10, 'partnerId': 'pABC', 'name': 'abc_1.csv',
+       'location': str(self.dest_dir), 'created': 1685577599}]
+
+    self.assertEqual(copier.relocate_processed_files(dry_run=True), 1)
+
+    self.assertTrue((self.dest_dir / 'abc_1-10.csv').exists())
+    self.assertFalse(tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().files.update_one'))
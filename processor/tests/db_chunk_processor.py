@@ -0,0 +1,217 @@
+""" Unit tests for rivoli.record_processor.db_chunk_processor. """
+import unittest
+from unittest import mock
+
+from rivoli.function_helpers import helpers
+from rivoli.protobson import bson_format
+from rivoli.record_processor import db_chunk_processor
+from rivoli import parser
+from rivoli import protos
+from rivoli import validator
+
+import tests
+
+# pylint: disable=protected-access
+# pyright: reportPrivateUsage=false
+
+class Processor(db_chunk_processor.DbChunkProcessor):
+  log_source = protos.ProcessingLog.PARSER
+
+  _only_process_record_status = protos.Record.LOADED
+
+  _success_status = protos.File.PARSED
+  _error_status = protos.File.PARSE_ERROR
+
+  _record_error_status = protos.Record.PARSE_ERROR
+
+  _step_stat_prefix = 'PARSE'
+  _finished_message = 'Parsed records'
+
+  def _process(self):
+    self._update_status_to_processing(protos.File.PARSING, protos.File.LOADED)
+    self._clear_stats('PARSE')
+
+    self._process_records(self._get_all_records(protos.Record.LOADED))
+
+    self._log_finished()
+
+  def _process_record(self, records: list[helpers.Record]):
+    record = records[0].updated_record
+    record.status = protos.Record.PARSED
+
+    self._get_step_stat(record.recordType).success += 1
+    self.file.stats.parsedRecordsSuccess += 1
+    return self._make_update(record, ['status'])
+
+  def _close_processing(self) -> None:
+    self._update_file(['status', 'stats', 'log', 'recentErrors'])
+
+def get_records(ids: list[int]) -> list[dict[str, int]]:
+  return [{'_id': (123 << 32) + line_num, 'recordType': 1001,
+           'status': protos.Record.LOADED} for line_num in ids]
+
+@mock.patch('rivoli.record_processor.record_processor.db')
+class ShardTests(unittest.TestCase):
+  def test_plan_shards(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    file.status = protos.File.LOADED
+    file.stats.totalRows = 2500
+
+    processor = Processor(file, tests.get_mock_partner(),
+                          tests.get_mock_filetype(), shard_records=1000)
+    processor.process()
+
+    # The remainder is spread across the shards
+    self.assertEqual(processor.shards, [(1, 1250), (1251, 2500)])
+    self.assertEqual(processor.file.status, protos.File.PARSING)
+    self.assertEqual(processor.file.log[-1].message,
+                     'Processing records in 2 shards')
+    mocked_db.get_db.return_value.records.find.assert_not_called()
+
+    # Files with less than two shards' worth of Records aren't sharded
+    file.status = protos.File.LOADED
+    file.stats.totalRows = 1999
+    mocked_db.get_db.return_value.records.find.return_value.sort.return_value = (
+        [])
+
+    processor = Processor(file, tests.get_mock_partner(),
+                          tests.get_mock_filetype(), shard_records=1000)
+    processor.process()
+
+    self.assertEqual(processor.shards, [])
+    self.assertEqual(processor.file.status, protos.File.PARSED)
+    self.assertEqual(processor.file.log[-1].message, 'Parsed records')
+
+  def test_shard(self, mocked_db: mock.Mock):
+    mydb = mocked_db.get_db.return_value
+
+    file = tests.get_mock_file()
+    file.status = protos.File.PARSING
+    file.stats.totalRows = 2500
+    file.stats.steps['LOAD'].input = 2500
+
+    mydb.records.find.return_value.sort.return_value = get_records([1251, 1252])
+
+    processor = Processor(file, tests.get_mock_partner(),
+                          tests.get_mock_filetype(), shard=(1251, 2500))
+    processor.process()
+
+    # Only the shard's Records are processed
+    self.assertEqual(mydb.records.find.call_args.args[0]['_id'],
+                     {'$gte': (123 << 32) + 1251, '$lte': (123 << 32) + 2500})
+    mydb.records.bulk_write.assert_called_once()
+
+    # The File is only updated once the shards are finished
+    mydb.files.update_one.assert_not_called()
+
+    result = processor.get_shard_result()
+    shard_file = bson_format.to_proto(protos.File, result)
+    self.assertEqual(shard_file.status, protos.File.PARSED)
+    self.assertEqual(shard_file.stats, protos.RecordStats(
+        parsedRecordsSuccess=2,
+        steps={'PARSE:1001': protos.StepStats(input=2, success=2)}))
+    self.assertEqual(len(shard_file.log), 0)
+
+    # A shard of a File which isn't being processed fails
+    file.status = protos.File.LOADED
+    processor = Processor(file, tests.get_mock_partner(),
+                          tests.get_mock_filetype(), shard=(1251, 2500))
+    processor.process()
+
+    self.assertEqual(processor.file.status, protos.File.PARSE_ERROR)
+    self.assertIn('File status is LOADED', processor.file.log[-1].message)
+
+  def test_finish_shards(self, mocked_db: mock.Mock):
+    mydb = mocked_db.get_db.return_value
+
+    file = tests.get_mock_file()
+    file.status = protos.File.PARSING
+    file.stats.totalRows = 2500
+
+    error = protos.ProcessingLog(level=protos.ProcessingLog.ERROR,
+                                 message='failed')
+    results = [
+      bson_format.from_proto(protos.File(
+          status=protos.File.PARSED,
+          stats=protos.RecordStats(
+              parsedRecordsSuccess=1250,
+              steps={'PARSE:1001': protos.StepStats(input=1250,
+                                                    success=1250)}))),
+      bson_format.from_proto(protos.File(
+          status=protos.File.PARSED,
+          stats=protos.RecordStats(
+              parsedRecordsSuccess=1249,
+              steps={'PARSE:1001': protos.StepStats(input=1250, success=1249,
+                                                    failure=1)}),
+          log=[error], recentErrors=[error])),
+    ]
+
+    processor = Processor(file, tests.get_mock_partner(),
+                          tests.get_mock_filetype())
+    processor.finish_shards(results)
+
+    self.assertEqual(processor.file.status, protos.File.PARSED)
+    self.assertEqual(processor.file.stats, protos.RecordStats(
+        totalRows=2500, parsedRecordsSuccess=2499,
+        steps={'PARSE:1001': protos.StepStats(input=2500, success=2499,
+                                              failure=1)}))
+    self.assertEqual([log.message for log in processor.file.log],
+                     ['failed', 'Parsed records'])
+    self.assertEqual(list(processor.file.recentErrors), [error])
+    mydb.files.update_one.assert_called_once()
+
+    # Any failed shard fails the File
+    results[0]['status'] = protos.File.PARSE_ERROR
+    file.status = protos.File.PARSING
+    file.stats.Clear()
+    del file.log[:]
+
+    processor = Processor(file, tests.get_mock_partner(),
+                          tests.get_mock_filetype())
+    processor.finish_shards(results)
+
+    self.assertEqual(processor.file.status, protos.File.PARSE_ERROR)
+    self.assertEqual([log.message for log in processor.file.log], ['failed'])
+
+  @mock.patch('rivoli.parser.celery')
+  @mock.patch('rivoli.parser._make_parser')
+  @mock.patch('rivoli.validator.celery')
+  @mock.patch('rivoli.validator.Validator')
+  @mock.patch('rivoli.admin_entities.get_file_entities')
+  def test_shards_error(self, mocked_entities: mock.Mock,
+                        mocked_validator: mock.Mock,
+                        mocked_validate_celery: mock.Mock,
+                        mocked_make_parser: mock.Mock,
+                        mocked_parse_celery: mock.Mock, mocked_db: mock.Mock):
+    # A failed shard (or finish) calls the chord's error callback, which
+    # fails the File
+    file = tests.get_mock_file()
+    mocked_entities.return_value = (file, tests.get_mock_partner(),
+                                    tests.get_mock_filetype())
+    mocked_make_parser.return_value.shards = [(1, 1250), (1251, 2500)]
+    mocked_validator.return_value.shards = [(1, 1250), (1251, 2500)]
+
+    for module, mocked_celery, task, callback, status, error_status in [
+        (parser, mocked_parse_celery, parser.parse, parser.fail_parse_shards,
+         protos.File.PARSING, protos.File.PARSE_ERROR),
+        (validator, mocked_validate_celery, validator.validate,
+         validator.fail_validate_shards, protos.File.VALIDATING,
+         protos.File.VALIDATE_ERROR)]:
+      with self.subTest(module.__name__):
+        mocked_db.reset_mock()
+        file.status = status
+
+        task(file.id)
+
+        finish = mocked_celery.chord.return_value.call_args[0][0]
+        self.assertEqual(finish.options['link_error'],
+                         [callback.s(file.id)])
+
+        callback(None, ValueError('bad shard'), None, file.id)
+
+        update_call = tests.get_mock_calls_by_name(
+            mocked_db.mock_calls, 'get_db().files.update_one')[0][1]
+        self.assertEqual(update_call[0], {'_id': file.id, 'status': status})
+        self.assertEqual(update_call[1]['$set'], {'status': error_status})
+        self.assertEqual(update_call[1]['$push']['recentErrors']['message'],
+                         'ValueError: bad shard')
@@ -1,16 +1,26 @@
 """ Unit tests for rivoli.function_helpers.exceptions. """
+import array
+import gzip
 import pathlib
+import tempfile
+import typing as t
 import unittest
 from unittest import mock
 
 from rivoli import loader
+from rivoli import protos
+from rivoli.protobson import bson_format
+from rivoli.utils import decoding
+from rivoli.utils import fingerprint
+from rivoli.utils import line_index
+from rivoli.utils import utils
 
 import tests
 
 # pylint: disable=protected-access
 # pyright: reportPrivateUsage=false
 
-@mock.patch('rivoli.record_processor.db')
+@mock.patch('rivoli.record_processor.record_processor.db')
 class LoaderTests(unittest.TestCase):
 
   def test_begin_processing_file_name(self, mocked_db: mock.Mock):
@@ -82,3 +92,738 @@ class LoaderTests(unittest.TestCase):
     self.assertEqual(len(first_record), 2)
 
     self.assertEqual(first_record[0]['rawLine'], '123  VAL1 VAL2')
+
+  @mock.patch('rivoli.loader.status_scheduler')
+  @mock.patch('rivoli.loader.admin_entities')
+  def test_load_from_id_fixedwidth(self, mocked_entities: mock.Mock,
+                                   mocked_scheduler: mock.Mock,
+                                   mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    file.name = 'loader_fixed.txt'
+    filetype = tests.get_mock_filetype()
+    filetype.format = protos.FileType.FLAT_FILE_FIXED_WIDTH
+
+    mocked_entities.get_file_entities.return_value = (
+        file, tests.get_mock_partner(), filetype)
+
+    loader.load_from_id(file.id)
+
+    # Lines are loaded whole rather than split on the delimiter
+    records = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.insert_many')[0][1][0]
+    self.assertEqual([record['rawLine'] for record in records],
+                     ['123  VAL1 VAL2', '456  VAL  VAL'])
+    self.assertNotIn('rawColumns', records[0])
+    self.assertEqual(file.status, protos.File.LOADED)
+    mocked_scheduler.next_step.assert_called_once_with(file, filetype)
+
+  def test_delimited_file_with_sample(self, mocked_db: mock.Mock):
+    # The Copier-provided sample is used in place of reading the file
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    path = pathlib.Path(tests.TEST_FILES_DIR) / 'loader_csv-123.csv'
+    file.sample = path.read_bytes()
+
+    delimited = loader.DelimitedLoader(file, partner, filetype)
+    delimited.process()
+
+    self.assertEqual(file.headerColumns, ['ID', 'COL_2', 'COL_3', 'COL_4'])
+    self.assertEqual(file.stats.totalRows, 6)
+
+  def test_delimited_compressed_file(self, mocked_db: mock.Mock):
+    # Compressed files are decompressed as they're loaded
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    path = pathlib.Path(tests.TEST_FILES_DIR) / 'loader_csv-123.csv'
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      (pathlib.Path(tmpdir) / 'loader_csv-123.csv').write_bytes(
+          gzip.compress(path.read_bytes()))
+      file.location = tmpdir
+      file.compression = protos.File.GZIP
+
+      delimited = loader.DelimitedLoader(file, partner, filetype)
+      delimited.process()
+
+    self.assertEqual(file.headerColumns, ['ID', 'COL_2', 'COL_3', 'COL_4'])
+    self.assertEqual(file.stats.totalRows, 6)
+
+    insert_calls = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.insert_many')
+    self.assertEqual(len(insert_calls[0][1][0]), 5)
+
+  def test_delimited_file_line_index(self, mocked_db: mock.Mock):
+    # Rows which can be read back from the line index don't store raw values
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = pathlib.Path(tmpdir) / 'loader_csv-123.csv'
+      path.write_bytes(b'ID,COL_2,COL_3\r\n1,a,x\r\n2,"b\nb",y\r\n'
+                       b'3,c,z\r\n')
+      line_index.write_index(path, t.cast(
+          'array.array[int]',
+          utils.get_file_summary(path, index_lines=True).line_offsets))
+
+      file.location = tmpdir
+      file.lineIndex = True
+
+      delimited = loader.DelimitedLoader(file, partner, filetype)
+      delimited.process()
+
+      records = tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().records.insert_many')[0][1][0]
+
+      self.assertNotIn('rawColumns', records[0])
+      self.assertNotIn('rawLineNum', records[0])
+      # The multi-line row keeps its raw values
+      self.assertEqual(records[1]['rawColumns'], ['2', 'b\nb', 'y'])
+      # ... which shifts the following row's line in the file
+      self.assertNotIn('rawColumns', records[2])
+      self.assertEqual(records[2]['rawLineNum'], 5)
+
+      # The raw values are read back from the index
+      self.assertEqual(file.dialect.delimiter, ',')
+      self.assertEqual(
+          delimited._get_raw_columns(protos.Record(id=(123 << 32) + 4,
+                                                   rawLineNum=5)),
+          ['3', 'c', 'z'])
+      self.assertEqual(
+          delimited._get_raw_columns(protos.Record(id=(123 << 32) + 2)),
+          ['1', 'a', 'x'])
+      delimited._line_index.close()
+
+  def test_line_index_parse_in_database(self, mocked_db: mock.Mock):
+    # FileTypes which parse in the database keep the raw columns anyway
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+    filetype.parseInDatabase = True
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      self._write_indexed_file(tmpdir,
+                               b'ID,COL_2,COL_3\r\n1,a,x\r\n2,b,y\r\n')
+      file.location = tmpdir
+      file.lineIndex = True
+
+      delimited = loader.DelimitedLoader(file, partner, filetype)
+      delimited.process()
+
+    self.assertTrue(file.rawColumnsStored)
+    update = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().files.update_one')[2][1][1]
+    self.assertEqual(update['$set']['rawColumnsStored'], True)
+
+    records = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.insert_many')[0][1][0]
+    self.assertEqual([record['rawColumns'] for record in records],
+                     [['1', 'a', 'x'], ['2', 'b', 'y']])
+
+  def test_fixedwidth_file_line_index(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = pathlib.Path(tmpdir) / 'loader_fixed-123.txt'
+      # A bare carriage return splits a line for Python but not for the index
+      path.write_bytes(b'123  VAL1 \n456\r789 VAL2\n')
+      line_index.write_index(path, t.cast(
+          'array.array[int]',
+          utils.get_file_summary(path, index_lines=True).line_offsets))
+
+      file.name = 'loader_fixed.txt'
+      file.location = tmpdir
+      file.lineIndex = True
+
+      fixed = loader.FixedWidthLoader(file, partner, filetype)
+      fixed.process()
+
+      records = tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().records.insert_many')[0][1][0]
+
+      self.assertEqual(len(records), 3)
+      self.assertNotIn('rawLine', records[0])
+      self.assertEqual(records[1]['rawLine'], '456')
+      self.assertEqual(records[2]['rawLine'], '789 VAL2')
+
+      self.assertEqual(
+          fixed._get_raw_line(protos.Record(id=(123 << 32) + 1)),
+          '123  VAL1')
+      fixed._line_index.close()
+
+  def test_fixedwidth_parse_while_loading(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+    filetype.format = protos.FileType.FLAT_FILE_FIXED_WIDTH
+    filetype.parseWhileLoading = True
+    filetype.recordTypes[0].fieldTypes.extend([
+        protos.FieldType(name='id', active=True, isSharedKey=True,
+                         charRange={'start': 1, 'end': 3}),
+        protos.FieldType(name='val', active=True,
+                         charRange={'start': 4, 'end': 9}),
+    ])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = pathlib.Path(tmpdir) / 'loader_fixed-123.txt'
+      # Leading whitespace is part of the first field
+      path.write_bytes(b' 12  VAL1\r\n456  VAL2   \r\n789\n')
+      line_index.write_index(path, t.cast(
+          'array.array[int]',
+          utils.get_file_summary(path, index_lines=True).line_offsets))
+
+      file.name = 'loader_fixed.txt'
+      file.location = tmpdir
+      file.lineIndex = True
+
+      fixed = loader.FixedWidthLoader(file, partner, filetype)
+      fixed.process()
+
+    self.assertEqual(file.status, protos.File.PARSED)
+    self.assertEqual(file.stats.parsedRecordsSuccess, 3)
+
+    records = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.insert_many')[0][1][0]
+
+    self.assertEqual([record['parsedFields'] for record in records], [
+        {'id': '12', 'val': 'VAL1'},
+        {'id': '456', 'val': 'VAL2'},
+        {'id': '789', 'val': ''},
+    ])
+    self.assertEqual([record['sharedKey'] for record in records],
+                     ['12', '456', '789'])
+    self.assertEqual(records[0]['status'], protos.Record.PARSED)
+    self.assertNotIn('rawLine', records[0])
+    # Raw lines are fingerprinted as they'd be read back
+    self.assertEqual(records[1]['hash'], fingerprint.fingerprint(b'456  VAL2'))
+
+  @mock.patch('rivoli.protobson.bson_format.now', return_value=1700000000)
+  def test_create_new_record_parity(self, _: mock.Mock, mocked_db: mock.Mock):
+    # The directly-built document must match the protos.Record conversion
+    loadr = loader.DelimitedLoader(tests.get_mock_file(),
+        tests.get_mock_partner(), tests.get_mock_filetype())
+
+    def _proto_record(line_num: int, line: str,
+        columns: t.Optional[list[str]],
+        record_type: t.Union[int, 'protos.Record.RecordTypeRef', None],
+        status: 'protos.Record.Status' = protos.Record.LOADED,
+        log_msg: t.Optional[str] = None,
+        raw_line_num: int = 0) -> dict[str, t.Any]:
+      indexed = loadr._index_lines and raw_line_num
+      record = protos.Record(
+          id=loadr.record_prefix + line_num,
+          rawLine=None if columns or indexed else line,
+          rawColumns=None if indexed else columns,
+          rawLineNum=raw_line_num if indexed and raw_line_num != line_num
+                     else None,
+          hash=(None if record_type == protos.Record.HEADER
+                else fingerprint.fingerprint(line.encode())),
+          recordType=record_type,
+          status=status,
+      )
+
+      if log_msg:
+        log = loadr._make_log_entry(True, log_msg,
+            protos.ProcessingLog.OTHER_OPERATION_ERROR)
+        record.log.append(log)
+        record.recentErrors.append(log)
+
+      return bson_format.from_proto(record)
+
+    cases: list[tuple[t.Any, ...]] = [
+      (2, 'a,b', ['a', 'b'], 1001),
+      (3, 'a,,', ['a', '', ''], 1001),
+      (4, '', [], 1001),
+      (5, '', None, 1001),
+      (6, '123  VAL1', None, 1001),
+      (1, '', ['ID', 'COL_2'], protos.Record.HEADER),
+      (7, 'x,y', ['x', 'y'], None, protos.Record.LOAD_ERROR,
+       'No record type match found'),
+      (8, 'x', None, None, protos.Record.LOAD_ERROR, 'No match'),
+      (9, 'a,b', ['a', 'b'], 1001, protos.Record.LOADED, None, 9),
+      (10, 'a,b', ['a', 'b'], 1001, protos.Record.LOADED, None, 12),
+      (11, 'x,y', ['x', 'y'], None, protos.Record.LOAD_ERROR, 'No match', 13),
+      (12, 'a', None, 1001, protos.Record.RECORD_STATUS_UNKNOWN),
+    ]
+
+    for index_lines in (False, True):
+      loadr._index_lines = index_lines
+
+      for case in cases:
+        with self.subTest(case=case, index_lines=index_lines):
+          expected = _proto_record(*case)
+          actual = loadr._create_new_record(*case)
+
+          self.assertEqual(actual, expected)
+          # Key order matters for the BSON documents
+          self.assertEqual(list(actual), list(expected))
+
+  def test_parse_while_loading(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+    filetype.parseWhileLoading = True
+    filetype.recordTypes[0].fieldTypes.extend([
+        protos.FieldType(name='id', headerColumn='ID', active=True,
+                         isSharedKey=True),
+        protos.FieldType(name='col3', headerColumn='COL_3', active=True),
+    ])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = pathlib.Path(tmpdir) / 'loader_csv-123.csv'
+      # The short row is after the sample which is used to detect the dialect
+      path.write_bytes(b'ID,COL_2,COL_3\r\n123,row1_val2,row1_val3\r\n' +
+                       b'456,val2,val3\r\n' * 1000 + b'789,val2\r\n')
+      file.location = tmpdir
+
+      delimited = loader.DelimitedLoader(file, partner, filetype)
+      delimited.process()
+
+    self.assertEqual(file.status, protos.File.PARSED)
+    self.assertEqual(file.parsedColumns, ['id', 'col3'])
+    self.assertEqual(file.stats.loadedRecordsSuccess, 1002)
+    self.assertEqual(file.stats.parsedRecordsSuccess, 1001)
+    self.assertEqual(file.stats.steps['PARSE:1001'],
+                     protos.StepStats(input=1002, success=1001, failure=1))
+    self.assertTrue(file.times.parsingEndTime)
+
+    # Chunks might be inserted in any order
+    records = sorted((record for call in tests.get_mock_calls_by_name(
+                          mocked_db.mock_calls, 'get_db().records.insert_many')
+                      for record in call[1][0]), key=lambda rec: rec['_id'])
+
+    self.assertEqual(records[0]['status'], protos.Record.PARSED)
+    self.assertEqual(records[0]['parsedFields'],
+                     {'id': '123', 'col3': 'row1_val3'})
+    self.assertEqual(records[0]['sharedKey'], '123')
+
+    # The short row is loaded, but can't be parsed
+    self.assertEqual(records[-1]['status'], protos.Record.PARSE_ERROR)
+    self.assertNotIn('parsedFields', records[-1])
+    self.assertEqual(records[-1]['recentErrors'][0]['source'],
+                     protos.ProcessingLog.PARSER)
+
+    # Documents still match the protos.Record conversion
+    expected = protos.Record(
+        id=(123 << 32) + 2, recordType=1001, status=protos.Record.PARSED,
+        hash=records[0]['hash'], rawColumns=['123', 'row1_val2', 'row1_val3'],
+        parsedFields={'id': '123', 'col3': 'row1_val3'}, sharedKey='123')
+    self.assertEqual(list(records[0]), list(bson_format.from_proto(expected)))
+
+  def test_prune_columns(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+    filetype.pruneColumns = True
+    filetype.recordTypes[0].fieldTypes.extend([
+        protos.FieldType(name='id', headerColumn='ID', active=True),
+        protos.FieldType(name='col4', headerColumn='COL_4', active=True),
+        protos.FieldType(name='col2', headerColumn='COL_2', active=False),
+    ])
+
+    delimited = loader.DelimitedLoader(file, partner, filetype)
+    delimited.process()
+
+    self.assertEqual(file.status, protos.File.LOADED)
+    self.assertEqual(file.storedColumns, [0, 3])
+
+    records = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.insert_many')[0][1][0]
+    self.assertEqual(records[0]['rawColumns'], ['123', 'row1_val4'])
+    self.assertEqual(records[0]['rawColumnCount'], 4)
+
+    # The header is always stored in full
+    header = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.insert_one')[0][1][0]
+    self.assertEqual(header['rawColumns'], ['ID', 'COL_2', 'COL_3', 'COL_4'])
+
+    # Columns which weren't stored are read back as empty
+    record = bson_format.to_proto(protos.Record, records[0])
+    self.assertEqual(delimited._get_raw_columns(record),
+                     ['123', '', '', 'row1_val4'])
+
+    # Outputs which duplicate the input fields need every column
+    file = tests.get_mock_file()
+    filetype.outputs.append(protos.Output(
+        configuration={'duplicateInputFields': True}))
+    mocked_db.reset_mock()
+
+    loader.DelimitedLoader(file, partner, filetype).process()
+
+    self.assertFalse(file.storedColumns)
+    records = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.insert_many')[0][1][0]
+    self.assertEqual(records[0]['rawColumns'],
+                     ['123', 'row1_val2', 'row1_val3', 'row1_val4'])
+    self.assertNotIn('rawColumnCount', records[0])
+
+  @mock.patch.object(loader, 'PROFILE_INTERVAL', 1)
+  def test_profile_columns(self, _: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+    filetype.profileColumns = True
+
+    loader.DelimitedLoader(file, partner, filetype).process()
+
+    self.assertEqual(file.status, protos.File.LOADED)
+    self.assertEqual([profile.name for profile in file.columnProfiles],
+                     ['ID', 'COL_2', 'COL_3', 'COL_4'])
+    # The header isn't profiled
+    self.assertEqual(file.columnProfiles[0].count, 5)
+    self.assertEqual(file.columnProfiles[0].distinctEstimate, 5)
+    self.assertEqual(file.columnProfiles[1].topValues[0].value, 'val2')
+
+  def test_latin_1_file(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = pathlib.Path(tmpdir) / 'loader_csv-123.csv'
+      path.write_bytes(b'ID,COL_2,COL_3\r\n' +
+                       b'123,caf\xe9,\xa0value3\r\n' * 1000)
+      file.location = tmpdir
+
+      delimited = loader.DelimitedLoader(file, partner, filetype)
+      delimited.process()
+
+    self.assertEqual(file.status, protos.File.LOADED)
+    self.assertEqual(file.encoding, decoding.LATIN_1)
+
+    records = [record for call in tests.get_mock_calls_by_name(
+                   mocked_db.mock_calls, 'get_db().records.insert_many')
+               for record in call[1][0]]
+    self.assertEqual(len(records), 1000)
+    self.assertEqual(records[0]['rawColumns'],
+                     ['123', 'cafe\u0301', ' value3'])
+
+    # The replaced bytes are summarized in a single log entry
+    warnings = [log for log in file.log
+                if log.level == protos.ProcessingLog.WARNING]
+    self.assertEqual(len(warnings), 1)
+    self.assertIn('Replaced 2,000 unexpected non-UTF-8 bytes',
+                  warnings[0].message)
+
+  def test_pipelined_writes(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    delimited = loader.DelimitedLoader(file, partner, filetype)
+    delimited._max_pending_updates = 2
+    delimited._writer_threads = 3
+    delimited.process()
+
+    self.assertEqual(file.status, protos.File.LOADED)
+    self.assertEqual(file.stats.loadedRecordsSuccess, 5)
+
+    insert_calls = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.insert_many')
+    # Chunks might be inserted in any order
+    self.assertEqual(len(insert_calls), 3)
+    self.assertEqual(sorted(rec['_id'] - (123 << 32) for call in insert_calls
+                            for rec in call[1][0]),
+                     [2, 3, 4, 5, 6])
+
+    # The final stats are written after all of the chunks
+    updates = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().files.update_one')
+    self.assertEqual(updates[-1][1][1]['$set']['stats']['loadedRecordsSuccess'],
+                     5)
+
+  def test_pipelined_write_error(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    mocked_db.get_db().records.insert_many.side_effect = ValueError('failed')
+
+    delimited = loader.DelimitedLoader(file, partner, filetype)
+    delimited._max_pending_updates = 1
+    delimited._writer_threads = 2
+    delimited.process()
+
+    self.assertEqual(file.status, protos.File.LOAD_ERROR)
+    self.assertEqual(file.recentErrors[0].message, 'ValueError: failed')
+
+  def _write_indexed_file(self, tmpdir: str, data: bytes) -> pathlib.Path:
+    path = pathlib.Path(tmpdir) / 'loader_csv-123.csv'
+    path.write_bytes(data)
+    line_index.write_index(path, t.cast(
+        'array.array[int]',
+        utils.get_file_summary(path, index_lines=True).line_offsets))
+    return path
+
+  def test_range_load(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      self._write_indexed_file(tmpdir, b'ID,COL_2,COL_3\r\n' + b''.join(
+          f'{idx},val{idx},x{idx}\r\n'.encode() for idx in range(1, 8)))
+      file.location = tmpdir
+      file.lineIndex = True
+
+      # 7 data lines are split into 2 ranges, which aren't loaded yet
+      delimited = loader.DelimitedLoader(file, partner, filetype,
+                                         range_lines=3)
+      delimited.process()
+
+      self.assertEqual(delimited.ranges, [(2, 4), (5, 8)])
+      self.assertEqual(file.status, protos.File.LOADING)
+      self.assertEqual(file.headerColumns, ['ID', 'COL_2', 'COL_3'])
+      self.assertFalse(tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().records.insert_many'))
+
+      # Each range loads its own rows, with the same IDs as a single load
+      record_ids: list[int] = []
+      for start, end in delimited.ranges:
+        mocked_db.reset_mock()
+        range_file = protos.File()
+        range_file.CopyFrom(file)
+
+        ranger = loader.RangeLoader(range_file, partner, filetype, start, end)
+        ranger.process()
+        self.assertTrue(ranger.aligned)
+
+        records = tests.get_mock_calls_by_name(
+            mocked_db.mock_calls, 'get_db().records.insert_many')[0][1][0]
+        record_ids.extend(rec['_id'] - (123 << 32) for rec in records)
+        self.assertNotIn('rawColumns', records[0])
+
+        update = tests.get_mock_calls_by_name(
+            mocked_db.mock_calls, 'get_db().files.update_one')[-1][1][1]
+        self.assertEqual(update['$inc']['stats.loadedRecordsSuccess'],
+                         end - start + 1)
+        self.assertNotIn('$set', update)
+
+      self.assertEqual(record_ids, list(range(2, 9)))
+
+  @mock.patch.object(loader, 'PROFILE_INTERVAL', 1)
+  def test_range_load_profile_columns(self, _: mock.Mock):
+    # Profiled files aren't split into ranges, so every row is profiled
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+    filetype.profileColumns = True
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      self._write_indexed_file(tmpdir, b'ID,COL_2,COL_3\r\n' + b''.join(
+          f'{idx},val{idx},x\r\n'.encode() for idx in range(1, 8)))
+      file.location = tmpdir
+      file.lineIndex = True
+
+      delimited = loader.DelimitedLoader(file, partner, filetype,
+                                         range_lines=3)
+      delimited.process()
+
+    self.assertEqual(delimited.ranges, [])
+    self.assertEqual(file.status, protos.File.LOADED)
+    self.assertEqual([profile.name for profile in file.columnProfiles],
+                     ['ID', 'COL_2', 'COL_3'])
+    self.assertEqual(file.columnProfiles[0].distinctEstimate, 7)
+    self.assertEqual(file.columnProfiles[2].topValues[0].value, 'x')
+
+  def test_range_load_misaligned(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      # The quoted value on line 4 continues into the second range
+      self._write_indexed_file(tmpdir, b'ID,COL_2,COL_3\r\n1,a,x\r\n2,b,y\r\n'
+                               b'3,"c\nc",z\r\n4,d,w\r\n5,e,v\r\n')
+      file.location = tmpdir
+      file.lineIndex = True
+      file.status = protos.File.LOADING
+      file.dialect.delimiter = ','
+      file.dialect.quoteChar = '"'
+      file.dialect.doubleQuote = True
+
+      ranger = loader.RangeLoader(file, partner, filetype, 2, 4)
+      ranger.process()
+
+      self.assertFalse(ranger.aligned)
+      self.assertEqual(file.status, protos.File.LOADING)
+      self.assertFalse(tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().files.update_one'))
+
+  @mock.patch.object(loader, 'RANGE_LINES', 3)
+  @mock.patch('rivoli.loader.celery')
+  @mock.patch('rivoli.loader.admin_entities')
+  def test_range_load_error(self, mocked_entities: mock.Mock,
+                            mocked_celery: mock.Mock, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    mocked_entities.get_file_entities.return_value = (
+        file, tests.get_mock_partner(), tests.get_mock_filetype())
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      self._write_indexed_file(tmpdir, b'ID,COL_2,COL_3\r\n' + b''.join(
+          f'{idx},val{idx},x{idx}\r\n'.encode() for idx in range(1, 8)))
+      file.location = tmpdir
+      file.lineIndex = True
+
+      loader.load_from_id(file.id)
+
+    # A failed range (or finish) calls the chord's error callback
+    finish = mocked_celery.chord.return_value.call_args[0][0]
+    self.assertEqual(finish.options['link_error'],
+                     [loader.fail_range_load.s(file.id)])
+
+    mocked_db.reset_mock()
+    loader.fail_range_load(None, ValueError('bad range'), None, file.id)
+
+    update_call = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().files.update_one')[0][1]
+    self.assertEqual(update_call[0],
+                     {'_id': file.id, 'status': protos.File.LOADING})
+    self.assertEqual(update_call[1]['$set'],
+                     {'status': protos.File.LOAD_ERROR})
+    self.assertEqual(update_call[1]['$push']['log']['message'],
+                     'ValueError: bad range')
+
+  def test_resume_from_checkpoint(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      # Rows and lines are out of step after the multi-line row
+      self._write_indexed_file(tmpdir, b'ID,COL_2,COL_3\r\n1,a,x\r\n2,b,y\r\n'
+                               b'3,"c\nc",z\r\n4,d,w\r\n5,e,v\r\n6,f,u\r\n')
+      file.location = tmpdir
+      file.lineIndex = True
+
+      delimited = loader.DelimitedLoader(file, partner, filetype)
+      delimited._max_pending_updates = 2
+      delimited._writer_threads = 0
+      delimited.process()
+
+      full_records = [record for call in tests.get_mock_calls_by_name(
+                          mocked_db.mock_calls, 'get_db().records.insert_many')
+                      for record in call[1][0]]
+      updates = [call[1][1] for call in tests.get_mock_calls_by_name(
+                     mocked_db.mock_calls, 'get_db().files.update_one')]
+      checkpoints = [update['$set']['loadCheckpoint'] for update in updates
+                     if 'loadCheckpoint' in update.get('$set', {})]
+
+      self.assertEqual([(cp['lineNum'], cp['rawLineNum'])
+                        for cp in checkpoints], [(4, 4), (6, 7)])
+      # The finished load doesn't need its checkpoint
+      self.assertIn('loadCheckpoint', updates[-1]['$unset'])
+
+      # Resume from the last checkpoint, as if the worker had stopped
+      mocked_db.reset_mock()
+      resumed_file = protos.File()
+      resumed_file.CopyFrom(file)
+      resumed_file.status = protos.File.LOADING
+      resumed_file.loadCheckpoint.CopyFrom(
+          bson_format.to_proto(protos.LoadCheckpoint, checkpoints[-1]))
+
+      resumed = loader.DelimitedLoader(resumed_file, partner, filetype)
+      resumed.process()
+
+      self.assertEqual(resumed_file.status, protos.File.LOADED)
+      self.assertEqual(
+          tests.get_mock_calls_by_name(mocked_db.mock_calls,
+                                       'get_db().records.delete_many')[0][1][0],
+          {'_id': {'$gte': (123 << 32) + 6, '$lte': (124 << 32) - 1}})
+
+      records = [record for call in tests.get_mock_calls_by_name(
+                     mocked_db.mock_calls, 'get_db().records.insert_many')
+                 for record in call[1][0]]
+      self.assertEqual(records, full_records[4:])
+      self.assertEqual(resumed_file.stats, file.stats)
+
+  def test_resume_claim_lost(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+    files = mocked_db.get_db.return_value.files
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      self._write_indexed_file(tmpdir, b'ID,COL_2,COL_3\r\n' + b''.join(
+          f'{idx},val{idx},x{idx}\r\n'.encode() for idx in range(1, 8)))
+      file.location = tmpdir
+      file.lineIndex = True
+      file.status = protos.File.LOADING
+      file.loadOwner = 'first'
+      file.loadCheckpoint.CopyFrom(protos.LoadCheckpoint(
+          lineNum=4, rawLineNum=4, byteOffset=30))
+
+      # Another Loader resumed the File since it was read
+      files.update_one.return_value.matched_count = 0
+
+      resumed = loader.DelimitedLoader(file, partner, filetype)
+      resumed.process()
+
+      claim = tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().files.update_one')
+      self.assertEqual(len(claim), 1)
+      self.assertEqual(claim[0][1][0], {
+          '_id': 123, 'status': protos.File.LOADING, 'loadOwner': 'first'})
+      self.assertNotEqual(claim[0][1][1]['$set']['loadOwner'], 'first')
+      # The other Loader's Records and File are left alone
+      self.assertFalse(tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().records.delete_many'))
+      self.assertFalse(tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().records.insert_many'))
+
+      # A running Loader stops once another resumes its File
+      mocked_db.reset_mock()
+      file.status = protos.File.NEW
+      file.ClearField('loadCheckpoint')
+      files.update_one.side_effect = [mock.Mock(matched_count=1)] * 4 + [
+          mock.Mock(matched_count=0)]
+
+      first = loader.DelimitedLoader(file, partner, filetype)
+      first._max_pending_updates = 2
+      first._writer_threads = 0
+      first.process()
+
+      self.assertEqual(len(tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().records.insert_many')), 1)
+      updates = tests.get_mock_calls_by_name(
+          mocked_db.mock_calls, 'get_db().files.update_one')
+      # ... and doesn't update the File afterwards
+      self.assertEqual(len(updates), 5)
+      self.assertEqual(list(updates[-1][1][1]['$set']),
+                       ['stats', 'loadCheckpoint'])
+      self.assertEqual(updates[-1][1][0],
+                       {'_id': 123, 'loadOwner': file.loadOwner})
+      self.assertEqual(file.status, protos.File.LOAD_ERROR)
+
+  def test_migrate_fingerprints(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+
+    mocked_db.get_db().records.find().sort.return_value = [
+      bson_format.from_proto(record) for record in [
+        protos.Record(id=(123 << 32) + 1, hash=b'm' * 16,
+                      recordType=protos.Record.HEADER,
+                      rawColumns=['ID', 'COL_2']),
+        protos.Record(id=(123 << 32) + 2, hash=b'm' * 16, recordType=1001,
+                      rawColumns=['1', 'a']),
+      ]]
+
+    migrator = loader.FingerprintMigrator(file, partner, filetype)
+    migrator.process()
+
+    self.assertEqual(migrator.migrated, 2)
+    updates = tests.get_mock_calls_by_name(
+        mocked_db.mock_calls, 'get_db().records.bulk_write')[0][1][0]
+
+    # Headers don't have fingerprints
+    self.assertEqual(updates[0]._doc, {'$unset': {'hash': ''}})
+    # Lines are fingerprinted as they're loaded
+    self.assertEqual(updates[1]._doc,
+                     {'$set': {'hash': fingerprint.fingerprint(b'1,a')}})
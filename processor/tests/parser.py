@@ -4,19 +4,17 @@ from unittest import mock
 
 from rivoli import parser
 from rivoli import protos
+from rivoli.utils import decoding
 
 import tests
 
 # pylint: disable=protected-access
 # pyright: reportPrivateUsage=false
 
-@mock.patch('rivoli.record_processor.db')
+@mock.patch('rivoli.record_processor.record_processor.db')
 class ParserTests(unittest.TestCase):
 
   def test_fixedwidth_parse_fields(self, mocked_db: mock.Mock):
-    # Test that the Loader class creates a filename with the File ID
-    file = tests.get_mock_file()
-    partner = tests.get_mock_partner()
     filetype = tests.get_mock_filetype()
 
     # charRanges as configured are 1-based and inclusive
@@ -47,14 +45,155 @@ class ParserTests(unittest.TestCase):
       ),
     ])
 
-    fwparser = parser.FixedWidthParser(file, partner, filetype)
-
-    # The parser initialization subtracts 1 from the start position
-    fields = fwparser._create_recordtype_fields(filetype.recordTypes)
+    # 1 is subtracted from the start position
+    fields = parser.get_fixedwidth_fields(filetype.recordTypes)
     self.assertDictEqual(fields,
         {1001: [
             ((0, 1), 'f1'), ((1, 3), 'f2'), ((14, 20), 'f3'), ((49, 55), 'f4')]
         })
 
-    dct = fwparser._parse_fields('ABCDEFGHIJKLMN   A  ', fields[1001])
+    dct, _ = parser.FixedWidthFieldMap(filetype).parse(
+        1001, 'ABCDEFGHIJKLMN   A  ')
     self.assertDictEqual(dct, {'f1': 'A', 'f2': 'BC', 'f3': 'A', 'f4': ''})
+
+  def test_fixedwidth_field_map(self, _: mock.Mock):
+    filetype = tests.get_mock_filetype()
+    filetype.recordTypes[0].fieldTypes.extend([
+      protos.FieldType(name='id', active=True, isSharedKey=True,
+                       charRange={'start': 1, 'end': 3}),
+      protos.FieldType(name='name', active=True,
+                       charRange={'start': 6, 'end': 10}),
+      protos.FieldType(name='inactive', active=False,
+                       charRange={'start': 4, 'end': 5}),
+    ])
+    # Overlapping fields can't be unpacked with a struct
+    filetype.recordTypes.append(protos.RecordType(id=1002, fieldTypes=[
+      protos.FieldType(name='a', active=True, charRange={'start': 1, 'end': 3}),
+      protos.FieldType(name='b', active=True, charRange={'start': 2, 'end': 4}),
+    ]))
+
+    field_map = parser.FixedWidthFieldMap(filetype)
+    self.assertIsNotNone(field_map._plans[1001].struct)
+    self.assertIsNone(field_map._plans[1002].struct)
+
+    expected = ({'id': '123', 'name': 'CAFE'}, '123')
+    self.assertEqual(field_map.parse(1001, b'123XX CAFE '), expected)
+    self.assertEqual(field_map.parse(1001, '123XX CAFE '), expected)
+    # Short lines have empty values
+    self.assertEqual(field_map.parse(1001, b'123XX CA'),
+                     ({'id': '123', 'name': 'CA'}, '123'))
+    self.assertEqual(field_map.parse(1001, b'12'),
+                     ({'id': '12', 'name': ''}, '12'))
+    self.assertEqual(field_map.parse(1002, b'ABCD'),
+                     ({'a': 'ABC', 'b': 'BCD'}, ''))
+
+    # Positions are characters, not bytes
+    self.assertEqual(field_map.parse(1001, '1é3XX CAFÉ '.encode()),
+                     ({'id': '1é3', 'name': 'CAFÉ'}, '1é3'))
+
+    latin_1_map = parser.FixedWidthFieldMap(filetype, decoding.LATIN_1)
+    self.assertEqual(latin_1_map.parse(1001, b'123XX CAF\xc9'),
+                     ({'id': '123', 'name': 'CAFÉ'}, '123'))
+
+  def test_delimited_update_pipeline(self, _: mock.Mock):
+    filetype = tests.get_mock_filetype()
+    filetype.recordTypes[0].fieldTypes.extend([
+      protos.FieldType(name='id', active=True, isSharedKey=True, columnIndex=1),
+      protos.FieldType(name='name', active=True, columnIndex=3),
+    ])
+    field_map = parser.DelimitedFieldMap(filetype, [])
+    error_log = {'source': protos.ProcessingLog.PARSER}
+
+    pipeline = field_map.get_update_pipeline(1001, error_log)
+    assert pipeline
+    update = pipeline[0]['$set']
+
+    failed = {'$lt': [{'$size': {'$ifNull': ['$rawColumns', []]}}, 3]}
+    self.assertEqual(update['status'], {'$cond': [
+        failed, protos.Record.PARSE_ERROR, protos.Record.PARSED]})
+    self.assertEqual(update['parsedFields'], {'$cond': [
+        failed, '$parsedFields', {'$arrayToObject': [[
+            {'k': {'$literal': 'id'},
+             'v': {'$arrayElemAt': ['$rawColumns', 0]}},
+            {'k': {'$literal': 'name'},
+             'v': {'$arrayElemAt': ['$rawColumns', 2]}},
+        ]]}]})
+
+    log = update['log']['$cond'][1]['$concatArrays'][1][0]
+    self.assertEqual(log['source'], protos.ProcessingLog.PARSER)
+    self.assertEqual(log['message']['$concat'][0],
+                     'Fewer values than fields: Found ')
+    self.assertEqual(log['message']['$concat'][2],
+                     ' values but expected at least 3')
+
+    # Pruned Records only store some columns, and count all of them
+    pipeline = field_map.get_update_pipeline(1001, error_log, [2])
+    assert pipeline
+    update = pipeline[0]['$set']
+    self.assertEqual(update['status']['$cond'][0],
+                     {'$lt': [{'$ifNull': ['$rawColumnCount', 0]}, 3]})
+    self.assertEqual(update['parsedFields']['$cond'][2], {'$arrayToObject': [[
+        {'k': {'$literal': 'id'}, 'v': ''},
+        {'k': {'$literal': 'name'},
+         'v': {'$arrayElemAt': ['$rawColumns', 0]}},
+    ]]})
+
+    # Shared keys which aren't mapped to a column can't be compiled
+    field_map.shared_keys[1001].append('missing')
+    self.assertIsNone(field_map.get_update_pipeline(1001, error_log))
+
+  def test_delimited_parse_in_db(self, mocked_db: mock.Mock):
+    file = tests.get_mock_file()
+    file.status = protos.File.LOADED
+    partner = tests.get_mock_partner()
+    filetype = tests.get_mock_filetype()
+    filetype.recordTypes[0].fieldTypes.extend([
+      protos.FieldType(name='id', active=True, columnIndex=1),
+    ])
+
+    records = mocked_db.get_db.return_value.records
+    records.aggregate.return_value = [
+        {'_id': {'recordType': 1001, 'status': protos.Record.PARSED},
+         'count': 3},
+        {'_id': {'recordType': 1001, 'status': protos.Record.PARSE_ERROR},
+         'count': 1},
+    ]
+
+    delimited_parser = parser.DelimitedParser(file, partner, filetype)
+    delimited_parser.process()
+
+    self.assertEqual(delimited_parser.file.status, protos.File.PARSED)
+    records.find.assert_not_called()
+
+    update_many = tests.get_mock_calls_by_name(records.mock_calls,
+                                               'update_many')
+    self.assertEqual(len(update_many), 1)
+    self.assertEqual(update_many[0].args[0]['recordType'], 1001)
+    self.assertEqual(update_many[0].args[0]['status'],
+                     {'$eq': protos.Record.LOADED})
+
+    stats = delimited_parser.file.stats
+    self.assertEqual(stats.parsedRecordsSuccess, 3)
+    self.assertEqual(stats.steps['PARSE:1001'],
+                     protos.StepStats(input=4, success=3, failure=1))
+
+    # Files with a line index are parsed in the database if their Records
+    # still store their raw columns
+    file.lineIndex = True
+    file.rawColumnsStored = True
+    file.status = protos.File.LOADED
+    records.reset_mock()
+    parser.DelimitedParser(file, partner, filetype).process()
+
+    records.update_many.assert_called_once()
+    records.find.assert_not_called()
+
+    # Records which are read from the line index are parsed here
+    file.rawColumnsStored = False
+    file.status = protos.File.LOADED
+    records.reset_mock()
+    records.find.return_value.sort.return_value = []
+    parser.DelimitedParser(file, partner, filetype).process()
+
+    records.update_many.assert_not_called()
+    records.find.assert_called_once()
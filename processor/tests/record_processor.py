@@ -1,5 +1,7 @@
 """ Unit tests for rivoli.record_processor. """
+import typing as t
 import unittest
+from unittest import mock
 
 from rivoli.record_processor import record_processor
 from rivoli.function_helpers import exceptions
@@ -16,8 +18,9 @@ class RecordProcessor(record_processor.RecordProcessor):
   def _close_processing(self) -> None:
     pass
 
+@mock.patch('rivoli.record_processor.record_processor.db')
 class ExceptionTests(unittest.TestCase):
-  def test_make_exc_log_entry_native_exception(self):
+  def test_make_exc_log_entry_native_exception(self, mocked_db: mock.Mock):
     # We need to do this inside of a try/except so that the method can get
     # the stacktrace
     try:
@@ -31,7 +34,7 @@ class ExceptionTests(unittest.TestCase):
       self.assertEqual(log.summary, 'ValueError')
       self.assertIn('in test_make_exc_log_entry', log.stackTrace)
 
-  def test_make_exc_log_entry_custom_exception(self):
+  def test_make_exc_log_entry_custom_exception(self, mocked_db: mock.Mock):
     # We need to do this inside of a try/except so that the method can get
     # the stacktrace
     try:
@@ -45,3 +48,65 @@ class ExceptionTests(unittest.TestCase):
       self.assertEqual(log.summary, 'sum')
       # RivoliErrors don't get stack trace include in logs
       self.assertEqual(log.stackTrace, '')
+
+class RecordTypeMatcherTests(unittest.TestCase):
+  def _recordtypes(self, *patterns: list[str]) -> list[protos.RecordType]:
+    return [protos.RecordType(id=idx, recordMatches=matches)
+            for idx, matches in enumerate(patterns, 1)]
+
+  def _match_id(self, matcher: record_processor.RecordTypeMatcher, text: str
+      ) -> t.Optional[int]:
+    recordtype = matcher.match(text)
+    return recordtype.id if recordtype else None
+
+  def test_literal_prefix(self):
+    matcher = record_processor.RecordTypeMatcher(
+        self._recordtypes(['HDR.*'], ['D.*', 'E[0-9]+'], ['TRL.*']))
+
+    # Looked up by the shortest prefix, "H"/"D"/"E"/"T"
+    self.assertEqual(matcher._prefix_len, 1)
+    self.assertEqual(self._match_id(matcher, 'HDR 2024'), 1)
+    self.assertEqual(self._match_id(matcher, 'D123'), 2)
+    self.assertEqual(self._match_id(matcher, 'E123'), 2)
+    self.assertEqual(self._match_id(matcher, 'TRL9'), 3)
+    self.assertIsNone(matcher.match('HXX'))
+    self.assertIsNone(matcher.match('Eabc'))
+    self.assertIsNone(matcher.match(''))
+
+  def test_quantified_prefix(self):
+    # "A?" might not be in the match, so it isn't part of the prefix
+    self.assertEqual(
+        record_processor.RecordTypeMatcher._literal_prefix('XA?B.*'), 'X')
+    self.assertEqual(
+        record_processor.RecordTypeMatcher._literal_prefix('A|B'), '')
+
+  def test_combined(self):
+    matcher = record_processor.RecordTypeMatcher(
+        self._recordtypes(['[0-9]+,(a|b)'], ['.*,b', '.*']))
+
+    self.assertIsNotNone(matcher._combined)
+    # The first matching pattern wins
+    self.assertEqual(self._match_id(matcher, '1,b'), 1)
+    self.assertEqual(self._match_id(matcher, 'x,b'), 2)
+    self.assertEqual(self._match_id(matcher, 'x'), 2)
+
+  def test_uncombinable(self):
+    matcher = record_processor.RecordTypeMatcher(
+        self._recordtypes([r'(?P<x>[0-9])\1'], ['.*']))
+
+    self.assertIsNone(matcher._combined)
+    self.assertEqual(self._match_id(matcher, '11'), 1)
+    self.assertEqual(self._match_id(matcher, '12'), 2)
+
+  def test_inline_flags(self):
+    # Global flags are only allowed at the start of the combined pattern
+    matcher = record_processor.RecordTypeMatcher(
+        self._recordtypes(['(?i)hdr.*'], ['[0-9]+,.*']))
+
+    self.assertIsNone(matcher._combined)
+    self.assertEqual(self._match_id(matcher, 'HDR 2024'), 1)
+    self.assertEqual(self._match_id(matcher, '1,a'), 2)
+
+  def test_no_patterns(self):
+    matcher = record_processor.RecordTypeMatcher(self._recordtypes([]))
+    self.assertIsNone(matcher.match('anything'))
@@ -0,0 +1,59 @@
+""" Unit tests for rivoli.utils.column_profile. """
+import unittest
+
+from rivoli.utils import column_profile
+
+class ColumnProfilerTests(unittest.TestCase):
+  def test_profiles(self):
+    profiler = column_profile.ColumnProfiler(['ID', 'STATE'])
+
+    profiler.add_rows([[str(idx), 'CA' if idx % 3 else '']
+                       for idx in range(600)])
+    # Short rows are missing the last column, and extra columns are profiled
+    profiler.add_rows([['600'], ['601', 'NY', 'x']])
+
+    id_profile, state_profile, extra_profile = profiler.get_profiles()
+
+    self.assertEqual(id_profile.name, 'ID')
+    self.assertEqual(id_profile.count, 602)
+    self.assertEqual(id_profile.missingCount, 0)
+    self.assertEqual((id_profile.minLength, id_profile.maxLength), (1, 3))
+    # More values than the sketch keeps, so this is an estimate
+    self.assertAlmostEqual(id_profile.distinctEstimate, 602, delta=602 * 0.2)
+
+    self.assertEqual(state_profile.count, 601)
+    self.assertEqual(state_profile.missingCount, 1)
+    self.assertEqual(state_profile.emptyCount, 200)
+    self.assertEqual(state_profile.distinctEstimate, 3)
+    self.assertEqual([(value.value, value.count)
+                      for value in state_profile.topValues],
+                     [('CA', 400), ('', 200), ('NY', 1)])
+
+    self.assertEqual(extra_profile.name, '')
+    self.assertEqual(extra_profile.count, 1)
+    self.assertEqual(extra_profile.missingCount, 601)
+
+  def test_top_values_bounded(self):
+    profiler = column_profile.ColumnProfiler()
+    # Half of the values are common, so that the column isn't mostly distinct
+    # for any hash seed
+    for chunk in range(20):
+      profiler.add_rows([['common']] * 100 +
+                        [[f'{chunk}-{idx}'] for idx in range(100)])
+
+    profile, = profiler.get_profiles()
+    self.assertEqual(len(profile.topValues), column_profile.TOP_VALUES)
+    self.assertEqual((profile.topValues[0].value, profile.topValues[0].count),
+                     ('common', 2000))
+
+  def test_interval(self):
+    profiler = column_profile.ColumnProfiler(interval=10)
+    # Every 10th row across chunks: 0, 10, 20, ...
+    for start in range(0, 100, 7):
+      profiler.add_rows([[str(idx)] for idx in range(start, start + 7)])
+
+    profile, = profiler.get_profiles()
+    self.assertEqual(profile.sampleInterval, 10)
+    self.assertEqual(profile.count, 11)
+    self.assertEqual(profile.distinctEstimate, 11)
+    self.assertEqual((profile.minLength, profile.maxLength), (1, 3))
@@ -0,0 +1,84 @@
+""" Unit tests for rivoli.utils.compression. """
+import bz2
+import gzip
+import hashlib
+import pathlib
+import tempfile
+import unittest
+import zipfile
+
+import zstandard
+
+from rivoli import protos
+from rivoli.utils import compression
+from rivoli.utils import utils
+
+CONTENTS = b'a,b\n' + b'1,2\n' * 5000
+
+def _write_zip(path: pathlib.Path, contents: bytes) -> None:
+  with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+    archive.writestr('file.csv', contents)
+
+COMPRESSORS = {
+  protos.File.GZIP: lambda path, contents: path.write_bytes(
+      gzip.compress(contents)),
+  protos.File.ZSTD: lambda path, contents: path.write_bytes(
+      zstandard.ZstdCompressor().compress(contents)),
+  protos.File.BZIP2: lambda path, contents: path.write_bytes(
+      bz2.compress(contents)),
+  protos.File.ZIP: _write_zip,
+}
+
+class CompressionTests(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self.path = pathlib.Path(self._tmpdir.name) / 'file.csv'
+
+  def tearDown(self):
+    self._tmpdir.cleanup()
+
+  def test_detect(self):
+    self.path.write_bytes(CONTENTS)
+    self.assertEqual(compression.detect(self.path),
+                     protos.File.COMPRESSION_NONE)
+
+    for file_compression, compress in COMPRESSORS.items():
+      compress(self.path, CONTENTS)
+      self.assertEqual(compression.detect(self.path), file_compression)
+
+  def test_open_text(self):
+    for compress in COMPRESSORS.values():
+      compress(self.path, CONTENTS)
+
+      with compression.open_text(self.path, encoding='UTF-8') as fobj:
+        self.assertEqual(fobj.read(), CONTENTS.decode())
+
+  def test_zstd_multiple_frames(self):
+    cctx = zstandard.ZstdCompressor()
+    self.path.write_bytes(cctx.compress(CONTENTS) + cctx.compress(CONTENTS))
+
+    with compression.open_binary(self.path) as fobj:
+      self.assertEqual(fobj.read(), CONTENTS * 2)
+
+  def test_zip_multiple_members(self):
+    with zipfile.ZipFile(self.path, 'w') as archive:
+      archive.writestr('a.csv', CONTENTS)
+      archive.writestr('b.csv', CONTENTS)
+
+    with self.assertRaises(ValueError):
+      compression.open_binary(self.path)
+
+  def test_get_file_summary(self):
+    for file_compression, compress in COMPRESSORS.items():
+      compress(self.path, CONTENTS)
+      stored = self.path.read_bytes()
+
+      summary = utils.get_file_summary(self.path)
+
+      self.assertEqual(summary.compression, file_compression)
+      self.assertEqual(summary.hash, hashlib.md5(stored).digest())
+      self.assertEqual(summary.size_bytes, len(stored))
+      self.assertEqual(summary.content_hash, hashlib.md5(CONTENTS).digest())
+      self.assertEqual(summary.content_size_bytes, len(CONTENTS))
+      self.assertEqual(summary.rows, 5001)
+      self.assertEqual(summary.sample, CONTENTS[:utils.SAMPLE_SIZE])
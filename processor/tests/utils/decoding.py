@@ -0,0 +1,37 @@
+""" Unit tests for rivoli.utils.decoding. """
+import unittest
+
+from rivoli.utils import decoding
+
+class DecodingTests(unittest.TestCase):
+  def test_detect(self):
+    self.assertEqual(decoding.detect(b'a,b,c\r\n'), decoding.UTF_8)
+    self.assertEqual(decoding.detect('a,café\r\n'.encode()),
+                     decoding.UTF_8)
+    # A multi-byte character cut off at the end of the sample is still UTF-8
+    self.assertEqual(decoding.detect('a,café'.encode()[:-1]),
+                     decoding.UTF_8)
+    self.assertEqual(decoding.detect(b'a,caf\xe9\r\n'), decoding.LATIN_1)
+    # Mostly UTF-8 with a stray byte
+    self.assertEqual(decoding.detect('café,\xe9'.encode() + b'\xe9'),
+                     decoding.UTF_8)
+
+  def test_decode(self):
+    with decoding.count_anomalies() as anomalies:
+      # Valid UTF-8 is unchanged, and invalid bytes are replaced
+      self.assertEqual(decoding.decode('café'.encode()), 'café')
+      self.assertEqual(decoding.decode(b'caf\xe9 x\xa0y'),
+                       'café x y')
+      self.assertEqual(decoding.decode(b'caf\xe9 x\xa0y', decoding.LATIN_1),
+                       'café x y')
+
+    self.assertEqual(anomalies, {0xe9: 2, 0xa0: 2})
+    self.assertEqual(decoding.summarize_anomalies(anomalies, limit=1),
+        "Replaced 4 unexpected non-UTF-8 bytes: 0xE9 'é' (2) and 1 others")
+
+  def test_decode_sample(self):
+    with decoding.count_anomalies() as anomalies:
+      self.assertEqual(decoding.decode_sample(b'a\xe9', decoding.LATIN_1),
+                       'aé')
+
+    self.assertFalse(anomalies)
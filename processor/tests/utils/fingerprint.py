@@ -0,0 +1,54 @@
+""" Unit tests for rivoli.utils.fingerprint. """
+import unittest
+
+from rivoli import protos
+from rivoli.utils import fingerprint
+
+class FingerprinterTests(unittest.TestCase):
+  def test_raw_line(self):
+    fingerprinter = fingerprint.Fingerprinter(protos.FileType())
+
+    line_hash = fingerprinter.line('a,b,c')
+    self.assertEqual(len(line_hash), fingerprint.FINGERPRINT_SIZE)
+    self.assertEqual(line_hash, fingerprint.fingerprint(b'a,b,c'))
+    self.assertNotEqual(line_hash, fingerprinter.line('a,b,d'))
+
+    # Fields aren't fingerprinted
+    self.assertEqual(fingerprinter.parsed({'a': '1'}), b'')
+    self.assertEqual(fingerprinter.validated({'a': '1'}), b'')
+
+  def test_selected_fields(self):
+    fingerprinter = fingerprint.Fingerprinter(protos.FileType(
+        fingerprint=protos.Fingerprint(
+            source=protos.Fingerprint.VALIDATED_FIELDS,
+            fields=['id', 'amount'])))
+
+    self.assertEqual(fingerprinter.line('a,b,c'), b'')
+    self.assertEqual(fingerprinter.parsed({'id': '1'}), b'')
+
+    # Only the selected fields matter, in any order
+    self.assertEqual(
+        fingerprinter.validated({'id': '1', 'amount': '5', 'note': 'x'}),
+        fingerprinter.validated({'note': 'y', 'amount': '5', 'id': '1'}))
+    self.assertNotEqual(
+        fingerprinter.validated({'id': '1', 'amount': '5'}),
+        fingerprinter.validated({'id': '1', 'amount': '6'}))
+    # Missing fields are treated as empty
+    self.assertEqual(fingerprinter.validated({'id': '1'}),
+                     fingerprinter.validated({'id': '1', 'amount': ''}))
+
+  def test_all_fields(self):
+    fingerprinter = fingerprint.Fingerprinter(protos.FileType(
+        fingerprint=protos.Fingerprint(
+            source=protos.Fingerprint.PARSED_FIELDS)))
+
+    self.assertNotEqual(fingerprinter.parsed({'id': '1', 'note': 'x'}),
+                        fingerprinter.parsed({'id': '1', 'note': 'y'}))
+
+  def test_none(self):
+    fingerprinter = fingerprint.Fingerprinter(protos.FileType(
+        fingerprint=protos.Fingerprint(source=protos.Fingerprint.NONE)))
+
+    self.assertEqual(fingerprinter.line('a,b,c'), b'')
+    self.assertEqual(fingerprinter.parsed({'a': '1'}), b'')
+    self.assertEqual(fingerprinter.validated({'a': '1'}), b'')
@@ -0,0 +1,34 @@
+""" Unit tests for rivoli.utils.inotify. """
+import pathlib
+import tempfile
+import unittest
+
+from rivoli.utils import inotify
+
+class InotifyTests(unittest.TestCase):
+  def test_read_events(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      with inotify.Inotify() as notifier:
+        notifier.add_watch(tmpdir,
+                           inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+
+        # No events yet
+        self.assertEqual(notifier.read_events(0), [])
+
+        (pathlib.Path(tmpdir) / 'written.csv').write_text('a,b\n')
+
+        other = pathlib.Path(tmpdir) / 'other'
+        other.mkdir()
+        (other / 'moved.csv').write_text('a,b\n')
+        (other / 'moved.csv').rename(pathlib.Path(tmpdir) / 'moved.csv')
+
+        events = notifier.read_events(1)
+
+    self.assertEqual([(event.mask, event.name) for event in events],
+                     [(inotify.IN_CLOSE_WRITE, 'written.csv'),
+                      (inotify.IN_MOVED_TO, 'moved.csv')])
+
+  def test_add_watch_missing_path(self):
+    with inotify.Inotify() as notifier:
+      with self.assertRaises(FileNotFoundError):
+        notifier.add_watch('/does/not/exist', inotify.IN_CLOSE_WRITE)
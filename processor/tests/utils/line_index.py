@@ -0,0 +1,58 @@
+""" Unit tests for rivoli.utils.line_index. """
+import pathlib
+import tempfile
+import unittest
+
+from rivoli.utils import line_index
+from rivoli.utils import utils
+
+class LineIndexTests(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self.path = pathlib.Path(self._tmpdir.name) / 'file.csv'
+
+  def tearDown(self):
+    self._tmpdir.cleanup()
+
+  def _index(self, contents: bytes) -> line_index.LineIndex:
+    self.path.write_bytes(contents)
+
+    summary = utils.get_file_summary(self.path, index_lines=True)
+    assert summary.line_offsets is not None
+    line_index.write_index(self.path, summary.line_offsets)
+
+    index = line_index.LineIndex(self.path)
+    self.addCleanup(index.close)
+    return index
+
+  def test_get_line(self):
+    index = self._index(b'a,b\r\nc,d\n\ne,f')
+
+    self.assertEqual(len(index), 4)
+    self.assertEqual(index.get_line(1), b'a,b')
+    self.assertEqual(index.get_line(2), b'c,d')
+    self.assertEqual(index.get_line(3), b'')
+    # Final line without a newline
+    self.assertEqual(index.get_line(4), b'e,f')
+
+    with self.assertRaises(IndexError):
+      index.get_line(0)
+    with self.assertRaises(IndexError):
+      index.get_line(5)
+
+  def test_lines_across_reads(self):
+    lines = [f'{idx},{"x" * (idx % 100)}'.encode()
+             for idx in range(utils.READ_BUFFER_SIZE // 20)]
+    index = self._index(b'\n'.join(lines) + b'\n')
+
+    self.assertEqual(len(index), len(lines))
+    for idx in (0, 1, len(lines) // 2, len(lines) - 1):
+      self.assertEqual(index.get_line(idx + 1), lines[idx])
+
+  def test_empty_file(self):
+    index = self._index(b'')
+
+    self.assertEqual(len(index), 0)
+    with self.assertRaises(IndexError):
+      index.get_line(1)
+
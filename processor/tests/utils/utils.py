@@ -0,0 +1,126 @@
+""" Unit tests for rivoli.utils.utils. """
+import errno
+import hashlib
+import os
+import pathlib
+import tempfile
+import typing as t
+import unittest
+from unittest import mock
+
+from rivoli import protos
+from rivoli.utils import utils
+
+import tests
+
+class FileSummaryTests(unittest.TestCase):
+  def test_get_file_summary(self):
+    path = pathlib.Path(tests.TEST_FILES_DIR) / 'loader_csv-123.csv'
+    contents = path.read_bytes()
+
+    summary = utils.get_file_summary(path)
+
+    self.assertEqual(summary.hash, hashlib.md5(contents).digest())
+    self.assertEqual(summary.size_bytes, len(contents))
+    self.assertEqual(summary.rows, len(contents.decode().splitlines()))
+    self.assertEqual(summary.sample, contents[:utils.SAMPLE_SIZE])
+
+  def test_get_file_summary_rows(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = pathlib.Path(tmpdir) / 'file.txt'
+
+      # Final line without a newline
+      path.write_bytes(b'a\nb\nc')
+      self.assertEqual(utils.get_file_summary(path).rows, 3)
+
+      path.write_bytes(b'a\nb\nc\n')
+      self.assertEqual(utils.get_file_summary(path).rows, 3)
+
+      path.write_bytes(b'')
+      self.assertEqual(utils.get_file_summary(path).rows, 0)
+
+class MoveFileTests(unittest.TestCase):
+  def setUp(self):
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self.src = pathlib.Path(self._tmpdir.name) / 'src.csv'
+    self.dest = pathlib.Path(self._tmpdir.name) / 'dest.csv'
+
+    self.contents = b'a,b\n' * 100000
+    self.src.write_bytes(self.contents)
+
+  def tearDown(self):
+    self._tmpdir.cleanup()
+
+  def _assert_moved(self):
+    self.assertFalse(self.src.exists())
+    self.assertEqual(self.dest.read_bytes(), self.contents)
+
+  def test_rename(self):
+    self.assertEqual(utils.move_file(self.src, self.dest),
+                     protos.CopyLog.EvaluatedFile.RENAME)
+    self._assert_moved()
+
+  @mock.patch('os.rename', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  def test_hardlink(self, _: mock.Mock):
+    self.assertEqual(utils.move_file(self.src, self.dest),
+                     protos.CopyLog.EvaluatedFile.HARDLINK)
+    self._assert_moved()
+
+  @mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  @mock.patch('os.rename', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  def test_copy(self, *_: mock.Mock):
+    self.assertEqual(utils.move_file(self.src, self.dest),
+                     protos.CopyLog.EvaluatedFile.COPY)
+    self._assert_moved()
+
+  @mock.patch('os.copy_file_range', side_effect=OSError(errno.ENOSYS, ''))
+  @mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  @mock.patch('os.rename', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  def test_copy_fallback(self, *_: mock.Mock):
+    with mock.patch('os.sendfile', side_effect=OSError(errno.EINVAL, '')):
+      utils.move_file(self.src, self.dest)
+    self._assert_moved()
+
+  def test_missing_source(self):
+    with self.assertRaises(FileNotFoundError):
+      utils.move_file(self.src.with_name('missing.csv'), self.dest)
+
+  @mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  @mock.patch('os.rename', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  def test_failed_copy_cleans_up(self, *_: mock.Mock):
+    with mock.patch('shutil.copystat', side_effect=OSError(errno.EIO, '')):
+      with self.assertRaises(OSError):
+        utils.move_file(self.src, self.dest)
+
+    # The source is kept and no partial copy is left behind
+    self.assertTrue(self.src.exists())
+    self.assertFalse(self.dest.exists())
+
+  def _refuse_unlink_source(self) -> t.ContextManager[mock.Mock]:
+    unlink = os.unlink
+    def _unlink(path: t.Any, *args: t.Any, **kwargs: t.Any) -> None:
+      if pathlib.Path(path) == self.src:
+        raise OSError(errno.EPERM, 'Operation not permitted')
+      unlink(path, *args, **kwargs)
+
+    return mock.patch('os.unlink', side_effect=_unlink)
+
+  @mock.patch('os.rename', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  def test_failed_unlink_after_hardlink(self, _: mock.Mock):
+    with self._refuse_unlink_source(), self.assertRaises(OSError):
+      utils.move_file(self.src, self.dest)
+
+    # The link is removed rather than copied over, which would truncate the
+    # source too
+    self.assertEqual(self.src.read_bytes(), self.contents)
+    self.assertFalse(self.dest.exists())
+
+  @mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  @mock.patch('os.rename', side_effect=OSError(errno.EXDEV, 'Cross-device'))
+  def test_failed_unlink_after_copy(self, *_: mock.Mock):
+    with self._refuse_unlink_source(), self.assertRaises(OSError):
+      utils.move_file(self.src, self.dest)
+
+    # The file isn't left in both directories
+    self.assertEqual(self.src.read_bytes(), self.contents)
+    self.assertFalse(self.dest.exists())
@@ -0,0 +1,81 @@
+""" Unit tests for rivoli.validation.cache. """
+import unittest
+from unittest import mock
+
+import redis
+
+from rivoli import protos
+from rivoli.function_helpers import exceptions
+from rivoli.validation import cache
+
+# pylint: disable=protected-access
+# pyright: reportPrivateUsage=false
+
+class ResultCacheTests(unittest.TestCase):
+  def test_lru(self):
+    results = cache.ResultCache(size=2, redis_url='')
+    results.set(('f', 'a'), cache.Result('A'))
+    results.set(('f', 'b'), cache.Result('B'))
+
+    # Getting a result makes it the most recently used
+    self.assertEqual(results.get(('f', 'a')), cache.Result('A'))
+    results.set(('f', 'c'), cache.Result('C'))
+
+    self.assertIsNone(results.get(('f', 'b')))
+    self.assertEqual(results.get(('f', 'a')), cache.Result('A'))
+    self.assertEqual(results.get(('f', 'c')), cache.Result('C'))
+
+  def test_error_replay(self):
+    exc = exceptions.ValidationError('bad value', summary='Bad')
+    result = cache.get_error_result(exc)
+    assert result
+
+    with self.assertRaises(exceptions.ValidationError) as ctx:
+      result.replay('value')
+
+    self.assertEqual(str(ctx.exception), 'bad value')
+    self.assertEqual(ctx.exception.summary, 'Bad')
+    self.assertEqual(ctx.exception.error_code,
+                     protos.ProcessingLog.OTHER_VALIDATION_ERROR)
+
+    # Subclasses wouldn't be replayed as themselves
+    class SubclassError(exceptions.ValidationError):
+      pass
+
+    self.assertIsNone(cache.get_error_result(SubclassError('bad value')))
+
+  def test_function_key(self):
+    function = protos.Function(id='fn', pythonFunction='mod.func')
+    key = cache.get_function_key(protos.FunctionConfig(parameters=['1']),
+                                 function)
+
+    self.assertNotEqual(key, cache.get_function_key(
+        protos.FunctionConfig(parameters=['2']), function))
+    self.assertNotEqual(key, cache.get_function_key(
+        protos.FunctionConfig(parameters=['1']),
+        protos.Function(id='fn', pythonFunction='mod.other')))
+
+  @mock.patch.object(cache.redis.Redis, 'from_url')
+  def test_redis(self, from_url: mock.Mock):
+    client = from_url.return_value
+    client.get.return_value = None
+
+    results = cache.ResultCache(redis_url='redis://cache', ttl=60)
+    self.assertIsNone(results.get(('f', 'a')))
+
+    results.set(('f', 'a'), cache.Result('A'))
+    redis_key = client.set.call_args.args[0]
+    self.assertTrue(redis_key.startswith('rivoli:validation:'))
+    self.assertEqual(client.set.call_args.kwargs, {'ex': 60})
+
+    # Results from other workers are cached locally
+    client.get.return_value = client.set.call_args.args[1].encode()
+    results = cache.ResultCache(redis_url='redis://cache', ttl=60)
+    self.assertEqual(results.get(('f', 'a')), cache.Result('A'))
+    self.assertEqual(results.get(('f', 'a')), cache.Result('A'))
+    self.assertEqual(client.get.call_count, 2)
+
+    # Redis errors disable Redis for the rest of the run
+    client.get.side_effect = redis.ConnectionError('down')
+    self.assertIsNone(results.get(('f', 'b')))
+    self.assertIsNone(results._redis)
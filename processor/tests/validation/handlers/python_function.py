@@ -1,8 +1,10 @@
 """ Unit tests for rivoli.validation.handlers.python_function. """
 import enum
 import unittest
+from unittest import mock
 
 from rivoli import protos
+from rivoli.function_helpers import exceptions
 from rivoli.validation.handlers import python_function
 
 # pylint: disable=protected-access
@@ -42,3 +44,31 @@ class PythonFunctionTests(unittest.TestCase):
 
     params = python_function._create_parameters(test_func, cfg, func)
     self.assertEqual([1, 'a string', Color.RED, 1.2, True, False], params)
+
+  def test_bind_field_validation(self):
+    func = protos.Function(
+      pythonFunction='rivoli.validation.validators.strings.match_full',
+      parameters=[
+        protos.Function.Parameter(type='STRING'),
+        protos.Function.Parameter(type='BOOLEAN'),
+      ]
+    )
+    cfg = protos.FunctionConfig(parameters=['[a-z]+', 'false'])
+
+    with mock.patch.object(python_function.importlib, 'import_module',
+                           wraps=python_function.importlib.import_module
+                           ) as import_module:
+      validate = python_function.bind_field_validation(cfg, func)
+
+      self.assertEqual(validate('abc'), 'abc')
+      # The parameters were converted when the function was bound
+      with self.assertRaises(exceptions.ValidationError):
+        validate('ABC')
+
+    import_module.assert_called_once()
+
+  def test_bind_missing_module(self):
+    func = protos.Function(pythonFunction='rivoli.not_a_module.func')
+
+    with self.assertRaises(exceptions.ConfigurationError):
+      python_function.bind_field_validation(protos.FunctionConfig(), func)
@@ -0,0 +1,119 @@
+""" Unit tests for rivoli.validator. """
+import unittest
+from unittest import mock
+
+from rivoli import protos
+from rivoli import validator
+from rivoli.validation.validators import strings
+
+import tests
+
+# pylint: disable=protected-access
+# pyright: reportPrivateUsage=false
+
+def get_filetype() -> protos.FileType:
+  filetype = tests.get_mock_filetype()
+  filetype.recordTypes[0].fieldTypes.append(protos.FieldType(
+    id='fName', name='name', active=True,
+    validations=[protos.FunctionConfig(id='cfgMatch', functionId='fnMatch',
+                                       parameters=['[a-z]+', 'false'])],
+  ))
+
+  return filetype
+
+def get_record(line_num: int, name: str) -> dict[str, object]:
+  return {'_id': (123 << 32) + line_num, 'recordType': 1001,
+          'status': protos.Record.PARSED, 'parsedFields': {'name': name}}
+
+@mock.patch('rivoli.record_processor.record_processor.db')
+@mock.patch('rivoli.validator.admin_entities.get_functions_by_ids')
+class ValidatorTests(unittest.TestCase):
+  def _validate(self, mocked_db: mock.Mock, records: list[dict[str, object]]
+      ) -> validator.Validator:
+    file = tests.get_mock_file()
+    file.status = protos.File.PARSED
+    mydb = mocked_db.get_db.return_value
+    mydb.records.find.return_value.sort.return_value = records
+
+    v = validator.Validator(file, tests.get_mock_partner(), get_filetype())
+    v.process()
+    return v
+
+  def test_bound_validations(self, get_functions: mock.Mock,
+      mocked_db: mock.Mock):
+    get_functions.return_value = {'fnMatch': protos.Function(
+      id='fnMatch',
+      pythonFunction='rivoli.validation.validators.strings.match_full',
+      parameters=[protos.Function.Parameter(type='STRING'),
+                  protos.Function.Parameter(type='BOOLEAN')],
+    )}
+
+    with mock.patch.object(validator.handler, 'bind_function',
+                           wraps=validator.handler.bind_function) as bind:
+      v = self._validate(mocked_db, [get_record(1, 'abc'),
+                                     get_record(2, 'ABC'),
+                                     get_record(3, 'def')])
+
+    # The function was bound once for all of the Records
+    bind.assert_called_once()
+
+    self.assertEqual(v.file.status, protos.File.VALIDATED)
+    self.assertEqual(v.file.stats.validatedRecordsSuccess, 2)
+    self.assertEqual(v.file.stats.validatedRecordsError, 1)
+    self.assertEqual(v.file.stats.validationErrors, 1)
+    self.assertEqual(v.file.stats.steps['VALIDATE:1001:fName:cfgMatch'],
+                     protos.StepStats(input=3, success=2, failure=1))
+
+  def test_binding_error(self, get_functions: mock.Mock,
+      mocked_db: mock.Mock):
+    get_functions.return_value = {'fnMatch': protos.Function(
+      id='fnMatch', pythonFunction='rivoli.not_a_module.func')}
+
+    v = self._validate(mocked_db, [get_record(1, 'abc'),
+                                   get_record(2, 'def')])
+
+    # The error is logged on the first Record like any error from calling the
+    # function, and stops validating the File
+    self.assertEqual(v.file.status, protos.File.VALIDATE_ERROR)
+    self.assertIn('ConfigurationError', v.file.log[-1].message)
+
+    bulk_write = mocked_db.get_db.return_value.records.bulk_write
+    updates = bulk_write.call_args.args[0]
+    self.assertEqual(len(updates), 1)
+    log = updates[0]._doc['$set']['log'][0]
+    self.assertEqual(log['functionId'], 'fnMatch')
+    self.assertEqual(log['field'], 'name')
+
+  def test_pure_function_cache(self, get_functions: mock.Mock,
+      mocked_db: mock.Mock):
+    get_functions.return_value = {'fnMatch': protos.Function(
+      id='fnMatch', pure=True,
+      pythonFunction='rivoli.validation.validators.strings.match_full',
+      parameters=[protos.Function.Parameter(type='STRING'),
+                  protos.Function.Parameter(type='BOOLEAN')],
+    )}
+
+    with mock.patch('rivoli.validation.validators.strings._regexp_match',
+                    wraps=strings._regexp_match) as regexp_match:
+      v = self._validate(mocked_db, [get_record(1, 'abc'),
+                                     get_record(2, 'ABC'),
+                                     get_record(3, 'abc'),
+                                     get_record(4, 'ABC')])
+
+    # Each distinct value was only validated once
+    self.assertEqual(regexp_match.call_count, 2)
+
+    self.assertEqual(v.file.stats.steps['VALIDATE:1001:fName:cfgMatch'],
+                     protos.StepStats(input=4, success=2, failure=2,
+                                      cacheHits=2, cacheMisses=2))
+
+    # Cached ValidationErrors are logged like the original
+    self.assertEqual(v.file.stats.validatedRecordsError, 2)
+    self.assertEqual(v.file.stats.validationErrors, 2)
+
+    updates = mocked_db.get_db.return_value.records.bulk_write.call_args.args[0]
+    logs = [update._doc['$set'].get('log') for update in updates]
+    self.assertIsNone(logs[0])
+    for log in logs[1][0], logs[3][0]:
+      del log['time']
+    self.assertEqual(logs[1], logs[3])
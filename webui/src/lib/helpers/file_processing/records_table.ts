@@ -157,6 +157,14 @@ export function makeExpandedRow(data: any): string {
           .join(',') +
         '</pre></div>'
     );
+  } else if (data.rawLine) {
+    lines.push(`Record #: ${data.id}`);
+
+    lines.push(
+      '<div><h5>Raw Line</h5><pre>' +
+        `<span class="raw">${escapeHTML(data.rawLine)}</span>` +
+        '</pre></div>'
+    );
   }
   if (data.parsedFields) {
     lines.push(
@@ -3,6 +3,7 @@ import { json } from '@sveltejs/kit';
 import { createTask } from '$lib/helpers/celery';
 import { makeLogMsg } from '$lib/helpers/utils';
 import { db, getEntitiesList } from '$lib/server/db';
+import { readIndexedLines } from '$lib/server/line_index';
 
 import {
   File_Status,
@@ -45,9 +46,43 @@ export async function getRequestRecords(
     (await countP).map((s) => [s.id, s.count])
   );
 
+  const records = await recordsP;
+  await addIndexedRawLines(fileId, records);
+
   return json({
     status: 'success',
-    data: { records: await recordsP, statusCounts: statusCounts }
+    data: { records: records, statusCounts: statusCounts }
+  });
+}
+
+// Records from indexed Files don't store their raw values, so read them from
+// the File's line index instead.
+async function addIndexedRawLines(fileId: string, records: Array<any>) {
+  const unstored = records.filter(
+    (record) => !record.rawLine && !record.rawColumns?.length);
+  if (!unstored.length) {
+    return;
+  }
+
+  const file = await db.collection('files').findOne(
+    { _id: Number(fileId) },
+    { projection: { name: 1, location: 1, lineIndex: 1, encoding: 1 } });
+  if (!file?.lineIndex) {
+    return;
+  }
+
+  // The lower 4 bytes of the Record ID are the row number
+  const lineNums = unstored.map(
+    (record) => record.rawLineNum ||
+                Number(BigInt(record.id) & ((1n << 32n) - 1n)));
+
+  const lines = await readIndexedLines(
+    { id: Number(fileId), name: file.name, location: file.location,
+      lineIndex: file.lineIndex, encoding: file.encoding },
+    lineNums);
+
+  unstored.forEach((record, idx) => {
+    record.rawLine = lines.get(lineNums[idx]);
   });
 }
 
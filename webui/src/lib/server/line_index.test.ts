@@ -0,0 +1,74 @@
+import { promises as fsp } from 'fs';
+import * as os from 'os';
+import * as path from 'path';
+import { afterEach, beforeEach, describe, expect, it } from 'vitest';
+
+import { getLocalFilePath, readIndexedLines } from './line_index';
+
+// Writes a file and its line index as the Copier would.
+async function writeIndexedFile(location: string, data: Buffer,
+                                encoding?: string) {
+  const file = { id: 123, name: 'test.csv', location, lineIndex: true,
+                 encoding };
+
+  const offsets = [0];
+  data.forEach((byte, idx) => {
+    if (byte === 0x0a) {
+      offsets.push(idx + 1);
+    }
+  });
+  if (offsets[offsets.length - 1] !== data.length) {
+    offsets.push(data.length);
+  }
+
+  const index = Buffer.alloc(offsets.length * 8);
+  offsets.forEach((offset, idx) => index.writeBigUInt64LE(BigInt(offset),
+                                                          idx * 8));
+
+  const filePath = getLocalFilePath(file);
+  await fsp.writeFile(filePath, data);
+  await fsp.writeFile(filePath + '.idx', index);
+
+  return file;
+}
+
+describe('readIndexedLines', () => {
+  let location: string;
+
+  beforeEach(async () => {
+    location = await fsp.mkdtemp(path.join(os.tmpdir(), 'line_index-'));
+  });
+
+  afterEach(async () => {
+    await fsp.rm(location, { recursive: true });
+  });
+
+  it('reads lines by number', async () => {
+    const file = await writeIndexedFile(
+      location, Buffer.from('ID,NAME\r\n1,café\r\n2,b\r\n'));
+
+    const lines = await readIndexedLines(file, [2, 3, 5]);
+    expect([...lines]).toEqual([[2, '1,café'], [3, '2,b']]);
+  });
+
+  it('replaces bytes which are not UTF-8 as the Loader does', async () => {
+    // A Latin-1 "é" and non-breaking space, and a truncated "€" before an
+    // ASCII character
+    const file = await writeIndexedFile(
+      location, Buffer.from([
+        ...Buffer.from('1,caf'), 0xe9, 0xa0, 0x2c, 0xe2, 0x82, 0x41,
+        ...Buffer.from(',€\n')]));
+
+    const lines = await readIndexedLines(file, [1]);
+    expect(lines.get(1)).toBe('1,cafe\u0301 ,a\u0302\u0082A,€');
+  });
+
+  it('decodes Latin-1 files', async () => {
+    const file = await writeIndexedFile(
+      location, Buffer.from([...Buffer.from('1,caf'), 0xe9, 0xa0, 0x0a]),
+      'ISO-8859-1');
+
+    const lines = await readIndexedLines(file, [1]);
+    expect(lines.get(1)).toBe('1,cafe\u0301 ');
+  });
+});
@@ -0,0 +1,149 @@
+import { promises as fsp } from 'fs';
+import * as path from 'path';
+
+// Reads raw lines from the line index which the Copier writes next to each
+// processed file (see rivoli.utils.line_index in the processor). The index is
+// an array of little-endian uint64 line start offsets followed by the file
+// size, so line N (1-based) is the bytes between offsets N-1 and N.
+
+const INDEX_SUFFIX = '.idx';
+const OFFSET_SIZE = 8;
+
+// File.encoding of files which the Loader detected as Latin-1 (see
+// rivoli.utils.decoding). Any other encoding is UTF-8.
+const LATIN_1 = 'ISO-8859-1';
+
+interface IndexedFile {
+  id: number;
+  name: string;
+  location: string;
+  lineIndex?: boolean;
+  encoding?: string;
+}
+
+export function getLocalFilePath(file: IndexedFile): string {
+  const ext = path.extname(file.name);
+  const stem = path.basename(file.name, ext);
+  return path.join(file.location, `${stem}-${file.id}${ext}`);
+}
+
+// Replacement text for bytes which aren't UTF-8, as in rivoli.utils.decoding.
+// Other bytes are replaced by their Latin-1 character's NFKD normalization.
+const BYTE_REPLACEMENTS: Map<number, string> = new Map([
+  [0xa0, ' '], // Non-breaking space
+]);
+
+function getReplacement(byte: number): string {
+  return (BYTE_REPLACEMENTS.get(byte) ??
+          String.fromCharCode(byte).normalize('NFKD'));
+}
+
+// Returns the length of the UTF-8 sequence starting at `start`, or 0 if the
+// byte there doesn't start a well-formed sequence.
+function sequenceLength(line: Buffer, start: number): number {
+  const lead = line[start];
+  let length = 0;
+  let [low, high] = [0x80, 0xbf];
+
+  if (lead < 0x80) {
+    return 1;
+  } else if (lead >= 0xc2 && lead <= 0xdf) {
+    length = 2;
+  } else if (lead >= 0xe0 && lead <= 0xef) {
+    length = 3;
+    if (lead === 0xe0) {
+      low = 0xa0;  // Overlong
+    } else if (lead === 0xed) {
+      high = 0x9f;  // Surrogates
+    }
+  } else if (lead >= 0xf0 && lead <= 0xf4) {
+    length = 4;
+    if (lead === 0xf0) {
+      low = 0x90;  // Overlong
+    } else if (lead === 0xf4) {
+      high = 0x8f;  // Beyond U+10FFFF
+    }
+  } else {
+    return 0;
+  }
+
+  for (let idx = 1; idx < length; idx++) {
+    const byte = line[start + idx];
+    if (byte === undefined || byte < low || byte > high) {
+      return 0;
+    }
+    [low, high] = [0x80, 0xbf];
+  }
+
+  return length;
+}
+
+// Decodes a line the same way as the Loader. UTF-8 bytes which can't be decoded
+// are replaced as by the Loader's error handler, and Latin-1 characters are all
+// replaced the same way.
+function decodeLine(line: Buffer, encoding?: string): string {
+  if (encoding === LATIN_1) {
+    return line.toString('latin1').replace(/\u00a0/g, ' ').normalize('NFKD');
+  }
+
+  const parts: string[] = [];
+  let runStart = 0;
+  let idx = 0;
+
+  while (idx < line.length) {
+    const length = sequenceLength(line, idx);
+    if (length) {
+      idx += length;
+      continue;
+    }
+
+    // Continuation bytes can't start a sequence, so the bytes of an invalid
+    // sequence are each replaced in turn
+    parts.push(line.toString('utf8', runStart, idx), getReplacement(line[idx]));
+    idx++;
+    runStart = idx;
+  }
+
+  parts.push(line.toString('utf8', runStart));
+  return parts.join('');
+}
+
+export async function readIndexedLines(
+  file: IndexedFile,
+  lineNums: number[]
+): Promise<Map<number, string>> {
+  const lines: Map<number, string> = new Map();
+  if (!file.lineIndex || !lineNums.length) {
+    return lines;
+  }
+
+  const filePath = getLocalFilePath(file);
+  const indexHandle = await fsp.open(filePath + INDEX_SUFFIX, 'r');
+  const fileHandle = await fsp.open(filePath, 'r');
+
+  try {
+    const offsets = Buffer.alloc(OFFSET_SIZE * 2);
+
+    for (const lineNum of lineNums) {
+      const { bytesRead } = await indexHandle.read(
+        offsets, 0, offsets.length, (lineNum - 1) * OFFSET_SIZE);
+      if (lineNum < 1 || bytesRead < offsets.length) {
+        continue;
+      }
+
+      const start = Number(offsets.readBigUInt64LE(0));
+      const end = Number(offsets.readBigUInt64LE(OFFSET_SIZE));
+
+      const line = Buffer.alloc(end - start);
+      await fileHandle.read(line, 0, line.length, start);
+
+      lines.set(lineNum,
+                decodeLine(line, file.encoding).replace(/\r?\n$/, ''));
+    }
+  } finally {
+    await indexHandle.close();
+    await fileHandle.close();
+  }
+
+  return lines;
+}